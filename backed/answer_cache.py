@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def context_fingerprint(contexts):
+    """检索上下文指纹：分块ID由内容哈希派生，同一组分块得到同一指纹"""
+    chunk_ids = sorted(doc.metadata.get("chunk_id", "") for doc in contexts)
+    return hashlib.sha1("\n".join(chunk_ids).encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """语义答案缓存：问题向量相似度 + 检索上下文指纹命中，LRU 淘汰，可选落盘
+
+    写入和失效只标记为脏，由后台线程每隔 flush_interval 秒整体写盘一次，close() 时写入最后的变更
+    """
+
+    def __init__(self, threshold=0.95, maxsize=2000, persist_path=None, flush_interval=30.0):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.persist_path = persist_path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._flusher = None
+        self._entries = OrderedDict()  # 条目ID -> 条目
+        self._by_fingerprint = {}  # 指纹 -> {条目ID}
+        self._next_id = 0
+        self.index_version = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+        if self.persist_path:
+            self._flusher = threading.Thread(target=self._flush_loop, name="answer-cache-flusher", daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def on_index_change(self, index_version):
+        """知识库变化时清空缓存"""
+        if index_version == self.index_version:
+            return
+        with self._lock:
+            self.index_version = index_version
+            self._entries.clear()
+            self._by_fingerprint.clear()
+            self._dirty = True
+        logging.info(f"知识库已更新（版本 {index_version}），答案缓存已清空")
+
+    def lookup(self, embedding, fingerprint):
+        """查找相似问题的缓存答案，未命中返回 None"""
+        with self._lock:
+            entry_ids = list(self._by_fingerprint.get(fingerprint, ()))
+            if entry_ids:
+                matrix = np.stack([self._entries[entry_id]["embedding"] for entry_id in entry_ids])
+                similarities = matrix @ self._normalize(embedding)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id = entry_ids[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    entry = self._entries[entry_id]
+                    logging.info(f"答案缓存命中：相似度 {similarities[best]:.3f}，原问题: {entry['question'][:50]}")
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, question, embedding, fingerprint, answer):
+        with self._lock:
+            self._add_entry({
+                "question": question,
+                "embedding": self._normalize(embedding),
+                "fingerprint": fingerprint,
+                "answer": answer,
+                "created_at": time.time()
+            })
+            self._dirty = True
+
+    def _add_entry(self, entry):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._by_fingerprint.setdefault(entry["fingerprint"], set()).add(entry_id)
+        while len(self._entries) > self.maxsize:
+            old_id, old_entry = self._entries.popitem(last=False)
+            ids = self._by_fingerprint.get(old_entry["fingerprint"])
+            if ids is not None:
+                ids.discard(old_id)
+                if not ids:
+                    del self._by_fingerprint[old_entry["fingerprint"]]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def flush(self):
+        """有未写盘的变更时写入磁盘"""
+        if self._dirty:
+            self._save()
+
+    def close(self):
+        """停止后台写盘线程并写入最后的变更"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _save(self):
+        """原子写入磁盘（未配置路径时跳过）"""
+        if not self.persist_path:
+            return
+        try:
+            with self._lock:
+                self._dirty = False
+                entries = [
+                    {**entry, "embedding": entry["embedding"].tolist()}
+                    for entry in self._entries.values()
+                ]
+            os.makedirs(os.path.dirname(self.persist_path), exist_ok=True)
+            tmp_path = self.persist_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            self._dirty = True  # 下次再试
+            logging.error(f"保存答案缓存失败: {e}")
+
+    def _load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for entry in entries:
+                entry["embedding"] = np.asarray(entry["embedding"], dtype=np.float32)
+                self._add_entry(entry)
+            logging.info(f"答案缓存加载完成，共 {len(self._entries)} 条")
+        except Exception as e:
+            logging.error(f"加载答案缓存失败: {e}")
@@ -12,16 +12,20 @@ from typing import Optional, Union, Literal
 
 import tempfile
 import io
-from fastapi import FastAPI, HTTPException, Depends, Query, Security, Request, File, UploadFile, Body
+from fastapi import FastAPI, HTTPException, Depends, Query, Security, Request, File, UploadFile, Body, BackgroundTasks
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from enhanced_rag import EnhancedRAG
+from llm_worker import QueueFullError
 from auth import Auth
-from constants import HISTORY_LIMIT, KNOWLEDGE_BASE_DIR, MULTILINGUAL_MODEL_NAME
+from database import AsyncDatabase
+from write_behind import WriteBehindQueue
+from constants import (HISTORY_LIMIT, KNOWLEDGE_BASE_DIR, MULTILINGUAL_MODEL_NAME, CONVERSATION_PAGE_SIZE,
+                       MESSAGE_PAGE_SIZE, MAX_PAGE_SIZE)
 from search_engine import SearchEngine
-from knowledge_processor import EnhancedKnowledgeProcessor
+from index_jobs import IndexJobQueue
 from sentence_transformers import SentenceTransformer
 # 初始化模型（建议放在全局）
 sentence_model = SentenceTransformer(MULTILINGUAL_MODEL_NAME)
@@ -44,6 +48,10 @@ app = FastAPI(
 )
 
 auth = Auth()
+# 数据库调用在专用线程池中执行，不阻塞事件循环
+db = AsyncDatabase(auth.db)
+# 问题、参考资料和消息由后台线程批量写入，请求不等待提交
+writer = WriteBehindQueue(auth.db)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -83,6 +91,7 @@ class ChatRequest(BaseModel):
     max_tokens: int = 1024
     temperature: float = 0.6
     stream: bool = False
+    conversation_id: Optional[Union[str, int]] = None  # 多轮对话时复用上一轮的推理状态
 
 class RelatedQuestionsRequest(BaseModel):
     """相关问题请求模型"""
@@ -140,6 +149,39 @@ rag = EnhancedRAG()
 # 初始化搜索引擎
 search_engine = SearchEngine()
 
+# 初始化后台索引任务队列
+index_jobs = IndexJobQueue(rag)
+
+@app.on_event("startup")
+async def start_background_workers():
+    """启动后台任务"""
+    await index_jobs.start()
+    await rag.llm_worker.start()
+    writer.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    """停止推理进程等后台任务"""
+    await rag.llm_worker.stop()
+    await index_jobs.stop()  # 持久化未写盘的索引变更
+    rag.answer_cache.close()  # 写入未落盘的答案缓存
+    writer.stop()  # 写完或落盘队列中的记录
+    db.shutdown()
+    auth.db.close()  # 写回缓冲的 API 密钥使用时间
+
+async def validate_api_key(api_key):
+    """校验 API 密钥：命中缓存时直接返回，未命中才到数据库线程池查询"""
+    user_id = auth.db.cached_user_id(api_key)
+    if user_id is None:
+        user_id = await db.validate_api_key(api_key)
+    return user_id
+
+async def wait_for_writes():
+    """读取会话 / 消息前等待写入队列清空，保证读到刚提交的消息"""
+    if writer.pending_count() and not await db.run(writer.barrier):
+        # 超时后继续读取，结果可能缺少最近的消息
+        logging.warning(f"等待写入队列超时，仍有 {writer.pending_count()} 条记录未写入，读取结果可能不完整")
+
 # 聊天补全接口
 @app.post("/v1/chat/completions")
 async def chat_completions(
@@ -149,7 +191,7 @@ async def chat_completions(
     """处理聊天补全请求（支持流式和非流式）"""
     # 验证和初始化
     logging.info(f"收到请求: model={request.model}, stream={request.stream}")
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
@@ -175,6 +217,9 @@ async def chat_completions(
         if not valid_history or len(valid_history[-1]["content"]) < 1:
             raise HTTPException(status_code=400, detail="无效的问题输入")
 
+        # 对话ID按用户隔离
+        conversation_id = f"{user_id}:{request.conversation_id}" if request.conversation_id else None
+
         # 2. 流式响应处理
         if request.stream:
             async def stream_response():
@@ -182,7 +227,11 @@ async def chat_completions(
                 full_response = ""
                 
                 try:
-                    async for chunk in rag.ask_stream(valid_history[-1]["content"], valid_history):
+                    async for chunk in rag.ask_stream(valid_history[-1]["content"], valid_history, conversation_id):
+                        if isinstance(chunk, dict):
+                            # 具名事件（如参考来源），不带 choices，按 OpenAI 格式解析的客户端会忽略
+                            yield f"event: {chunk['event']}\ndata: {json.dumps(chunk['data'], ensure_ascii=False)}\n\n"
+                            continue
                         response_data = {
                             "id": f"chatcmpl-{int(time.time())}",
                             "object": "chat.completion.chunk",
@@ -229,10 +278,11 @@ async def chat_completions(
         # 3. 非流式响应处理
         else:
             start_time = time.time()
-            response = await rag.ask(valid_history[-1]["content"], valid_history)
+            usage = {}
+            response = await rag.ask(valid_history[-1]["content"], valid_history, conversation_id, usage=usage)
             
-            inputs = rag.tokenizer(rag.last_prompt or "", return_tensors="pt")
-            prompt_tokens = inputs["input_ids"].shape[1]
+            prompt_tokens = usage["prompt_tokens"]
+            completion_tokens = rag.packer.count(response)
             
             logging.info(f"非流式响应 | 耗时: {time.time()-start_time:.2f}s")
             
@@ -250,11 +300,15 @@ async def chat_completions(
                 } ],
                 "usage": {
                     "prompt_tokens": prompt_tokens,
-                    "completion_tokens": len(rag.tokenizer.encode(response)),
-                    "total_tokens": prompt_tokens + len(rag.tokenizer.encode(response))
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
                 }
             }
 
+    except HTTPException:
+        raise
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="当前提问人数较多，请稍后重试", headers={"Retry-After": "5"})
     except Exception as e:
         logging.error(f"请求处理失败：{str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="服务器内部错误")
@@ -269,12 +323,12 @@ async def related_questions(
 ):
     """获取相关问题"""
     # 验证 API 密钥
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
     try:
-        # 调用大模型生成相关问题
+        # 知识库问答对近邻推荐（可选大模型补足）
         related_questions = await rag.generate_related_questions(request.question)
         return {
             "related_questions": related_questions,
@@ -289,12 +343,31 @@ async def related_questions(
             "message": f"获取相关问题时发生错误: {str(e)}"
         }
 
+# 推理队列状态接口
+@app.get("/v1/llm/status")
+async def llm_status(api_key: str = Security(get_api_key)):
+    user_id = await validate_api_key(api_key)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="无效的API密钥")
+    return {"status": "success", "data": {**rag.llm_worker.stats(), "classifier": rag.classifier.stats(),
+                                           "related_questions": rag.related_questions.stats(),
+                                           "prompt": rag.packer.stats(),
+                                           "compression": rag.compressor.stats()}}
+
+# 数据库连接池状态接口
+@app.get("/v1/db/status")
+async def db_status(api_key: str = Security(get_api_key)):
+    user_id = await validate_api_key(api_key)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="无效的API密钥")
+    return {"status": "success", "data": {**auth.db.stats(), "write_behind": writer.stats()}}
+
 # 登录接口
 @app.post("/auth")
 async def authenticate_user(request: LoginRequest):
     """用户登录"""
     try:
-        status, result = auth.login_user(request.username, request.password)
+        status, result = await db.run(auth.login_user, request.username, request.password)
         if not status:
             return JSONResponse(
                 status_code=401,
@@ -325,7 +398,8 @@ async def authenticate_user(request: LoginRequest):
 async def register_user(request: RegisterRequest):
     """用户注册"""
     try:
-        status, result = auth.register_user(
+        status, result = await db.run(
+            auth.register_user,
             request.username,
             request.password,
             request.email
@@ -356,12 +430,12 @@ async def create_conversation(
     api_key: str = Security(get_api_key)
 ):
     """创建新会话"""
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(401, "无效的API密钥")
 
     try:
-        conv_id = auth.db.create_conversation(user_id, request.title)
+        conv_id = await db.create_conversation(user_id, request.title)
         return {"conversation_id": conv_id}
     except Exception as e:
         logging.error(f"创建会话失败: {str(e)}")
@@ -369,30 +443,24 @@ async def create_conversation(
 
 # 获取用户所有会话接口
 @app.get("/conversations",
-         summary="获取用户的所有会话",
-         response_description="返回用户的所有会话列表，包含会话标题、ID 和消息记录")
+         summary="分页获取用户的会话",
+         response_description="返回一页会话（标题、ID、创建时间、最后一条消息预览）和下一页游标")
 async def get_all_conversations(
+    limit: int = Query(CONVERSATION_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
     api_key: str = Security(get_api_key)
 ):
-    """获取用户的所有会话"""
-    user_id = auth.db.validate_api_key(api_key)
+    """按创建时间倒序分页获取会话，消息通过 /conversations/{id}/messages 单独获取"""
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(401, "无效的API密钥")
 
     try:
-        # 获取用户的所有会话
-        conversations = auth.db.get_conversations(user_id)
-        result = []
-        for conversation in conversations:
-            conversation_id = conversation['id']
-            # 获取每个会话的消息
-            messages = auth.db.get_messages(conversation_id)
-            result.append({
-                "title": conversation['title'],
-                "messages": messages,
-                "conversation_id": conversation_id
-            })
-        return result
+        await wait_for_writes()
+        conversations, next_cursor = await db.list_conversations(user_id, limit, cursor)
+        return {"conversations": conversations, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     except Exception as e:
         logging.error(f"获取会话列表失败: {str(e)}")
         raise HTTPException(500, "服务器内部错误")
@@ -401,26 +469,30 @@ async def get_all_conversations(
 @app.get("/conversations/{conversation_id}/messages")
 async def get_conversation_messages(
     conversation_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页条数；不传时返回全部消息"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，用于获取更早的消息"),
     api_key: str = Security(get_api_key)
 ):
-    """获取会话消息"""
-    user_id = auth.db.validate_api_key(api_key)
+    """获取会话消息；传 limit 时从最新消息往前分页"""
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
-    cursor = auth.db.connection.cursor()
-    try:
-        cursor.execute("SELECT user_id FROM conversations WHERE id = %s", (conversation_id,))
-        result = cursor.fetchone()
-        if not result:
-            raise HTTPException(status_code=404, detail="会话不存在")
-        if result[0] != user_id:
-            raise HTTPException(status_code=403, detail="无权限访问该会话")
-
-        messages = auth.db.get_messages(conversation_id)
+    owner_id = await db.get_conversation_owner(conversation_id)
+    if owner_id is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    if owner_id != user_id:
+        raise HTTPException(status_code=403, detail="无权限访问该会话")
+
+    await wait_for_writes()
+    if limit is None and cursor is None:
+        messages = await db.get_messages(conversation_id)
         return {"messages": messages}
-    finally:
-        cursor.close()
+    try:
+        messages, next_cursor = await db.list_messages(conversation_id, limit or MESSAGE_PAGE_SIZE, cursor)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"messages": messages, "next_cursor": next_cursor}
 
 # 创建会话消息接口
 @app.post("/conversations/{conversation_id}/messages")
@@ -430,23 +502,17 @@ async def create_message(
     api_key: str = Security(get_api_key)
 ):
     """创建会话消息"""
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(401, "无效的API密钥")
 
     # 验证会话归属
-    cursor = auth.db.connection.cursor()
-    try:
-        cursor.execute("SELECT user_id FROM conversations WHERE id = %s", (conversation_id,))
-        result = cursor.fetchone()
-        if not result or result[0] != user_id:
-            raise HTTPException(403, "无权限操作此会话")
+    if await db.get_conversation_owner(conversation_id) != user_id:
+        raise HTTPException(403, "无权限操作此会话")
 
-        # 保存消息到数据库
-        message_id = auth.db.add_message(conversation_id, request.role, request.content)
-        return {"message_id": message_id}
-    finally:
-        cursor.close()
+    # 消息进入批量写入队列，同一会话的读接口会先等待写入完成
+    writer.enqueue_message(conversation_id, request.role, request.content)
+    return {"status": "queued"}
 
 # 更新会话接口
 @app.patch("/conversations/{conversation_id}",
@@ -458,29 +524,23 @@ async def update_conversation(
     api_key: str = Security(get_api_key)
 ):
     """更新会话信息"""
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(401, "无效的API密钥")
 
-    cursor = auth.db.connection.cursor()
     try:
         # 验证会话归属
-        cursor.execute("SELECT user_id FROM conversations WHERE id = %s", (conversation_id,))
-        result = cursor.fetchone()
-        if not result or result[0] != user_id:
+        if await db.get_conversation_owner(conversation_id) != user_id:
             raise HTTPException(403, "无权限操作此会话")
 
         # 更新标题
-        update_query = "UPDATE conversations SET title = %s WHERE id = %s"
-        cursor.execute(update_query, (request.title, conversation_id))
-        auth.db.connection.commit()
+        await db.update_conversation_title(conversation_id, request.title)
         return {"status": "success", "message": "会话更新成功"}
+    except HTTPException:
+        raise
     except Exception as e:
-        auth.db.connection.rollback()
         logging.error(f"更新会话失败: {str(e)}")
         raise HTTPException(500, "服务器内部错误")
-    finally:
-        cursor.close()
 
 # 删除会话接口
 @app.delete("/conversations/{conversation_id}",
@@ -491,30 +551,24 @@ async def delete_conversation(
     api_key: str = Security(get_api_key)
 ):
     """删除会话"""
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(401, "无效的API密钥")
 
-    cursor = auth.db.connection.cursor()
     try:
         # 验证会话归属
-        cursor.execute("SELECT user_id FROM conversations WHERE id = %s", (conversation_id,))
-        result = cursor.fetchone()
-        if not result or result[0] != user_id:
+        if await db.get_conversation_owner(conversation_id) != user_id:
             raise HTTPException(403, "无权限操作此会话")
 
-        # 删除关联消息
-        cursor.execute("DELETE FROM messages WHERE conversation_id = %s", (conversation_id,))
-        # 删除会话
-        cursor.execute("DELETE FROM conversations WHERE id = %s", (conversation_id,))
-        auth.db.connection.commit()
+        # 删除关联消息和会话（同一事务）；先等待队列中该会话的消息写入，避免删除后再写入失败
+        await wait_for_writes()
+        await db.delete_conversation(conversation_id)
         return {"status": "success", "message": "会话删除成功"}
+    except HTTPException:
+        raise
     except Exception as e:
-        auth.db.connection.rollback()
         logging.error(f"删除会话失败: {str(e)}")
         raise HTTPException(500, "服务器内部错误")
-    finally:
-        cursor.close()
 
 # 管理API密钥接口
 @app.get("/api-keys",
@@ -526,13 +580,13 @@ async def manage_api_keys(
     api_key: str = Security(get_api_key)
 ):
     """管理API密钥"""
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
     # GET 请求：返回所有密钥
     if not request:
-        keys = auth.db.get_all_api_keys(user_id)
+        keys = await db.get_all_api_keys(user_id)
         formatted_keys = [ {
             "id": f"key_{idx}",
             "user_id": user_id,
@@ -544,7 +598,7 @@ async def manage_api_keys(
 
     # POST 请求：创建密钥
     if request.action == "create":
-        new_key = auth.generate_api_key(user_id)
+        new_key = await db.generate_api_key(user_id)
         return {
             "status": "success",
             "message": "密钥生成成功",
@@ -555,7 +609,7 @@ async def manage_api_keys(
             }
         }
     elif request.action == "revoke" and request.key:
-        success = auth.db.delete_api_key(user_id, request.key)
+        success = await db.delete_api_key(user_id, request.key)
         return {
             "status": "success" if success else "error",
             "message": "密钥已删除" if success else "删除失败"
@@ -571,7 +625,7 @@ async def reference_files(
     api_key: str = Security(get_api_key)
 ):
     """检索参考文件"""
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
     
@@ -622,7 +676,7 @@ async def reference_files(
         
         # 如果提供了问题ID，保存参考资料到数据库
         if question_id and knowledge_files:
-            auth.db.save_reference_files(question_id, knowledge_files)
+            writer.enqueue_reference_files(question_id, knowledge_files)
         
         return {
             "status": "success",
@@ -647,7 +701,7 @@ async def download_file(
     try:
         # 验证token
         token = credentials.credentials
-        if not auth.db.validate_api_key(token):
+        if not await validate_api_key(token):
             raise HTTPException(status_code=401, detail="Invalid API key")
         
         # 清理文件路径，只保留文件名
@@ -694,10 +748,11 @@ async def download_file(
           response_description="返回生成的问题ID")
 async def save_question(
     request: QuestionRequest,
+    background_tasks: BackgroundTasks,
     api_key: str = Security(get_api_key)
 ):
     """保存问题并获取问题ID"""
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
     
@@ -705,42 +760,16 @@ async def save_question(
         # 生成唯一的问题ID
         question_id = str(uuid.uuid4())
         
-        # 保存问题到数据库
-        success = auth.db.save_question(
+        # 问题进入批量写入队列（数据库不可用时落盘到问题缓存目录，恢复后重放）
+        writer.enqueue_question(
             question_id=question_id,
             user_id=user_id,
             content=request.content,
             conversation_id=request.conversation_id
         )
-        
-        if not success:
-            # 如果数据库保存失败，尝试保存到文件系统作为备份
-            cache_dir = Path("question_cache")
-            cache_dir.mkdir(exist_ok=True)
-            
-            with open(cache_dir / f"{question_id}.json", "w", encoding="utf-8") as f:
-                json.dump({
-                    "user_id": user_id,
-                    "content": request.content,
-                    "conversation_id": request.conversation_id,
-                    "timestamp": time.time()
-                }, f, ensure_ascii=False)
-            
-            logging.warning(f"问题保存到数据库失败，已保存到文件系统: {question_id}")
-        else:
-            logging.info(f"问题已保存到数据库: {question_id}")
-            
-            # 执行搜索并保存参考资料
-            try:
-                # 使用搜索引擎搜索相关资料
-                search_results = await search_engine.search(request.content, max_results=5)
-                
-                if search_results:
-                    # 保存参考资料到数据库
-                    auth.db.save_reference_files(question_id, search_results)
-                    logging.info(f"参考资料已保存到数据库: {question_id}")
-            except Exception as search_error:
-                logging.error(f"搜索和保存参考资料失败: {str(search_error)}")
+
+        # 搜索参考资料在响应返回后执行
+        background_tasks.add_task(enrich_question_references, question_id, request.content)
         
         return {
             "question_id": question_id,
@@ -752,6 +781,17 @@ async def save_question(
 
 
 
+async def enrich_question_references(question_id, content):
+    """后台任务：搜索相关资料并写入参考资料"""
+    try:
+        search_results = await search_engine.search(content, max_results=5)
+        if search_results:
+            writer.enqueue_reference_files(question_id, search_results)
+            logging.info(f"参考资料已加入写入队列: {question_id}")
+    except Exception as e:
+        logging.error(f"搜索和保存参考资料失败: {str(e)}")
+
+
 #/*************************更新*************************/
 
 # 新增用户知识库目录基础路径
@@ -763,7 +803,7 @@ async def get_user_document(
     filename: str,
     api_key: str = Security(get_api_key)
 ):
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
@@ -791,7 +831,7 @@ async def upload_user_document(
     file: UploadFile = File(...),
     api_key: str = Security(get_api_key)
 ):
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
@@ -824,17 +864,16 @@ async def upload_user_document(
             content = await file.read()
             f.write(content)
         file_size = os.path.getsize(file_path)
-        success = auth.db.save_user_document(user_id, file.filename, file_path, file_ext, file_size)
+        success = await db.save_user_document(user_id, file.filename, file_path, file_ext, file_size)
 
         if not success:
             os.remove(file_path)  # 如果数据库保存失败，删除已上传的文件
             raise HTTPException(status_code=500, detail="保存文件记录失败")
 
-        # 重新加载用户知识库
-        rag.processor = EnhancedKnowledgeProcessor()
-        rag.chunks = rag.processor.process_documents()
+        # 提交后台索引任务
+        job = index_jobs.submit("upsert", file_path, user_id)
         
-        return {"status": "success", "message": "文件上传成功"}
+        return {"status": "success", "message": "文件上传成功", "job_id": job.job_id}
     except HTTPException:
         raise
     except Exception as e:
@@ -851,13 +890,13 @@ async def list_user_documents(
     page_size: int = Query(10, ge=1, le=100),
     api_key: str = Security(get_api_key)
 ):
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
     
     try:
         # 从数据库获取文档列表
-        docs = auth.db.get_user_documents(user_id)
+        docs = await db.get_user_documents(user_id)
         
         # 转换为前端需要的格式
         documents = []
@@ -897,7 +936,7 @@ async def update_user_document(
     content: str = Body(..., embed=True, description="新文件内容"),
     api_key: str = Security(get_api_key)
 ):
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
@@ -927,11 +966,10 @@ async def update_user_document(
         with open(file_path, "w", encoding="utf-8") as f:
             f.write(content)
 
-        # 重新加载知识库
-        rag.processor = EnhancedKnowledgeProcessor()
-        rag.chunks = rag.processor.process_documents()
+        # 提交后台索引任务
+        job = index_jobs.submit("upsert", file_path, user_id)
         
-        return {"status": "success", "message": "文件更新成功"}
+        return {"status": "success", "message": "文件更新成功", "job_id": job.job_id}
     
     except HTTPException as he:
         raise he
@@ -945,16 +983,13 @@ async def delete_user_document(
     doc_id: int,
     api_key: str = Security(get_api_key)
 ):
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(401, "无效的API密钥")
 
     try:
         # 先获取文件信息
-        cursor = auth.db.connection.cursor(dictionary=True)
-        cursor.execute("SELECT file_name, file_path FROM user_documents WHERE id = %s AND user_id = %s", 
-                      (doc_id, user_id))
-        doc = cursor.fetchone()
+        doc = await db.get_user_document(doc_id, user_id)
         
         if not doc:
             raise HTTPException(404, "文档不存在或无权访问")
@@ -964,23 +999,34 @@ async def delete_user_document(
             os.remove(doc['file_path'])
         
         # 删除数据库记录
-        cursor.execute("DELETE FROM user_documents WHERE id = %s AND user_id = %s", 
-                      (doc_id, user_id))
-        auth.db.connection.commit()
+        await db.delete_user_document(doc_id, user_id)
         
-        # 重新加载知识库
-        rag.processor = EnhancedKnowledgeProcessor()
-        rag.chunks = rag.processor.process_documents()
+        # 提交后台索引任务
+        job = index_jobs.submit("delete", doc['file_path'], user_id)
         
-        return {"status": "success", "message": "文件删除成功"}
+        return {"status": "success", "message": "文件删除成功", "job_id": job.job_id}
     except HTTPException:
         raise
     except Exception as e:
-        auth.db.connection.rollback()
         logging.error(f"删除用户文件失败: {str(e)}")
         raise HTTPException(500, detail=f"删除失败: {str(e)}")
-    finally:
-        cursor.close()
+
+
+# 查询索引任务状态接口
+@app.get("/user-knowledge/jobs/{job_id}")
+async def get_index_job(
+    job_id: str,
+    api_key: str = Security(get_api_key)
+):
+    user_id = await validate_api_key(api_key)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="无效的API密钥")
+
+    job = index_jobs.get(job_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    return {"status": "success", "data": {**job.to_dict(), "queue_size": index_jobs.pending_count()}}
 
 
 # 修改后的下载接口
@@ -989,7 +1035,7 @@ async def download_user_document(
     filename: str,
     api_key: str = Security(get_api_key)
 ):
-    user_id = auth.db.validate_api_key(api_key)
+    user_id = await validate_api_key(api_key)
     if not user_id:
         raise HTTPException(status_code=401, detail="无效的API密钥")
 
@@ -1,12 +1,10 @@
 from database import Database
 import hashlib
-import secrets
-from datetime import datetime  # 确保导入 datetime
 
 class Auth:
     def __init__(self):
         self.db = Database()
-        if not self.db.connection:
+        if self.db.pool is None:
             print("数据库连接失败，请检查配置。")
             raise ConnectionError("数据库连接失败，请检查配置。")
 
@@ -35,45 +33,10 @@ class Auth:
         return False, "用户名或密码错误"
 
     def generate_api_key(self, user_id):
-        api_key = secrets.token_hex(32)
-        cursor = self.db.connection.cursor()
-        query = "INSERT INTO api_keys (user_id, api_key) VALUES (%s, %s)"
-        cursor.execute(query, (user_id, api_key))
-        self.db.connection.commit()
-        cursor.close()
-        return api_key
+        return self.db.generate_api_key(user_id)
 
     def get_api_key(self, user_id):
-        cursor = self.db.connection.cursor()
-        query = "SELECT api_key FROM api_keys WHERE user_id = %s ORDER BY created_at DESC LIMIT 1"
-        cursor.execute(query, (user_id,))
-        result = cursor.fetchone()
-        cursor.close()
-        if result:
-            return result[0]
-        return None
+        return self.db.get_api_key(user_id)
 
     def validate_api_key(self, api_key):
-        cursor = self.db.connection.cursor(dictionary=True)
-        query = """
-        SELECT ak.user_id, ak.api_key, ak.last_used 
-        FROM api_keys ak
-        JOIN users u ON ak.user_id = u.id
-        WHERE ak.api_key = %s
-        """
-        cursor.execute(query, (api_key,))
-        result = cursor.fetchone()
-        cursor.close()
-
-        if result:
-            # 更新最后使用时间
-            cursor = self.db.connection.cursor()
-            update_query = "UPDATE api_keys SET last_used = %s WHERE api_key = %s"
-            cursor.execute(update_query, (datetime.now(), api_key))
-            self.db.connection.commit()
-            cursor.close()
-
-            return result['user_id']
-        return None
-
-
+        return self.db.validate_api_key(api_key)
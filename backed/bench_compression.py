@@ -0,0 +1,116 @@
+"""参考知识压缩基准测试
+
+对评测集中的每个问题执行检索，分别以不压缩和若干压缩比例组装提示词，统计提示词 token 数和压缩耗时；
+指定 --generate 时再用主模型贪心生成回答，统计首 token 延迟（预填充），并用 bge 向量余弦相似度衡量回答质量：
+有参考答案时与参考答案比较，否则与不压缩时的回答比较。
+
+评测集为 JSONL，每行 {"question": ..., "reference": 可选参考答案}；未指定时使用内置问题。
+
+用法：
+    python bench_compression.py --eval-file eval.jsonl --ratios 0.3 0.5 0.7 --generate --threads 10
+"""
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from knowledge_processor import EnhancedKnowledgeProcessor
+from hybrid_retriever import HybridRetriever
+from context_compressor import ContextCompressor
+from prompt_packer import PromptPacker
+from prompt_templates import build_prompt
+from constants import RETRIEVAL_TOP_K
+
+DEFAULT_QUESTIONS = [
+    "求函数 f(x)=x^3-3x 的极值",
+    "如何计算矩阵的特征值",
+    "已知等差数列前n项和，求通项公式",
+    "二次函数的顶点坐标怎么求",
+    "计算定积分 \\int_0^1 x^2 dx",
+    "什么是条件概率",
+    "三角形内角和为什么是180度",
+    "求解一元二次方程 x^2-5x+6=0",
+]
+
+
+def load_samples(path):
+    if not path:
+        return [{"question": question} for question in DEFAULT_QUESTIONS]
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def cosine(embed, a, b):
+    va, vb = np.asarray(embed([a, b]), dtype=np.float32)
+    return float(va @ vb / max(np.linalg.norm(va) * np.linalg.norm(vb), 1e-12))
+
+
+def generate(engine, prompt, max_tokens):
+    engine.llm.reset()
+    start = time.perf_counter()
+    first_token = None
+    parts = []
+    for chunk in engine.stream({"prompt": prompt, "max_tokens": max_tokens, "temperature": 0.0,
+                                "stop": ["</s>", "[INST]"]}):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        parts.append(chunk["choices"][0]["text"])
+    return "".join(parts), (first_token or 0.0) * 1000
+
+
+def main(args):
+    processor = EnhancedKnowledgeProcessor()
+    retriever = HybridRetriever(processor.process_documents())
+    packer = PromptPacker(cache_path=None)
+    compressor = ContextCompressor(retriever.embed_query, retriever.embedding_model.embed_documents)
+    embed = retriever.embedding_model.embed_documents
+    engine = None
+    if args.generate:
+        from llm_engine import LlamaEngine, build_llama
+        engine = LlamaEngine(build_llama(n_threads=args.threads, n_gpu_layers=args.gpu_layers),
+                             prefix_cache_bytes=0, conversation_cache_bytes=0)
+
+    samples = load_samples(args.eval_file)
+    ratios = [1.0] + sorted(args.ratios)
+    rows = {ratio: {"tokens": [], "compress_ms": [], "ttft_ms": [], "quality": []} for ratio in ratios}
+    baseline_answers = {}
+    for sample in samples:
+        question = sample["question"]
+        contexts = asyncio.run(retriever.retrieve(question, top_k=RETRIEVAL_TOP_K))
+        for ratio in ratios:
+            start = time.perf_counter()
+            compressed = compressor.compress(question, contexts, ratio=ratio)
+            compress_ms = (time.perf_counter() - start) * 1000
+            budget = packer.prompt_budget - packer.count(build_prompt(question, "", "", True))
+            context_str, _ = packer.pack_context(compressed, budget)
+            prompt = build_prompt(question, history="无近期对话", context=context_str, is_math=True)
+            rows[ratio]["tokens"].append(packer.count(prompt))
+            rows[ratio]["compress_ms"].append(compress_ms)
+            if engine is None:
+                continue
+            answer, ttft = generate(engine, prompt, args.max_tokens)
+            rows[ratio]["ttft_ms"].append(ttft)
+            if ratio == 1.0:
+                baseline_answers[question] = answer
+            reference = sample.get("reference") or baseline_answers[question]
+            rows[ratio]["quality"].append(cosine(embed, answer, reference))
+
+    baseline_tokens = np.mean(rows[1.0]["tokens"])
+    print(f"\n{'保留比例':>8} {'提示词tokens':>12} {'减少':>7} {'压缩(ms)':>9} {'首token(ms)':>11} {'回答相似度':>10}")
+    for ratio, row in rows.items():
+        tokens = np.mean(row["tokens"])
+        ttft = f"{np.mean(row['ttft_ms']):>11.0f}" if row["ttft_ms"] else f"{'-':>11}"
+        quality = f"{np.mean(row['quality']):>10.3f}" if row["quality"] else f"{'-':>10}"
+        print(f"{ratio:>8.2f} {tokens:>12.0f} {1 - tokens / baseline_tokens:>7.1%} "
+              f"{np.mean(row['compress_ms']):>9.1f} {ttft} {quality}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="参考知识压缩基准")
+    parser.add_argument("--eval-file", default=None)
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.3, 0.5, 0.7])
+    parser.add_argument("--generate", action="store_true", help="生成回答并评估首 token 延迟和回答质量")
+    parser.add_argument("--threads", type=int, default=10)
+    parser.add_argument("--gpu-layers", type=int, default=0)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    main(parser.parse_args())
@@ -0,0 +1,129 @@
+"""会话列表分页基准测试
+
+在配置的数据库（DB_HOST / DB_NAME 等环境变量）中创建一个基准用户，写入指定数量的会话和消息，
+对比旧接口的逐会话取消息（N+1 查询，返回全部消息）与键集分页列表（单条查询，只带最后一条消息预览）
+的耗时、查询次数和响应体大小，并测量翻到最后一页和消息分页的延迟。结束后默认删除写入的数据。
+
+用法：
+    python bench_conversations.py --conversations 10000 --messages 10 --page-size 30
+"""
+import json
+import time
+import uuid
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+from database import Database
+
+
+INSERT_MESSAGE = "INSERT INTO messages (conversation_id, role, content) VALUES (%s, %s, %s)"
+
+
+def seed(db, args):
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    user_id = db.create_user(username, "bench", f"{username}@bench.local")
+    start = datetime.now() - timedelta(minutes=args.conversations)
+    db.execute_many("seed_conversations",
+                    "INSERT INTO conversations (user_id, title, created_at) VALUES (%s, %s, %s)",
+                    [(user_id, f"会话 {i}", start + timedelta(minutes=i)) for i in range(args.conversations)])
+    conversation_ids = [row[0] for row in db.fetch_all(
+        "seed_conversations", "SELECT id FROM conversations WHERE user_id = %s", (user_id,))]
+
+    rows = []
+    for conversation_id in conversation_ids:
+        for j in range(args.messages):
+            content = f"第 {j} 条消息：" + "求函数 f(x)=x^3-3x 的极值。" * args.message_repeat
+            rows.append((conversation_id, "user" if j % 2 == 0 else "assistant", content))
+            if len(rows) >= args.batch_size:
+                db.execute_many("seed_messages", INSERT_MESSAGE, rows)
+                rows = []
+    if rows:
+        db.execute_many("seed_messages", INSERT_MESSAGE, rows)
+    return user_id, conversation_ids
+
+
+def cleanup(db, user_id):
+    db.transaction("cleanup", [
+        ("DELETE m FROM messages m JOIN conversations c ON m.conversation_id = c.id WHERE c.user_id = %s", (user_id,)),
+        ("DELETE FROM conversations WHERE user_id = %s", (user_id,)),
+        ("DELETE FROM users WHERE id = %s", (user_id,))
+    ])
+
+
+def payload_size(data):
+    return len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def legacy_listing(db, user_id):
+    """旧 /conversations：取全部会话，再逐个会话取全部消息"""
+    conversations = db.get_conversations(user_id)
+    result = [{"title": c["title"], "messages": db.get_messages(c["id"]), "conversation_id": c["id"]}
+              for c in conversations]
+    return result, 1 + len(conversations)
+
+
+def timed(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, np.array(times)
+
+
+def main(args):
+    db = Database()
+    if db.pool is None:
+        raise SystemExit("数据库连接失败")
+    print(f"写入 {args.conversations} 个会话，每个 {args.messages} 条消息 ...")
+    start = time.perf_counter()
+    user_id, conversation_ids = seed(db, args)
+    print(f"写入完成，用时 {time.perf_counter() - start:.1f}s")
+
+    try:
+        rows = []
+        if not args.skip_legacy:
+            (legacy, queries), times = timed(lambda: legacy_listing(db, user_id), 1)
+            rows.append(("旧接口（全部会话+消息）", queries, times, payload_size(legacy)))
+
+        (page, _), times = timed(lambda: db.list_conversations(user_id, args.page_size), args.repeat)
+        rows.append((f"分页列表 第1页（{args.page_size}条）", 1, times, payload_size(page)))
+
+        # 翻到最后一页：逐页跟随游标
+        def walk():
+            cursor, pages = None, 0
+            while True:
+                _, cursor = db.list_conversations(user_id, args.page_size, cursor)
+                pages += 1
+                if cursor is None:
+                    return pages
+        pages, times = timed(walk, 1)
+        rows.append((f"分页列表 翻完全部（{pages}页）", pages, times / pages, None))
+
+        (messages, _), times = timed(lambda: db.list_messages(conversation_ids[-1], args.page_size), args.repeat)
+        rows.append((f"消息分页 第1页（{args.page_size}条）", 1, times, payload_size(messages)))
+
+        print(f"\n{'场景':<28} {'查询数':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'响应大小':>12}")
+        for name, queries, times, size in rows:
+            size = f"{size / 1024:>10.1f}KB" if size is not None else f"{'-':>12}"
+            print(f"{name:<28} {queries:>8} {np.percentile(times, 50):>9.1f} {np.percentile(times, 95):>9.1f} {size}")
+    finally:
+        if args.keep:
+            print(f"保留基准数据，用户ID {user_id}")
+        else:
+            cleanup(db, user_id)
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会话列表分页基准")
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=10, help="每个会话的消息数")
+    parser.add_argument("--message-repeat", type=int, default=10, help="控制单条消息长度")
+    parser.add_argument("--page-size", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--skip-legacy", action="store_true", help="跳过旧接口（会话很多时很慢）")
+    parser.add_argument("--keep", action="store_true", help="保留写入的基准数据")
+    main(parser.parse_args())
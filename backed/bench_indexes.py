@@ -0,0 +1,151 @@
+"""表结构迁移（索引）基准测试
+
+新建一个独立的基准库（默认 {DB_NAME}_index_bench），用 _init_tables 建出未迁移的表，写入有代表性
+数量的用户、API 密钥、用户文档、问题 / 参考资料、会话 / 消息，然后对 migrations.HOT_QUERIES 中的热点查询
+分别在迁移前后用随机参数执行多次，报告 p50 / p95 延迟和 EXPLAIN 使用的索引。结束后默认删除基准库。
+
+用法：
+    python bench_indexes.py --users 2000 --conversations 20000 --messages 10 --questions 50000 --repeat 200
+"""
+import os
+import time
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import mysql.connector
+import migrations
+
+
+def connect_server():
+    return mysql.connector.connect(host=os.getenv('DB_HOST', 'localhost'), user=os.getenv('DB_USER', 'root'),
+                                   password=os.getenv('DB_PASSWORD', 'root'))
+
+
+def insert_chunks(db, name, query, rows, chunk_size):
+    for i in range(0, len(rows), chunk_size):
+        db.execute_many(name, query, rows[i:i + chunk_size])
+
+
+def seed(db, args, rng):
+    """写入基准数据，返回用于生成查询参数的样本"""
+    base = datetime.now() - timedelta(days=365)
+
+    def stamp():
+        return base + timedelta(seconds=rng.randrange(365 * 86400))
+
+    insert_chunks(db, "seed", "INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s)",
+                  [(f"bench_{i}", "x" * 64, f"bench_{i}@bench.local") for i in range(args.users)], args.chunk_size)
+    user_ids = [row[0] for row in db.fetch_all("seed", "SELECT id FROM users")]
+
+    insert_chunks(db, "seed", "INSERT INTO api_keys (user_id, api_key, created_at) VALUES (%s, %s, %s)",
+                  [(user_id, uuid.uuid4().hex + uuid.uuid4().hex, stamp())
+                   for user_id in user_ids for _ in range(args.keys_per_user)], args.chunk_size)
+
+    documents = [(user_id, f"doc_{j}.pdf", f"/data/{user_id}/doc_{j}.pdf", "pdf", 1024, stamp())
+                 for user_id in user_ids for j in range(args.documents_per_user)]
+    insert_chunks(db, "seed", "INSERT INTO user_documents (user_id, file_name, file_path, file_type, file_size, "
+                  "created_at) VALUES (%s, %s, %s, %s, %s, %s)", documents, args.chunk_size)
+
+    question_ids = [str(uuid.uuid4()) for _ in range(args.questions)]
+    insert_chunks(db, "seed", "INSERT INTO questions (id, user_id, content, created_at) VALUES (%s, %s, %s, %s)",
+                  [(qid, rng.choice(user_ids), "求函数 f(x)=x^3-3x 的极值", stamp()) for qid in question_ids],
+                  args.chunk_size)
+    insert_chunks(db, "seed", "INSERT INTO reference_files (question_id, file_name, file_path, file_type, "
+                  "description, similarity, source) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                  [(qid, f"ref_{j}.pdf", f"ref_{j}.pdf", "pdf", "本地知识库文件", rng.random(), "local")
+                   for qid in question_ids for j in range(args.refs_per_question)], args.chunk_size)
+
+    insert_chunks(db, "seed", "INSERT INTO conversations (user_id, title, created_at) VALUES (%s, %s, %s)",
+                  [(rng.choice(user_ids), "会话", stamp()) for _ in range(args.conversations)], args.chunk_size)
+    conversation_ids = [row[0] for row in db.fetch_all("seed", "SELECT id FROM conversations")]
+    messages = [(cid, "user" if j % 2 == 0 else "assistant", "求函数 f(x)=x^3-3x 的极值。" * 10,
+                 base + timedelta(minutes=j)) for cid in conversation_ids for j in range(args.messages)]
+    rng.shuffle(messages)  # 不同会话的消息交错写入，接近真实分布
+    insert_chunks(db, "seed", "INSERT INTO messages (conversation_id, role, content, timestamp) "
+                  "VALUES (%s, %s, %s, %s)", messages, args.chunk_size)
+    return {"user_ids": user_ids, "question_ids": question_ids, "conversation_ids": conversation_ids,
+            "file_names": [f"doc_{j}.pdf" for j in range(args.documents_per_user)]}
+
+
+def query_params(name, samples, rng):
+    """为热点查询生成随机但命中数据的参数"""
+    if name == "find_user_document":
+        return rng.choice(samples["user_ids"]), rng.choice(samples["file_names"])
+    if name == "get_reference_files":
+        return (rng.choice(samples["question_ids"]),)
+    if name in ("get_messages", "list_messages"):
+        return (rng.choice(samples["conversation_ids"]),)
+    return (rng.choice(samples["user_ids"]),)
+
+
+def measure(db, samples, args):
+    # 更新索引统计信息，避免优化器按过期的统计选择执行计划
+    db.fetch_all("analyze", "ANALYZE TABLE api_keys, user_documents, reference_files, conversations, messages")
+    plans = {row["query"]: row for row in migrations.check_plans(db)}
+    results = {}
+    rng = random.Random(args.seed + 1)  # 迁移前后使用相同的参数序列
+    for name, query, _, _ in migrations.HOT_QUERIES:
+        times = []
+        for _ in range(args.repeat):
+            params = query_params(name, samples, rng)
+            start = time.perf_counter()
+            db.fetch_all(name, query, params)
+            times.append((time.perf_counter() - start) * 1000)
+        results[name] = (np.array(times), plans[name].get("key"))
+    return results
+
+
+def main(args):
+    bench_db = args.database or f"{os.getenv('DB_NAME', 'cs')}_index_bench"
+    server = connect_server()
+    cursor = server.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{bench_db}`")
+    cursor.execute(f"CREATE DATABASE `{bench_db}` CHARACTER SET utf8mb4")
+    os.environ["DB_NAME"] = bench_db
+    from database import Database  # 读取 DB_NAME 之后再建连接池
+    db = Database(migrate=False)
+    try:
+        rng = random.Random(args.seed)
+        start = time.perf_counter()
+        samples = seed(db, args, rng)
+        print(f"基准库 {bench_db} 写入完成，用时 {time.perf_counter() - start:.1f}s")
+
+        before = measure(db, samples, args)
+        start = time.perf_counter()
+        applied = migrations.migrate(db)
+        print(f"应用迁移 {applied}，用时 {time.perf_counter() - start:.1f}s")
+        after = measure(db, samples, args)
+
+        print(f"\n{'查询':<20} {'迁移前 p50':>10} {'p95':>8} {'迁移后 p50':>10} {'p95':>8} {'加速比':>7}  索引（前 -> 后）")
+        for name, _, _, _ in migrations.HOT_QUERIES:
+            (t0, key0), (t1, key1) = before[name], after[name]
+            p50_before, p50_after = np.percentile(t0, 50), np.percentile(t1, 50)
+            print(f"{name:<20} {p50_before:>10.2f} {np.percentile(t0, 95):>8.2f} {p50_after:>10.2f} "
+                  f"{np.percentile(t1, 95):>8.2f} {p50_before / max(p50_after, 1e-6):>7.1f}  {key0} -> {key1}")
+    finally:
+        db.close()
+        if args.keep:
+            print(f"保留基准库 {bench_db}")
+        else:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{bench_db}`")
+        cursor.close()
+        server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="表结构迁移（索引）基准")
+    parser.add_argument("--database", default=None, help="基准库名，默认 {DB_NAME}_index_bench")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--keys-per-user", type=int, default=3)
+    parser.add_argument("--documents-per-user", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=50000)
+    parser.add_argument("--refs-per-question", type=int, default=5)
+    parser.add_argument("--conversations", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=10, help="每个会话的消息数")
+    parser.add_argument("--repeat", type=int, default=200, help="每条查询在迁移前后各执行的次数")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="保留基准库")
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""推理进程池吞吐基准测试
+
+在 CPU 主机上依次以不同进程数启动 LLMProcessPool（总核心数在进程间均分），
+并发提交一批生成请求，统计聚合 token/s、单请求延迟和首 token 延迟。
+
+用法：
+    python bench_llm_pool.py --sizes 1 2 4 8 --cores 32 --requests 32 --max-tokens 128
+"""
+import time
+import asyncio
+import argparse
+import numpy as np
+from llm_pool import LLMProcessPool
+
+DEFAULT_PROMPTS = [
+    "求函数 f(x)=x^3-3x 的极值",
+    "如何计算矩阵的特征值",
+    "已知等差数列前n项和，求通项公式",
+    "二次函数的顶点坐标怎么求",
+    "计算定积分 \\int_0^1 x^2 dx",
+    "什么是条件概率",
+    "三角形内角和为什么是180度",
+    "求解一元二次方程 x^2-5x+6=0",
+]
+
+
+async def wait_ready(pool, timeout):
+    deadline = time.monotonic() + timeout
+    while not all(worker.ready for worker in pool.workers):
+        if time.monotonic() > deadline:
+            raise TimeoutError("推理进程加载超时")
+        await asyncio.sleep(0.5)
+
+
+async def run_one(pool, prompt, max_tokens):
+    start = time.perf_counter()
+    first_token = None
+    config = {"prompt": f"<|user|>\n{prompt}\n</s>\n<|assistant|>\n", "max_tokens": max_tokens,
+              "temperature": 0.0, "stop": ["</s>"]}
+    async for _ in pool.stream(config):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token or 0.0
+
+
+async def bench(size, args):
+    threads = args.cores // size
+    pool = LLMProcessPool(size=size, threads_per_worker=threads, core_offset=args.core_offset,
+                          gpu_layers=args.gpu_layers, max_queue=args.requests)
+    await pool.start()
+    try:
+        await wait_ready(pool, args.load_timeout)
+        # 预热：每个进程一次短生成
+        await asyncio.gather(*[run_one(pool, DEFAULT_PROMPTS[0], 8) for _ in range(size)])
+
+        prompts = [DEFAULT_PROMPTS[i % len(DEFAULT_PROMPTS)] for i in range(args.requests)]
+        tokens_before = sum(worker.tokens for worker in pool.workers)
+        start = time.perf_counter()
+        results = await asyncio.gather(*[run_one(pool, prompt, args.max_tokens) for prompt in prompts])
+        elapsed = time.perf_counter() - start
+        tokens = sum(worker.tokens for worker in pool.workers) - tokens_before
+    finally:
+        await pool.stop()
+
+    latencies = np.array([r[0] for r in results]) * 1000
+    first_tokens = np.array([r[1] for r in results]) * 1000
+    return {
+        "size": size,
+        "threads": threads,
+        "tokens": tokens,
+        "elapsed": elapsed,
+        "tokens_per_sec": tokens / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "ttft_p50_ms": float(np.percentile(first_tokens, 50))
+    }
+
+
+async def main(args):
+    rows = []
+    for size in args.sizes:
+        print(f"进程数 {size}，每进程 {args.cores // size} 线程 ...")
+        rows.append(await bench(size, args))
+
+    baseline = rows[0]["tokens_per_sec"]
+    print(f"\n{'进程数':>6} {'线程':>6} {'tokens':>8} {'耗时(s)':>8} {'tok/s':>8} {'加速比':>6} "
+          f"{'p50(ms)':>9} {'p95(ms)':>9} {'首token p50':>11}")
+    for row in rows:
+        print(f"{row['size']:>6} {row['threads']:>6} {row['tokens']:>8} {row['elapsed']:>8.1f} "
+              f"{row['tokens_per_sec']:>8.1f} {row['tokens_per_sec'] / baseline:>6.2f} "
+              f"{row['p50_ms']:>9.0f} {row['p95_ms']:>9.0f} {row['ttft_p50_ms']:>11.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="推理进程池吞吐基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--cores", type=int, default=32, help="参与推理的总核心数")
+    parser.add_argument("--core-offset", type=int, default=0)
+    parser.add_argument("--gpu-layers", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--load-timeout", type=float, default=600)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+"""提示词前缀 KV 状态复用基准测试
+
+用 build_prompt 构造数学 / 非数学交替的提示词，对比三种情况下的首 token 延迟：
+    cold    每次请求前清空 KV 状态（完整预填充）
+    default 不启用前缀缓存，只依赖 llama.cpp 与上一次请求的公共前缀复用
+    prefix  启用 PrefixStateCache，恢复固定前缀的 KV 状态
+
+用法：
+    python bench_prefix_cache.py --threads 10 --gpu-layers 0 --rounds 3
+"""
+import time
+import argparse
+import numpy as np
+from llm_engine import LlamaEngine, build_llama
+from prompt_templates import build_prompt, fixed_prefixes
+
+SAMPLES = [
+    ("求函数 f(x)=x^3-3x 的极值", True),
+    ("你好，今天适合学习什么内容？", False),
+    ("计算定积分 \\int_0^1 x^2 dx", True),
+    ("怎样养成好的学习习惯", False),
+    ("求解一元二次方程 x^2-5x+6=0", True),
+    ("数学学不好怎么办", False),
+]
+
+CONTEXT = "导数描述函数在某一点附近的变化率。若 f'(x0)=0 且 f''(x0)>0，则 x0 为极小值点。" * 4
+
+
+def run(engine, mode, rounds):
+    ttft = []
+    for _ in range(rounds):
+        for question, is_math in SAMPLES:
+            if mode == "cold":
+                engine.llm.reset()
+            prompt = build_prompt(question, history="无近期对话", context=CONTEXT, is_math=is_math)
+            start = time.perf_counter()
+            for _ in engine.stream({"prompt": prompt, "max_tokens": 1, "temperature": 0.0}):
+                break
+            ttft.append((time.perf_counter() - start) * 1000)
+    return np.array(ttft)
+
+
+def main(args):
+    llm = build_llama(n_threads=args.threads, n_gpu_layers=args.gpu_layers)
+    engines = {
+        "cold": LlamaEngine(llm, prefix_cache_bytes=0),
+        "default": LlamaEngine(llm, prefix_cache_bytes=0),
+        "prefix": LlamaEngine(llm, prefixes=fixed_prefixes()),
+    }
+    engines["prefix"].warm_prefixes()
+
+    results = {}
+    for mode, engine in engines.items():
+        llm.reset()
+        results[mode] = run(engine, mode, args.rounds)
+
+    print(f"\n{'模式':<8} {'平均(ms)':>10} {'p50(ms)':>10} {'p95(ms)':>10}")
+    for mode, ttft in results.items():
+        print(f"{mode:<8} {ttft.mean():>10.1f} {np.percentile(ttft, 50):>10.1f} {np.percentile(ttft, 95):>10.1f}")
+    print(f"\n前缀缓存: {engines['prefix'].stats()['prefix_cache']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="前缀 KV 状态复用基准")
+    parser.add_argument("--threads", type=int, default=10)
+    parser.add_argument("--gpu-layers", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+"""重排序后端基准测试
+
+对比当前的 CrossEncoder.predict（不排序、不截断）与 RerankEngine 各后端的延迟和排序一致性。
+候选文档来自分块存储，用稀疏索引为每个问题召回。
+
+用法：
+    python bench_reranker.py --queries questions.txt --candidates 20 --backends torch int8 onnx
+"""
+import time
+import argparse
+import tempfile
+import numpy as np
+import torch
+from sentence_transformers import CrossEncoder
+from chunk_store import ChunkStore
+from sparse_index import SparseIndex
+from reranker import RerankEngine
+from constants import RERANKER_MODEL_NAME, RERANK_MAX_LENGTH
+
+DEFAULT_QUERIES = [
+    "求函数 f(x)=x^3-3x 的极值",
+    "如何计算矩阵的特征值",
+    "已知等差数列前n项和，求通项公式",
+    "二次函数的顶点坐标怎么求",
+    "计算定积分 \\int_0^1 x^2 dx",
+    "什么是条件概率",
+    "三角形内角和为什么是180度",
+    "求解一元二次方程 x^2-5x+6=0",
+]
+
+
+def spearman(a, b):
+    """Spearman 秩相关系数"""
+    if len(a) < 2:
+        return 1.0
+    rank_a = np.argsort(np.argsort(a))
+    rank_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def load_candidates(queries, n_candidates):
+    """从分块存储召回每个问题的候选文本"""
+    store = ChunkStore()
+    chunks = [chunk for path in sorted(store.paths()) for chunk in store.load_chunks(path)]
+    index = SparseIndex(tempfile.mkdtemp())
+    index.add_documents(chunks)
+    texts = {chunk.metadata["chunk_id"]: chunk.page_content for chunk in chunks}
+    return [[texts[chunk_id] for chunk_id, _ in index.search(query, n_candidates)] for query in queries]
+
+
+def run(name, score_fn, queries, candidates, repeat):
+    latencies, all_scores = [], []
+    for query, texts in zip(queries, candidates):
+        score_fn(query, texts)  # 预热
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            scores = score_fn(query, texts)
+        latencies.append((time.perf_counter() - start_time) * 1000 / repeat)
+        all_scores.append(np.asarray(scores, dtype=np.float32))
+    latencies = np.asarray(latencies)
+    print(f"{name:<14} 平均 {latencies.mean():8.1f}ms  p50 {np.percentile(latencies, 50):8.1f}ms  "
+          f"p95 {np.percentile(latencies, 95):8.1f}ms")
+    return all_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重排序后端基准测试")
+    parser.add_argument("--queries", help="问题文件，每行一个问题")
+    parser.add_argument("--candidates", type=int, default=20, help="每个问题的候选数")
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+    parser.add_argument("--max-length", type=int, default=RERANK_MAX_LENGTH)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU 线程数")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    candidates = load_candidates(queries, args.candidates)
+    print(f"{len(queries)} 个问题，每个问题 {args.candidates} 个候选，max_length={args.max_length}")
+
+    baseline_model = CrossEncoder(RERANKER_MODEL_NAME, device="cpu")
+    baseline = run(
+        "baseline",
+        lambda query, texts: baseline_model.predict([[query, text] for text in texts]),
+        queries, candidates, args.repeat
+    )
+
+    for backend in args.backends:
+        try:
+            engine = RerankEngine(backend=backend, max_length=args.max_length,
+                                  max_candidates=args.candidates)
+        except Exception as e:
+            print(f"{backend:<14} 跳过：{e}")
+            continue
+        results = run(backend, engine.predict, queries, candidates, args.repeat)
+        top1 = np.mean([np.argmax(a) == np.argmax(b) for a, b in zip(results, baseline) if len(a)])
+        rho = np.mean([spearman(a, b) for a, b in zip(results, baseline) if len(a)])
+        gate = np.mean([np.array_equal(a > 0.85, b > 0.85) for a, b in zip(results, baseline) if len(a)])
+        print(f"{'':<14} Top-1 一致率 {top1:.2%}  Spearman {rho:.3f}  阈值(0.85)判定一致率 {gate:.2%}")
+
+
+if __name__ == "__main__":
+    main()
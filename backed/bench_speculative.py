@@ -0,0 +1,106 @@
+"""推测解码基准测试
+
+在固定评测集上依次以 baseline（不启用）、prompt_lookup 和 draft（指定 --draft-model 时）模式加载模型，
+贪心解码生成回答，统计 token/s、草稿接受率、每轮解码产出的 token 数，以及输出是否与 baseline 一致。
+
+评测集为 JSONL，每行 {"question": ..., "context": ...}；未指定时使用内置样例。
+
+用法：
+    python bench_speculative.py --eval-file eval.jsonl --threads 10 --max-tokens 256
+"""
+import gc
+import json
+import time
+import argparse
+from llm_engine import LlamaEngine, build_llama
+from prompt_templates import build_prompt
+
+DEFAULT_SAMPLES = [
+    {
+        "question": "求函数 f(x)=x^3-3x 的极值",
+        "context": "对函数 f(x) 求导得 f'(x)。令 f'(x)=0 求驻点，再由 f''(x) 的符号判断极大值或极小值。"
+                   "例：f(x)=x^3-3x，f'(x)=3x^2-3，驻点 x=±1，f''(x)=6x。",
+        "is_math": True
+    },
+    {
+        "question": "求解一元二次方程 x^2-5x+6=0",
+        "context": "一元二次方程 ax^2+bx+c=0 的求根公式为 x=\\frac{-b\\pm\\sqrt{b^2-4ac}}{2a}，"
+                   "也可以因式分解，例如 x^2-5x+6=(x-2)(x-3)。",
+        "is_math": True
+    },
+    {
+        "question": "计算定积分 \\int_0^1 x^2 dx",
+        "context": "牛顿-莱布尼茨公式：\\int_a^b f(x)dx=F(b)-F(a)，其中 F 是 f 的原函数。x^n 的原函数为 \\frac{x^{n+1}}{n+1}。",
+        "is_math": True
+    },
+    {
+        "question": "已知等差数列首项为 2，公差为 3，求第 10 项和前 10 项和",
+        "context": "等差数列通项公式 a_n=a_1+(n-1)d，前 n 项和 S_n=\\frac{n(a_1+a_n)}{2}=na_1+\\frac{n(n-1)}{2}d。",
+        "is_math": True
+    },
+    {
+        "question": "什么是条件概率",
+        "context": "条件概率 P(A|B)=\\frac{P(AB)}{P(B)}，表示在事件 B 发生的条件下事件 A 发生的概率，要求 P(B)>0。",
+        "is_math": False
+    },
+]
+
+
+def load_samples(path):
+    if not path:
+        return DEFAULT_SAMPLES
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_mode(mode, samples, args):
+    llm = build_llama(n_threads=args.threads, n_gpu_layers=args.gpu_layers, speculative=mode,
+                      draft_model_path=args.draft_model)
+    engine = LlamaEngine(llm, prefix_cache_bytes=0, conversation_cache_bytes=0)
+    outputs = []
+    for sample in samples:
+        prompt = build_prompt(sample["question"], history="无近期对话", context=sample["context"],
+                              is_math=sample.get("is_math", True))
+        llm.reset()
+        result = engine.complete({
+            "prompt": prompt,
+            "max_tokens": args.max_tokens,
+            "temperature": 0.0,
+            "stop": ["</s>", "[INST]"],
+            "lookup_text": sample["context"]
+        })
+        outputs.append(result["choices"][0]["text"])
+    stats = engine.speculative_stats()
+    del engine, llm
+    gc.collect()
+    return outputs, stats
+
+
+def main(args):
+    samples = load_samples(args.eval_file)
+    modes = [None, "prompt_lookup"] + (["draft"] if args.draft_model else [])
+    results = {}
+    for mode in modes:
+        name = mode or "baseline"
+        print(f"运行 {name} ...")
+        start = time.perf_counter()
+        results[name] = run_mode(mode, samples, args)
+        print(f"  耗时 {time.perf_counter() - start:.1f}s")
+
+    baseline_outputs, baseline_stats = results["baseline"]
+    print(f"\n{'模式':<14} {'tok/s':>8} {'加速比':>6} {'接受率':>7} {'tok/轮':>7} {'输出一致':>8}")
+    for name, (outputs, stats) in results.items():
+        same = sum(a == b for a, b in zip(outputs, baseline_outputs))
+        print(f"{name:<14} {stats['tokens_per_sec']:>8.1f} "
+              f"{stats['tokens_per_sec'] / baseline_stats['tokens_per_sec']:>6.2f} "
+              f"{stats['acceptance_rate']:>7.1%} {stats['tokens_per_step']:>7.2f} {same:>4}/{len(outputs)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="推测解码基准")
+    parser.add_argument("--eval-file", default=None)
+    parser.add_argument("--draft-model", default=None, help="草稿 GGUF 模型路径（需与主模型词表一致）")
+    parser.add_argument("--threads", type=int, default=10)
+    parser.add_argument("--gpu-layers", type=int, default=0)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    main(parser.parse_args())
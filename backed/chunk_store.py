@@ -0,0 +1,127 @@
+import os
+import json
+import logging
+import hashlib
+import threading
+from langchain.schema import Document
+from constants import CHUNK_STORE_DIR
+
+
+def compute_content_hash(text):
+    """计算分块内容的哈希值"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def assign_chunk_ids(file_path, chunks):
+    """为文件的分块分配稳定ID（同一文件内相同内容的分块按出现顺序编号）"""
+    path_key = os.path.normcase(os.path.abspath(file_path))
+    occurrences = {}
+    for chunk in chunks:
+        content_hash = compute_content_hash(chunk.page_content)
+        dup_index = occurrences.get(content_hash, 0)
+        occurrences[content_hash] = dup_index + 1
+        chunk_id = hashlib.sha1(f"{path_key}\x00{content_hash}\x00{dup_index}".encode("utf-8")).hexdigest()
+        chunk.metadata["chunk_id"] = chunk_id
+        chunk.metadata["content_hash"] = content_hash
+    return chunks
+
+
+class ChunkStore:
+    """分块持久化存储：manifest 记录每个文件的大小、修改时间和哈希，分块按文件单独保存"""
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, store_dir=CHUNK_STORE_DIR):
+        self.store_dir = store_dir
+        self.chunks_dir = os.path.join(store_dir, "chunks")
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        self.manifest_path = os.path.join(store_dir, self.MANIFEST_NAME)
+        self._lock = threading.RLock()
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        """加载 manifest，损坏时从空状态开始"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"读取分块manifest失败，将重新构建: {e}")
+            return {}
+
+    def flush(self):
+        """原子写入 manifest"""
+        with self._lock:
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+
+    def _chunk_file(self, file_path):
+        name = hashlib.md5(os.path.normcase(os.path.abspath(file_path)).encode("utf-8")).hexdigest()
+        return os.path.join(self.chunks_dir, f"{name}.jsonl")
+
+    def paths(self):
+        with self._lock:
+            return set(self.manifest.keys())
+
+    def get_entry(self, file_path):
+        with self._lock:
+            return self.manifest.get(file_path)
+
+    def is_unchanged(self, file_path, size, mtime):
+        """大小和修改时间都未变化时视为未修改（不计算哈希）"""
+        entry = self.get_entry(file_path)
+        return entry is not None and entry["size"] == size and entry["mtime"] == mtime
+
+    def touch(self, file_path, size, mtime):
+        """内容未变但修改时间变化时只更新 manifest"""
+        with self._lock:
+            entry = self.manifest.get(file_path)
+            if entry is not None:
+                entry["size"] = size
+                entry["mtime"] = mtime
+
+    def save_chunks(self, file_path, size, mtime, file_hash, chunks):
+        """保存单个文件的分块并更新 manifest"""
+        chunk_file = self._chunk_file(file_path)
+        tmp_path = chunk_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(json.dumps(
+                    {"page_content": chunk.page_content, "metadata": chunk.metadata},
+                    ensure_ascii=False,
+                    default=str
+                ) + "\n")
+        os.replace(tmp_path, chunk_file)
+        with self._lock:
+            self.manifest[file_path] = {
+                "size": size,
+                "mtime": mtime,
+                "hash": file_hash,
+                "chunk_ids": [chunk.metadata["chunk_id"] for chunk in chunks]
+            }
+
+    def load_chunks(self, file_path):
+        """读取单个文件的分块"""
+        chunk_file = self._chunk_file(file_path)
+        if not os.path.exists(chunk_file):
+            return []
+        chunks = []
+        with open(chunk_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                chunks.append(Document(page_content=item["page_content"], metadata=item["metadata"]))
+        return chunks
+
+    def remove(self, file_path):
+        """删除文件的分块记录，返回被删除的分块ID"""
+        with self._lock:
+            entry = self.manifest.pop(file_path, None)
+        chunk_file = self._chunk_file(file_path)
+        if os.path.exists(chunk_file):
+            os.remove(chunk_file)
+        return entry["chunk_ids"] if entry else []
@@ -1,6 +1,65 @@
 # 常量配置
 KNOWLEDGE_BASE_DIR = r"E:\math-ai\knowledge_base"
 VECTOR_DB_DIR = r"E:\math-ai\math-ai-backend\vector_db"
+VECTOR_DB_BATCH_SIZE = 256  # 向量库增量同步时每批写入/删除的分块数
+SPARSE_INDEX_DIR = r"E:\math-ai\math-ai-backend\sparse_index"
+SPARSE_INDEX_BATCH_SIZE = 50000  # 稀疏索引构建时每个增量段的分块数
+INDEX_PERSIST_INTERVAL = 60  # 增量索引变更的持久化间隔（秒），停止服务时写入剩余变更
+# 混合检索配置
+DENSE_TOP_K = 10  # 稠密检索候选数
+SPARSE_TOP_K = 10  # 稀疏检索候选数
+FUSION_TOP_K = 10  # 融合后送入重排序的候选数
+FUSION_WEIGHTS = (0.6, 0.4)  # 稠密、稀疏两路权重
+FUSION_METHOD = "rrf"  # "rrf" 倒数排名融合 或 "score" 归一化分数加权
+RRF_K = 60
+# 重排序配置
+RERANK_BACKEND = "torch"  # "torch" / "int8"（CPU 动态量化）/ "onnx"（ONNX Runtime CPU）
+RERANK_MAX_LENGTH = 512  # 每个 (问题, 分块) 对的最大 token 数
+RERANK_BATCH_SIZE = 16
+RERANK_MAX_CANDIDATES = 10  # 送入重排序的最大候选数
+RERANK_ONNX_DIR = r"E:\math-ai\models\BAAI\bge-reranker-large-onnx"
+# 检索缓存配置
+RETRIEVAL_CACHE_SIZES = {"embedding_size": 10000, "candidate_size": 5000, "rerank_size": 50000}
+RETRIEVAL_CACHE_TTL = 3600  # 秒
+# 语义答案缓存配置
+ANSWER_CACHE_THRESHOLD = 0.95  # 问题向量余弦相似度阈值
+ANSWER_CACHE_SIZE = 2000
+ANSWER_CACHE_PATH = r"E:\math-ai\math-ai-backend\answer_cache\answers.json"  # 设为 None 则只缓存在内存
+ANSWER_CACHE_FLUSH_INTERVAL = 30.0  # 答案缓存后台写盘间隔（秒）
+ANSWER_REPLAY_CHUNK_SIZE = 32  # 流式回放缓存答案时每帧的字符数
+STREAM_FLUSH_INTERVAL = 0.03  # 流式输出合并帧的最长等待（秒），第一帧不等待
+STREAM_FLUSH_BYTES = 256  # 流式输出缓冲达到该字节数时立即发出
+# 知识库问答对直查配置
+QA_INDEX_DIR = r"E:\math-ai\math-ai-backend\qa_index"
+QA_MATCH_THRESHOLD = 0.97  # 问题向量余弦相似度达到该值时直接返回标准答案
+
+RETRIEVAL_TOP_K = 5  # 重排后进入提示词组装的分块数上限（再按 token 预算取舍）
+
+PROMPT_CONTEXT_TOKENS = 1536  # 参考知识 token 上限；提示词总预算为 MAX_SEQ_LENGTH - MAX_NEW_TOKENS
+PROMPT_HISTORY_TOKENS = 512  # 会话记忆 token 上限
+PROMPT_HISTORY_MESSAGE_TOKENS = 128  # 单条历史消息 token 上限
+PROMPT_MIN_CHUNK_TOKENS = 64  # 剩余预算不足该值时不再放入（截断）分块
+PROMPT_MIN_OVERLAP_CHARS = 20  # 相邻分块首尾重叠达到该长度时去掉重叠部分
+PROMPT_TOKEN_CACHE_PATH = r"E:\math-ai\math-ai-backend\prompt_packer\chunk_tokens.json"
+
+COMPRESSION_RATIO = 0.5  # 参考知识压缩后保留的字符比例，设为 1 或 None 关闭压缩
+COMPRESSION_MIN_CHARS = 300  # 参考知识总字符数不超过该值时不压缩
+COMPRESSION_REDUNDANCY = 0.92  # 与已选片段向量相似度达到该值的片段视为重复
+COMPRESSION_CACHE_SIZE = 50000  # 句子向量缓存条数
+
+RELATED_CANDIDATES = 50  # 相关问题近邻候选数
+RELATED_MMR_LAMBDA = 0.7  # MMR 相关度权重，越小越强调多样性
+RELATED_MIN_SIMILARITY = 0.6  # 低于该相似度的问答对不作为相关问题
+RELATED_MAX_CHARS = 60
+RELATED_CACHE_SIZE = 5000
+RELATED_CACHE_TTL = 3600  # 秒
+RELATED_LLM_FALLBACK = False  # 知识库中相关问题不足时是否调用大模型补足（会与对话请求争用推理）
+
+CLASSIFIER_HEAD_PATH = r"E:\math-ai\math-ai-backend\classifier\head.npz"  # 设为 None 则不持久化
+CLASSIFIER_CONFIDENCE = 0.9  # 逻辑回归头概率 >= 该值或 <= 1-该值时直接采用，否则调用 SeqGPT
+CLASSIFIER_MEMO_SIZE = 10000
+CLASSIFIER_RETRAIN_EVERY = 50  # 每积累多少个 SeqGPT 标注样本重新拟合分类头
+CLASSIFIER_MAX_SAMPLES = 20000
 EMBED_MODEL_NAME = r"E:\math-ai\models\BAAI\bge-small-zh-v1.5"
 RERANKER_MODEL_NAME = r"E:\math-ai\models\BAAI\bge-reranker-large"
 SEQGPT_MODEL_NAME = r"E:\math-ai\models\iic\nlp_seqgpt-560m"
@@ -15,5 +74,45 @@ MAX_NEW_TOKENS = 1024
 DEFAULT_TEMPERATURE = 0.6
 TOP_P = 0.9
 HISTORY_LIMIT = 6
+LLM_N_THREADS = 10  # 推理线程数
+LLM_QUEUE_SIZE = 16  # 推理请求排队上限，超出立即拒绝
+LLM_POOL_SIZE = 0  # 推理进程数，0 表示单进程（专属推理线程）
+LLM_POOL_THREADS_PER_WORKER = 0  # 每个推理进程的线程数，0 表示均分可用核心
+LLM_POOL_CORE_OFFSET = 0  # 推理进程从该核心开始绑定，之前的核心留给检索和接口
+LLM_POOL_GPU_LAYERS = 0  # 推理进程卸载到GPU的层数，纯CPU主机为0
+LLM_POOL_STALL_TIMEOUT = 300  # 推理进程有请求但超过该秒数无进展时重启
+LLM_SPECULATIVE_MODE = None  # 推测解码：None 关闭，"prompt_lookup" n-gram 提示词查找，"draft" 小模型草稿
+LLM_LOOKUP_NGRAM_SIZE = 3  # 提示词查找匹配的最长 n-gram
+LLM_LOOKUP_NUM_TOKENS = 10  # 提示词查找每次草稿的 token 数
+LLM_DRAFT_MODEL_NAME = None  # 草稿 GGUF 模型路径，需与主模型词表一致
+LLM_DRAFT_NUM_TOKENS = 4  # 草稿模型每次贪心生成的 token 数
+LLM_PREFIX_CACHE_BYTES = 512 * 1024 * 1024  # 提示词前缀 KV 状态缓存上限（字节），0 表示关闭
+LLM_CONVERSATION_CACHE_BYTES = 4 * 1024 * 1024 * 1024  # 多轮对话 KV 状态内存上限（字节），0 表示关闭
+LLM_CONVERSATION_DISK_BYTES = 32 * 1024 * 1024 * 1024  # 对话状态溢出到磁盘的上限（字节）
+LLM_CONVERSATION_SPILL_DIR = r"E:\math-ai\math-ai-backend\kv_states"
+LLM_CONVERSATION_SESSIONS = 1000  # 保留对话记录的会话数
+LLM_CONVERSATION_TTL = 6 * 3600  # 会话记录过期时间（秒）
+LLM_CONVERSATION_CHECK_TURNS = 2  # 校验会话记录时比对客户端历史的最近轮数（客户端历史会被截断，不能比对轮数）
+
+# 分块持久化存储目录（manifest + 每个文件的分块）
+CHUNK_STORE_DIR = r"E:\math-ai\math-ai-backend\chunk_store"
+
+DB_POOL_SIZE = 16  # MySQL 连接池大小（mysql-connector 上限 32），数据库线程池线程数与之相同
+DB_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # 查询延迟直方图分桶上界（毫秒）
+
+API_KEY_CACHE_SIZE = 10000
+API_KEY_CACHE_TTL = 300  # 秒；删除密钥时立即失效，TTL 兜底其他途径的变更
+API_KEY_FLUSH_INTERVAL = 5  # last_used 批量写回间隔（秒）
+
+CONVERSATION_PAGE_SIZE = 30  # 会话列表默认每页条数
+MESSAGE_PAGE_SIZE = 50  # 消息分页默认每页条数
+MAX_PAGE_SIZE = 200
+CONVERSATION_PREVIEW_CHARS = 100  # 会话列表中最后一条消息的预览长度
+
+# 问题、参考资料、消息的异步批量写入；数据库不可用时批次落盘到问题缓存目录，恢复后重放
+QUESTION_CACHE_DIR = "E:/math-ai/math-ai-backend/question_cache"
+WRITE_BEHIND_FLUSH_INTERVAL = 0.2  # 组提交等待时间（秒）
+WRITE_BEHIND_BATCH_SIZE = 500  # 每个事务最多写入的记录数
+WRITE_BEHIND_RETRY_INTERVAL = 30  # 落盘批次的重放间隔（秒）
 
-    
\ No newline at end of file
+SCHEMA_MIGRATION_LOCK_TIMEOUT = 30  # 等待其他进程执行表结构迁移的最长时间（秒）
@@ -0,0 +1,131 @@
+"""面向问题的参考知识压缩
+
+在检索（重排）之后、提示词组装之前，把分块切成句子和公式块，按与问题的向量相似度挑选，
+去掉与已选内容高度重复的片段，保留约 ratio 比例的字符，按原文顺序拼回各分块。
+问题向量复用检索已缓存的查询向量，句子向量用同一 bge 模型计算并按内容哈希缓存。
+"""
+import re
+import time
+import hashlib
+import threading
+import numpy as np
+from langchain.schema import Document
+from constants import COMPRESSION_RATIO, COMPRESSION_MIN_CHARS, COMPRESSION_REDUNDANCY, COMPRESSION_CACHE_SIZE
+from retrieval_cache import LRUCache
+
+# 独立成块的公式：$$...$$、\[...\]、\begin{env}...\end{env}
+FORMULA_BLOCK = re.compile(r"\$\$.+?\$\$|\\\[.+?\\\]|\\begin\{([a-zA-Z]+\*?)\}.+?\\end\{\1\}", re.S)
+SENTENCE_END = re.compile(r"(?<=[。！？；!?;])|(?<=\.)\s+|\n+")
+MIN_UNIT_CHARS = 8
+
+
+def split_units(text):
+    """把分块切成句子和公式块，过短的片段并入前一个"""
+    units = []
+    position = 0
+    for match in FORMULA_BLOCK.finditer(text):
+        units.extend(SENTENCE_END.split(text[position:match.start()]))
+        units.append(match.group(0))
+        position = match.end()
+    units.extend(SENTENCE_END.split(text[position:]))
+
+    merged = []
+    for unit in units:
+        unit = (unit or "").strip()
+        if not unit:
+            continue
+        if merged and len(unit) < MIN_UNIT_CHARS and not FORMULA_BLOCK.fullmatch(unit):
+            merged[-1] += unit
+        else:
+            merged.append(unit)
+    return merged
+
+
+class ContextCompressor:
+    """按问题相似度挑选句子 / 公式块；ratio 为保留字符比例，>= 1 时不压缩"""
+
+    def __init__(self, embed_query, embed_documents, ratio=COMPRESSION_RATIO, min_chars=COMPRESSION_MIN_CHARS,
+                 redundancy=COMPRESSION_REDUNDANCY, cache_size=COMPRESSION_CACHE_SIZE):
+        self.embed_query = embed_query
+        self.embed_documents = embed_documents
+        self.ratio = ratio
+        self.min_chars = min_chars
+        self.redundancy = redundancy
+        self.cache = LRUCache(cache_size)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.chars_in = 0
+        self.chars_out = 0
+        self.total_ms = 0.0
+
+    def _unit_vectors(self, units):
+        """句子向量（归一化，按内容哈希缓存）"""
+        keys = [hashlib.sha1(unit.encode("utf-8")).hexdigest() for unit in units]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = np.asarray(self.embed_documents([units[i] for i in missing]), dtype=np.float32)
+            embedded /= np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-12)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+                self.cache.set(keys[i], vector)
+        return np.stack(vectors)
+
+    def compress(self, question, contexts, ratio=None):
+        """返回压缩后的分块列表（保持检索排序，整块未被选中的分块去掉）"""
+        ratio = self.ratio if ratio is None else ratio
+        total_chars = sum(len(doc.page_content) for doc in contexts)
+        if not contexts or not ratio or ratio >= 1 or total_chars <= self.min_chars:
+            return contexts
+
+        start = time.perf_counter()
+        units, owners = [], []
+        for index, doc in enumerate(contexts):
+            for unit in split_units(doc.page_content):
+                units.append(unit)
+                owners.append(index)
+        if not units:
+            return contexts
+
+        query = np.asarray(self.embed_query(question), dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        vectors = self._unit_vectors(units)
+        relevance = vectors @ query
+
+        # 按相关度从高到低选，跳过与已选片段高度重复的，直到达到目标字符数
+        target = total_chars * ratio
+        selected = []
+        used = 0
+        for i in np.argsort(-relevance):
+            if used >= target:
+                break
+            if selected and float(np.max(vectors[selected] @ vectors[i])) >= self.redundancy:
+                continue
+            selected.append(int(i))
+            used += len(units[i])
+
+        keep = set(selected)
+        compressed = []
+        for index, doc in enumerate(contexts):
+            kept = [units[i] for i in range(len(units)) if owners[i] == index and i in keep]
+            if kept:
+                # 内容已改变，不再携带原分块的内容哈希
+                metadata = {k: v for k, v in doc.metadata.items() if k != "content_hash"}
+                compressed.append(Document(page_content="\n".join(kept), metadata=metadata))
+
+        with self._lock:
+            self.requests += 1
+            self.chars_in += total_chars
+            self.chars_out += sum(len(doc.page_content) for doc in compressed)
+            self.total_ms += (time.perf_counter() - start) * 1000
+        return compressed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ratio": self.ratio,
+                "requests": self.requests,
+                "kept_char_ratio": self.chars_out / self.chars_in if self.chars_in else 1.0,
+                "avg_ms": self.total_ms / self.requests if self.requests else 0.0,
+                "unit_cache": self.cache.stats()
+            }
@@ -1,43 +1,272 @@
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
 import os
-from datetime import datetime
+import json
+import time
+import base64
+import asyncio
+import bisect
 import logging
-import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from constants import (DB_POOL_SIZE, DB_LATENCY_BUCKETS_MS,
+                       API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL, API_KEY_FLUSH_INTERVAL, CONVERSATION_PREVIEW_CHARS)
+from retrieval_cache import LRUCache
+import migrations
+
+# 连接断开 / 服务端重启时可以重连重试的错误
+RETRYABLE_ERRORS = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+
+
+def encode_cursor(*values):
+    """把分页位置（排序键）编码成不透明的游标字符串"""
+    raw = json.dumps([str(v) if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """解码游标，格式不对时抛出 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("无效的分页游标")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("无效的分页游标")
+    return values
+
+
+class LatencyHistogram:
+    """按操作名统计的查询延迟直方图（毫秒分桶）"""
+
+    def __init__(self, buckets=DB_LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, name, elapsed_ms, error=False):
+        with self._lock:
+            op = self._ops.get(name)
+            if op is None:
+                op = self._ops[name] = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                        "buckets": [0] * (len(self.buckets) + 1)}
+            op["count"] += 1
+            op["errors"] += int(error)
+            op["total_ms"] += elapsed_ms
+            op["max_ms"] = max(op["max_ms"], elapsed_ms)
+            op["buckets"][bisect.bisect_left(self.buckets, elapsed_ms)] += 1
+
+    def _percentile(self, counts, total, q):
+        """按分桶上界估计分位数"""
+        target = total * q
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for name, op in self._ops.items():
+                labels = [f"<={b}ms" for b in self.buckets] + [f">{self.buckets[-1]}ms"]
+                result[name] = {
+                    "count": op["count"],
+                    "errors": op["errors"],
+                    "avg_ms": op["total_ms"] / op["count"],
+                    "max_ms": op["max_ms"],
+                    "p50_ms": self._percentile(op["buckets"], op["count"], 0.5),
+                    "p95_ms": self._percentile(op["buckets"], op["count"], 0.95),
+                    "histogram": dict(zip(labels, op["buckets"]))
+                }
+            return result
 
-QUESTION_CACHE_DIR = "E:/math-ai/math-ai-backend/question_cache"
 
 class Database:
-    def __init__(self):
+    """连接池数据访问层
+
+    所有查询经 _connection() 从连接池取连接，用完归还；借连接时连接池会检测并重连失效的连接。
+    连接错误时只重试借连接阶段的失败和只读查询，写语句可能已经执行，不重试以免重复写入。
+    方法本身是阻塞的，异步代码通过 AsyncDatabase 在专用线程池中调用。
+
+    API 密钥校验结果在内存中按 TTL 缓存，last_used 先记在内存里，由后台线程定期批量写回。
+    """
+
+    def __init__(self, pool_size=DB_POOL_SIZE, migrate=True):
         self.host = os.getenv('DB_HOST', 'localhost')
         self.user = os.getenv('DB_USER', 'root')
         self.password = os.getenv('DB_PASSWORD', 'root')
         self.database = os.getenv('DB_NAME', 'cs')
-        self.connection = None
-        self.connect()  # 调用 connect 方法建立连接
-        self._init_tables()  # 初始化表结构
+        self.pool_size = pool_size
+        self.pool = None
+        # 连接池耗尽时 get_connection 直接报错，用信号量让调用方排队等待
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.latency = LatencyHistogram()
+        self.api_keys = LRUCache(API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL)  # api_key -> user_id
+        self._last_used = {}  # api_key -> 待写回的最后使用时间
+        self._last_used_lock = threading.Lock()
+        self._key_generation = 0  # 每删除一个密钥加一，查询期间发生删除时不写入缓存
+        self._stop = threading.Event()
+        self._flusher = None
+        if self.connect():  # 调用 connect 方法建立连接池
+            self._init_tables()  # 初始化表结构
+            if migrate:
+                self._migrate()  # 补建索引等版本化变更
+            self._flusher = threading.Thread(target=self._flush_loop, name="api-key-flusher", daemon=True)
+            self._flusher.start()
 
     def connect(self):
         try:
-            self.connection = mysql.connector.connect(
+            self.pool = pooling.MySQLConnectionPool(
+                pool_name="math_ai",
+                pool_size=self.pool_size,
+                pool_reset_session=True,
                 host=self.host,
                 user=self.user,
                 password=self.password,
                 database=self.database
             )
-            if self.connection.is_connected():
-                return True
+            return True
         except Error as e:
-            print(f"Error while connecting to MySQL: {e}")
+            logging.error(f"Error while connecting to MySQL: {e}")
+            return False
+
+    def is_connected(self):
+        try:
+            with self._connection() as conn:
+                return conn.is_connected()
+        except Error:
             return False
-    
+
+    @contextmanager
+    def _connection(self):
+        """从连接池借出一个可用连接（get_connection 会检测连接并在失效时重连）"""
+        with self._slots:
+            conn = self.pool.get_connection()
+            try:
+                yield conn
+            finally:
+                conn.close()  # 归还连接池
+
+    def _run(self, name, work, retry=False):
+        """在池化连接上执行 work(conn)，记录延迟
+
+        借连接失败时重试一次；work 执行中的连接错误只在 retry=True（只读查询）时重试
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            for attempt in range(2):
+                started = False
+                try:
+                    with self._connection() as conn:
+                        started = True
+                        return work(conn)
+                except RETRYABLE_ERRORS as e:
+                    if attempt or (started and not retry):
+                        raise
+                    logging.warning(f"数据库连接异常，重连后重试 {name}: {e}")
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.latency.record(name, (time.perf_counter() - start) * 1000, error)
+
+    def fetch_one(self, name, query, params=(), dictionary=False):
+        def work(conn):
+            cursor = conn.cursor(dictionary=dictionary)
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchone()
+            finally:
+                cursor.close()
+        return self._run(name, work, retry=True)
+
+    def fetch_all(self, name, query, params=(), dictionary=False):
+        def work(conn):
+            cursor = conn.cursor(dictionary=dictionary)
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        return self._run(name, work, retry=True)
+
+    def execute(self, name, query, params=()):
+        """执行单条写语句并提交，返回 (影响行数, 自增ID)"""
+        return self.transaction(name, [(query, params)])
+
+    def transaction(self, name, statements):
+        """在一个事务中依次执行 [(语句, 参数)]，出错回滚；返回最后一条的 (影响行数, 自增ID)"""
+        def work(conn):
+            cursor = conn.cursor()
+            try:
+                for query, params in statements:
+                    cursor.execute(query, params)
+                conn.commit()
+                return cursor.rowcount, cursor.lastrowid
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        return self._run(name, work)
+
+    def execute_many(self, name, query, rows):
+        """用 executemany 批量执行同一条写语句并提交，返回影响行数"""
+        return self.execute_batches(name, [(query, rows)])
+
+    def execute_batches(self, name, batches):
+        """在一个事务中依次对 [(语句, 参数列表)] 执行 executemany（空列表跳过），出错回滚；返回总影响行数"""
+        def work(conn):
+            cursor = conn.cursor()
+            try:
+                rowcount = 0
+                for query, rows in batches:
+                    if rows:
+                        cursor.executemany(query, rows)
+                        rowcount += max(cursor.rowcount, 0)
+                conn.commit()
+                return rowcount
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        return self._run(name, work)
+
+    @contextmanager
+    def named_lock(self, name, timeout):
+        """MySQL 命名锁（GET_LOCK），用于多个进程间串行执行（如表结构迁移）"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+                if not cursor.fetchone()[0]:
+                    raise TimeoutError(f"获取数据库锁 {name} 超时")
+                try:
+                    yield
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                    cursor.fetchone()
+            finally:
+                cursor.close()
+
+    def stats(self):
+        with self._last_used_lock:
+            pending = len(self._last_used)
+        return {"pool_size": self.pool_size, "queries": self.latency.stats(),
+                "api_key_cache": {**self.api_keys.stats(), "pending_last_used": pending}}
+
     def _init_tables(self):
         """初始化数据库表结构"""
         try:
-            cursor = self.connection.cursor()
-            
+            statements = []
+
             # 创建 users 表
-            cursor.execute('''
+            statements.append(('''
             CREATE TABLE IF NOT EXISTS users (
                 id INT PRIMARY KEY AUTO_INCREMENT,
                 username VARCHAR(255) NOT NULL UNIQUE,
@@ -45,10 +274,10 @@ class Database:
                 email VARCHAR(255),
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-            ''')
-            
+            ''', ()))
+
             # 创建 api_keys 表
-            cursor.execute('''
+            statements.append(('''
             CREATE TABLE IF NOT EXISTS api_keys (
                 id INT PRIMARY KEY AUTO_INCREMENT,
                 user_id INT NOT NULL,
@@ -57,10 +286,33 @@ class Database:
                 last_used TIMESTAMP NULL,
                 FOREIGN KEY (user_id) REFERENCES users(id)
             )
-            ''')
-            
+            ''', ()))
+
+            # 创建 conversations 表（索引由 migrations.py 维护）
+            statements.append(('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INT PRIMARY KEY AUTO_INCREMENT,
+                user_id INT,
+                title VARCHAR(255),
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+            ''', ()))
+
+            # 创建 messages 表（索引由 migrations.py 维护）
+            statements.append(('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INT PRIMARY KEY AUTO_INCREMENT,
+                conversation_id INT,
+                role VARCHAR(255),
+                content TEXT,
+                timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+            )
+            ''', ()))
+
             # 修改后的 user_documents 表结构
-            cursor.execute('''
+            statements.append(('''
             CREATE TABLE IF NOT EXISTS user_documents (
                 id INT PRIMARY KEY AUTO_INCREMENT,
                 user_id INT NOT NULL,
@@ -71,10 +323,10 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users(id)
             )
-            ''')
-            
+            ''', ()))
+
               # 创建questions表
-            cursor.execute('''
+            statements.append(('''
             CREATE TABLE IF NOT EXISTS questions (
                 id VARCHAR(36) PRIMARY KEY,
                 user_id INTEGER NOT NULL,
@@ -85,10 +337,10 @@ class Database:
                 INDEX idx_conversation_id (conversation_id),
                 INDEX idx_user_id (user_id)
             )
-            ''')
-            
+            ''', ()))
+
             # 创建reference_files表
-            cursor.execute('''
+            statements.append(('''
             CREATE TABLE IF NOT EXISTS reference_files (
                 id INTEGER PRIMARY KEY AUTO_INCREMENT,
                 question_id VARCHAR(36) NOT NULL,
@@ -101,38 +353,39 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (question_id) REFERENCES questions(id)
             )
-            ''')
-            self.connection.commit()
+            ''', ()))
+            self.transaction("init_tables", statements)
         except Error as e:
-            print(f"初始化表失败: {e}")
+            logging.error(f"初始化表失败: {e}")
+
+    def _migrate(self):
+        try:
+            migrations.migrate(self)
+        except (Error, TimeoutError) as e:
+            logging.error(f"表结构迁移失败: {e}")
 
     def close(self):
-        if self.connection.is_connected():
-            self.connection.close()
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+            self.flush_last_used()
+        # 连接池没有整体关闭接口，逐个取出空闲连接关闭底层连接
+        if self.pool is not None:
+            self.pool._remove_connections()
 
     def user_exists(self, username):
-        cursor = self.connection.cursor()
         query = "SELECT id FROM users WHERE username = %s"
-        cursor.execute(query, (username,))
-        result = cursor.fetchone()
-        cursor.close()
-        return result is not None
+        return self.fetch_one("user_exists", query, (username,)) is not None
 
     def create_user(self, username, password_hash, email):
-        cursor = self.connection.cursor()
         query = "INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s)"
-        cursor.execute(query, (username, password_hash, email))
-        self.connection.commit()
-        user_id = cursor.lastrowid
-        cursor.close()
+        _, user_id = self.execute("create_user", query, (username, password_hash, email))
         return user_id
 
     def verify_user(self, username, password_hash):
-        cursor = self.connection.cursor()
         query = "SELECT id, password_hash FROM users WHERE username = %s"
-        cursor.execute(query, (username,))
-        result = cursor.fetchone()
-        cursor.close()
+        result = self.fetch_one("verify_user", query, (username,))
         if result and result[1] == password_hash:
             return result[0]
         return None
@@ -140,109 +393,204 @@ class Database:
     def generate_api_key(self, user_id):
         import secrets
         api_key = secrets.token_hex(32)
-
-        cursor = self.connection.cursor()
         query = "INSERT INTO api_keys (user_id, api_key) VALUES (%s, %s)"
-        cursor.execute(query, (user_id, api_key))
-        self.connection.commit()
-        cursor.close()
-
+        self.execute("generate_api_key", query, (user_id, api_key))
         return api_key
 
     def get_api_key(self, user_id):
-        cursor = self.connection.cursor()
         query = "SELECT api_key FROM api_keys WHERE user_id = %s ORDER BY created_at DESC LIMIT 1"
-        cursor.execute(query, (user_id,))
-        result = cursor.fetchone()
-        cursor.close()
+        result = self.fetch_one("get_api_key", query, (user_id,))
         if result:
             return result[0]
         return None
 
+    def cached_user_id(self, api_key):
+        """只查缓存校验 API 密钥，未命中返回 None；不访问数据库，可以在事件循环中直接调用"""
+        user_id = self.api_keys.get(api_key)
+        if user_id is not None:
+            self._touch_api_key(api_key)
+        return user_id
+
     def validate_api_key(self, api_key):
-        cursor = self.connection.cursor(dictionary=True)
+        """校验 API 密钥并返回用户ID；命中缓存时不访问数据库"""
+        user_id = self.cached_user_id(api_key)
+        if user_id is not None:
+            return user_id
+        with self._last_used_lock:
+            generation = self._key_generation
         query = """
-        SELECT ak.user_id, ak.api_key, ak.last_used 
+        SELECT ak.user_id
         FROM api_keys ak
         JOIN users u ON ak.user_id = u.id
         WHERE ak.api_key = %s
         """
-        cursor.execute(query, (api_key,))
-        result = cursor.fetchone()
-        cursor.close()
+        result = self.fetch_one("validate_api_key", query, (api_key,))
+        if not result:
+            return None
+        user_id = result[0]
+        with self._last_used_lock:
+            # 查询期间有密钥被删除时不写入缓存，避免把刚删除的密钥重新放回缓存
+            if self._key_generation == generation:
+                self.api_keys.set(api_key, user_id)
+        self._touch_api_key(api_key)
+        return user_id
 
-        if result:
-            # 更新最后使用时间
-            cursor = self.connection.cursor()
-            update_query = "UPDATE api_keys SET last_used = %s WHERE api_key = %s"
-            cursor.execute(update_query, (datetime.now(), api_key))
-            self.connection.commit()
-            cursor.close()
-
-            return result['user_id']
-        return None
+    def _touch_api_key(self, api_key):
+        """最后使用时间由后台线程批量写回"""
+        with self._last_used_lock:
+            self._last_used[api_key] = datetime.now()
+
+    def flush_last_used(self):
+        """把缓冲的 last_used 批量写回数据库，失败时放回缓冲区等待下次写回"""
+        with self._last_used_lock:
+            pending, self._last_used = self._last_used, {}
+        if not pending:
+            return 0
+        try:
+            query = "UPDATE api_keys SET last_used = %s WHERE api_key = %s"
+            self.execute_many("flush_last_used", query, [(used, key) for key, used in pending.items()])
+            return len(pending)
+        except Exception as e:
+            logging.error(f"写回 API 密钥使用时间失败: {e}")
+            with self._last_used_lock:
+                for key, used in pending.items():
+                    self._last_used.setdefault(key, used)  # 期间有更新的时间则保留更新的
+            return 0
+
+    def _flush_loop(self):
+        while not self._stop.wait(API_KEY_FLUSH_INTERVAL):
+            self.flush_last_used()
 
     # 会话相关方法
     def create_conversation(self, user_id, title=None):
-        cursor = self.connection.cursor()
         query = "INSERT INTO conversations (user_id, title) VALUES (%s, %s)"
-        cursor.execute(query, (user_id, title))
-        self.connection.commit()
-        conversation_id = cursor.lastrowid
-        cursor.close()
+        _, conversation_id = self.execute("create_conversation", query, (user_id, title))
         return conversation_id
 
     def get_conversations(self, user_id):
-        cursor = self.connection.cursor(dictionary=True)
         query = "SELECT id, title, created_at FROM conversations WHERE user_id = %s ORDER BY created_at DESC"
-        cursor.execute(query, (user_id,))
-        results = cursor.fetchall()
-        cursor.close()
-        return results
+        return self.fetch_all("get_conversations", query, (user_id,), dictionary=True)
+
+    def list_conversations(self, user_id, limit, cursor=None):
+        """键集分页获取会话列表（创建时间倒序），附带最后一条消息预览；一次查询完成
+
+        返回 (会话列表, 下一页游标)，没有更多时游标为 None
+        """
+        where = "user_id = %s"
+        params = [user_id]
+        if cursor:
+            created_at, conversation_id = decode_cursor(cursor, 2)
+            where += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+            params += [created_at, created_at, conversation_id]
+        # 多取一条判断是否还有下一页；最后一条消息用 (conversation_id, id) 索引取 MAX(id)
+        query = f"""
+        SELECT c.id, c.title, c.created_at,
+               m.role AS last_role, LEFT(m.content, %s) AS last_content, m.timestamp AS last_timestamp
+        FROM (
+            SELECT id, title, created_at FROM conversations
+            WHERE {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        ) c
+        LEFT JOIN messages m ON m.id = (SELECT MAX(id) FROM messages WHERE conversation_id = c.id)
+        ORDER BY c.created_at DESC, c.id DESC
+        """
+        rows = self.fetch_all("list_conversations", query, [CONVERSATION_PREVIEW_CHARS] + params + [limit + 1],
+                              dictionary=True)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+        conversations = []
+        for row in rows:
+            last_message = None
+            if row["last_role"] is not None:
+                last_message = {"role": row["last_role"], "content": row["last_content"],
+                                "timestamp": row["last_timestamp"]}
+            conversations.append({"conversation_id": row["id"], "title": row["title"],
+                                  "created_at": row["created_at"], "last_message": last_message})
+        return conversations, next_cursor
+
+    def get_conversation_owner(self, conversation_id):
+        """返回会话所属用户ID，会话不存在时返回 None"""
+        result = self.fetch_one("get_conversation_owner",
+                                "SELECT user_id FROM conversations WHERE id = %s", (conversation_id,))
+        return result[0] if result else None
+
+    def update_conversation_title(self, conversation_id, title):
+        query = "UPDATE conversations SET title = %s WHERE id = %s"
+        rowcount, _ = self.execute("update_conversation_title", query, (title, conversation_id))
+        return rowcount > 0
+
+    def delete_conversation(self, conversation_id):
+        """删除会话及其消息（同一事务）"""
+        rowcount, _ = self.transaction("delete_conversation", [
+            ("DELETE FROM messages WHERE conversation_id = %s", (conversation_id,)),
+            ("DELETE FROM conversations WHERE id = %s", (conversation_id,))
+        ])
+        return rowcount > 0
 
     # 消息相关方法
     def add_message(self, conversation_id, role, content):
-        cursor = self.connection.cursor()
         query = "INSERT INTO messages (conversation_id, role, content) VALUES (%s, %s, %s)"
-        cursor.execute(query, (conversation_id, role, content))
-        self.connection.commit()
-        message_id = cursor.lastrowid
-        cursor.close()
+        _, message_id = self.execute("add_message", query, (conversation_id, role, content))
         return message_id
 
     def get_messages(self, conversation_id):
-        cursor = self.connection.cursor(dictionary=True)
         query = """
-        SELECT role, content, timestamp 
-        FROM messages 
-        WHERE conversation_id = %s 
+        SELECT role, content, timestamp
+        FROM messages
+        WHERE conversation_id = %s
         ORDER BY timestamp ASC  # 改为正序排列
         """
-        cursor.execute(query, (conversation_id,))
-        results = cursor.fetchall()
-        cursor.close()
-        return results
-    
+        return self.fetch_all("get_messages", query, (conversation_id,), dictionary=True)
+
+    def list_messages(self, conversation_id, limit, cursor=None):
+        """游标分页获取消息：每页取游标之前最新的 limit 条，按时间正序返回
+
+        返回 (消息列表, 更早一页的游标)，没有更早的消息时游标为 None
+        """
+        where = "conversation_id = %s"
+        params = [conversation_id]
+        if cursor:
+            (before_id,) = decode_cursor(cursor, 1)
+            where += " AND id < %s"
+            params.append(before_id)
+        query = f"""
+        SELECT id, role, content, timestamp
+        FROM messages
+        WHERE {where}
+        ORDER BY id DESC
+        LIMIT %s
+        """
+        rows = self.fetch_all("list_messages", query, params + [limit + 1], dictionary=True)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["id"])
+        rows.reverse()
+        return rows, next_cursor
+
     def get_all_api_keys(self, user_id):
         """获取用户所有API密钥"""
-        cursor = self.connection.cursor()
         # 添加 user_id 到查询结果中
         query = "SELECT user_id, api_key, created_at, last_used FROM api_keys WHERE user_id = %s ORDER BY created_at DESC"
-        cursor.execute(query, (user_id,))
-        results = cursor.fetchall()
-        cursor.close()
+        results = self.fetch_all("get_all_api_keys", query, (user_id,))
         # 返回的字典中包含 "user_id" 键
         return [{"user_id": row[0], "api_key": row[1], "created_at": row[2], "last_used": row[3]} for row in results]
-    
+
     def delete_api_key(self, user_id, api_key):
         try:
-            cursor = self.connection.cursor()
             query = "DELETE FROM api_keys WHERE api_key = %s AND user_id = %s"
-            cursor.execute(query, (api_key, user_id))
-            self.connection.commit()
-            return cursor.rowcount > 0
+            rowcount, _ = self.execute("delete_api_key", query, (api_key, user_id))
+            if rowcount > 0:
+                # 立即失效，已删除的密钥不能再通过缓存校验
+                with self._last_used_lock:
+                    self._key_generation += 1
+                    self.api_keys.pop(api_key)
+                    self._last_used.pop(api_key, None)
+            return rowcount > 0
         except Exception as e:
-            self.connection.rollback()
             logging.error(f"删除API密钥失败: {str(e)}")
             return False
 
@@ -250,51 +598,38 @@ class Database:
     def save_question(self, question_id, user_id, content, conversation_id=None):
         """保存问题到数据库"""
         try:
-            cursor = self.connection.cursor()
             query = """
-            INSERT INTO questions (id, user_id, content, conversation_id, created_at) 
+            INSERT INTO questions (id, user_id, content, conversation_id, created_at)
             VALUES (%s, %s, %s, %s, %s)
             """
-            cursor.execute(query, (question_id, user_id, content, conversation_id, datetime.now()))
-            self.connection.commit()
-            cursor.close()
+            self.execute("save_question", query, (question_id, user_id, content, conversation_id, datetime.now()))
             return True
         except Error as e:
-            print(f"保存问题失败: {e}")
+            logging.error(f"保存问题失败: {e}")
             return False
-    
+
     def get_question(self, question_id):
         """获取问题内容"""
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = "SELECT * FROM questions WHERE id = %s"
-            cursor.execute(query, (question_id,))
-            result = cursor.fetchone()
-            cursor.close()
-            return result
+            return self.fetch_one("get_question", query, (question_id,), dictionary=True)
         except Error as e:
-            print(f"获取问题失败: {e}")
+            logging.error(f"获取问题失败: {e}")
             return None
-    
+
     # 添加参考资料相关方法
     def save_reference_files(self, question_id, reference_files):
         """保存参考资料到数据库"""
         try:
-            cursor = self.connection.cursor()
-            
-            # 先删除该问题已有的参考资料
-            delete_query = "DELETE FROM reference_files WHERE question_id = %s"
-            cursor.execute(delete_query, (question_id,))
-            
-            # 插入新的参考资料
+            # 先删除该问题已有的参考资料，再插入新的参考资料
+            statements = [("DELETE FROM reference_files WHERE question_id = %s", (question_id,))]
             insert_query = """
-            INSERT INTO reference_files 
+            INSERT INTO reference_files
             (question_id, file_name, file_path, file_type, description, similarity, source)
             VALUES (%s, %s, %s, %s, %s, %s, %s)
             """
-            
             for ref in reference_files:
-                cursor.execute(insert_query, (
+                statements.append((insert_query, (
                     question_id,
                     ref.get("file_name", ""),
                     ref.get("file_path", ""),
@@ -302,84 +637,97 @@ class Database:
                     ref.get("description", ""),
                     ref.get("similarity", 0.0),
                     ref.get("source", "local")
-                ))
-            
-            self.connection.commit()
-            cursor.close()
+                )))
+            self.transaction("save_reference_files", statements)
             return True
         except Error as e:
-            print(f"保存参考资料失败: {e}")
-            self.connection.rollback()
+            logging.error(f"保存参考资料失败: {e}")
             return False
-    
+
     def get_reference_files(self, question_id):
         """获取问题的参考资料"""
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = """
             SELECT file_name, file_path, file_type, description, similarity, source
             FROM reference_files
             WHERE question_id = %s
             ORDER BY similarity DESC
             """
-            cursor.execute(query, (question_id,))
-            results = cursor.fetchall()
-            cursor.close()
-            return results
+            return self.fetch_all("get_reference_files", query, (question_id,), dictionary=True)
         except Error as e:
-            print(f"获取参考资料失败: {e}")
+            logging.error(f"获取参考资料失败: {e}")
             return []
-    # 在Database类中添加以下方法
 
     def save_user_document(self, user_id, file_name, file_path, file_type, file_size):
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT id FROM user_documents WHERE user_id = %s AND file_name = %s", 
-                        (user_id, file_name))
-            if cursor.fetchone():
+            if self.fetch_one("find_user_document", "SELECT id FROM user_documents WHERE user_id = %s AND file_name = %s",
+                              (user_id, file_name)):
                 return False
 
             query = """
-            INSERT INTO user_documents 
+            INSERT INTO user_documents
             (user_id, file_name, file_path, file_type, file_size)
             VALUES (%s, %s, %s, %s, %s)
             """
-            cursor.execute(query, (user_id, file_name, file_path, file_type, file_size))
-            self.connection.commit()
+            self.execute("save_user_document", query, (user_id, file_name, file_path, file_type, file_size))
             return True
         except Error as e:
-            print(f"保存用户文档失败: {e}")
-            self.connection.rollback()
+            logging.error(f"保存用户文档失败: {e}")
             return False
-        finally:
-            cursor.close()
 
     def get_user_documents(self, user_id):
         """获取用户文档列表"""
         try:
-            cursor = self.connection.cursor(dictionary=True)
             query = """
-            SELECT id, file_name, file_path, file_type, created_at 
-            FROM user_documents 
-            WHERE user_id = %s 
+            SELECT id, file_name, file_path, file_type, created_at
+            FROM user_documents
+            WHERE user_id = %s
             ORDER BY created_at DESC
             """
-            cursor.execute(query, (user_id,))
-            return cursor.fetchall()
+            return self.fetch_all("get_user_documents", query, (user_id,), dictionary=True)
         except Error as e:
-            print(f"获取用户文档失败: {e}")
+            logging.error(f"获取用户文档失败: {e}")
             return []
-        finally:
-            cursor.close()
-            
+
+    def get_user_document(self, doc_id, user_id):
+        """获取用户的单个文档记录，不存在或不属于该用户时返回 None"""
+        query = "SELECT file_name, file_path FROM user_documents WHERE id = %s AND user_id = %s"
+        return self.fetch_one("get_user_document", query, (doc_id, user_id), dictionary=True)
+
     def delete_user_document(self, doc_id, user_id):
         """删除用户文档"""
         try:
-            cursor = self.connection.cursor()
             query = "DELETE FROM user_documents WHERE id = %s AND user_id = %s"
-            cursor.execute(query, (doc_id, user_id))
-            self.connection.commit()
-            return cursor.rowcount > 0
+            rowcount, _ = self.execute("delete_user_document", query, (doc_id, user_id))
+            return rowcount > 0
         except Error as e:
-            print(f"删除用户文档失败: {e}")
-            return False
\ No newline at end of file
+            logging.error(f"删除用户文档失败: {e}")
+            return False
+
+
+class AsyncDatabase:
+    """Database 的异步外观：每个方法在专用线程池中执行，不阻塞事件循环
+
+    线程数与连接池大小一致，请求在线程池队列中等待，而不是占用事件循环或争抢同一个连接。
+    """
+
+    def __init__(self, db, max_workers=None):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or db.pool_size, thread_name_prefix="db")
+
+    async def run(self, func, *args, **kwargs):
+        """在数据库线程池中执行任意阻塞调用（如 Auth 的注册 / 登录）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
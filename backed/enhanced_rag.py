@@ -1,20 +1,37 @@
 import os
-import random
+import shutil
 import signal
 import time
 import re
 import asyncio
+import hashlib
 import logging
 from constants import LLM_MODEL_NAME, MAX_SEQ_LENGTH, MAX_NEW_TOKENS, DEFAULT_TEMPERATURE, TOP_P, HISTORY_LIMIT, SEQGPT_MODEL_NAME
+from constants import LLM_POOL_SIZE, LLM_SPECULATIVE_MODE, LLM_CONVERSATION_SPILL_DIR, LLM_CONVERSATION_SESSIONS, LLM_CONVERSATION_TTL
+from constants import LLM_CONVERSATION_CHECK_TURNS
+from constants import KNOWLEDGE_BASE_DIR, RETRIEVAL_TOP_K
+from constants import RELATED_LLM_FALLBACK
+from constants import ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_SIZE, ANSWER_CACHE_PATH, ANSWER_CACHE_FLUSH_INTERVAL
+from constants import ANSWER_REPLAY_CHUNK_SIZE
 from knowledge_processor import EnhancedKnowledgeProcessor
 from hybrid_retriever import HybridRetriever
+from answer_cache import SemanticAnswerCache, context_fingerprint
+from qa_lookup import QALookupIndex
+from llm_engine import LlamaEngine, build_llama
+from prompt_templates import build_prompt, fixed_prefixes, conversation_prefix, build_turn, close_turn
+from retrieval_cache import LRUCache
+from llm_worker import LLMWorker, QueueFullError
+from llm_pool import LLMProcessPool
+from question_classifier import QuestionClassifier
+from related_questions import RelatedQuestionEngine
+from prompt_packer import PromptPacker
+from context_compressor import ContextCompressor
 import torch
 import json
 from typing import AsyncGenerator
 from transformers import TextIteratorStreamer, AutoModelForCausalLM, AutoTokenizer
 import threading
 from queue import Empty
-from llama_cpp import Llama  # 新增导入
 
 HISTORY_LIMIT=6
 os.environ["GGML_CUDA_MAX_DEVICE_BUF"] = "2048"  # 提升显存利用率
@@ -30,19 +47,39 @@ class EnhancedRAG:
         self.processor = EnhancedKnowledgeProcessor()
         self.chunks = self.processor.process_documents()
         self.retriever = HybridRetriever(self.chunks)
+
+        # 提示词 token 预算器（只加载模型词表），预先计算分块 token 数
+        self.packer = PromptPacker()
+        self.packer.index_chunks(self.chunks)
+        self.compressor = ContextCompressor(self.retriever.embed_query, self.retriever.embedding_model.embed_documents)
+
+        # 知识库问答对直查索引
+        self.qa_lookup = QALookupIndex(self.retriever.embedding_model.embed_documents)
+        self.qa_lookup.sync(self.processor.chunk_store)
+        self.related_questions = RelatedQuestionEngine(self.qa_lookup, self.retriever.embed_query)
         
-        self.llm = Llama(
-            model_path=LLM_MODEL_NAME,
-            n_gpu_layers=33,     # 启用全部GPU加速
-            n_ctx=4096,          # 与模型训练长度一致
-            n_batch=512,         # 根据显存调整
-            n_threads=10,  # 在此处设置线程数
-            seed=3029422349,
-            # verbose=True
-        )
+        # 对话 KV 状态只在进程生命周期内有效，清理本进程溢出目录（<spill>/<pid>）中遗留的文件；
+        # 溢出目录可能由多个 API 进程共用，不能清空整个目录
+        shutil.rmtree(os.path.join(LLM_CONVERSATION_SPILL_DIR, str(os.getpid())), ignore_errors=True)
+        if LLM_POOL_SIZE > 0:
+            # 多进程推理池：每个进程各自加载模型，在应用启动时拉起
+            self.llm = None
+            self.llm_worker = LLMProcessPool()
+        else:
+            # Llama 实例只在专属推理线程中使用，请求经有界队列排队
+            self.llm = build_llama()
+            self.llm_worker = LLMWorker(LlamaEngine(self.llm, prefixes=fixed_prefixes()))
         
         self.logger.info(f"模型加载完成，耗时：{time.time() - start_time:.2f}s")
-        self.cache = {}
+        self.answer_cache = SemanticAnswerCache(
+            threshold=ANSWER_CACHE_THRESHOLD,
+            maxsize=ANSWER_CACHE_SIZE,
+            persist_path=ANSWER_CACHE_PATH,
+            flush_interval=ANSWER_CACHE_FLUSH_INTERVAL
+        )
+        # 多轮对话记录：对话ID -> 截至上一轮回答的完整提示词文本
+        self.conversations = LRUCache(LLM_CONVERSATION_SESSIONS, LLM_CONVERSATION_TTL)
+        self._last_prompt = None
 
         # 初始化分类模型（使用SeqGPT）
         self.classification_tokenizer = AutoTokenizer.from_pretrained(SEQGPT_MODEL_NAME)
@@ -51,6 +88,9 @@ class EnhancedRAG:
             self.classification_model = self.classification_model.half().cuda()
         self.classification_model.eval()
         self.GEN_TOK = '[GEN]'
+        # 分层分类：记忆化 -> 关键词规则 / 向量逻辑回归头 -> SeqGPT 兜底
+        self.classifier = QuestionClassifier(self.retriever.embed_query, self._seqgpt_is_math)
+        self.classifier.bootstrap(self.qa_lookup.embeddings)
 
     def _classify_question(self, question: str) -> bool:
         """使用SeqGPT模型进行问题分类"""
@@ -95,120 +135,246 @@ class EnhancedRAG:
         self.logger.info(f"分类结果: {result} => 数学问题? {is_math}")
         return is_math
 
-    def _is_math_question(self, question: str) -> bool:
-        """综合判断数学问题"""
-        # 预处理问题
+    def _seqgpt_is_math(self, question: str) -> bool:
+        """SeqGPT 分类（分类头没有把握时的兜底）"""
         processed_question = question.strip()
         if not processed_question.endswith('?'):
             processed_question += '?'
-        
-        # 使用SeqGPT模型分类
-        is_math = self._classify_question(processed_question)
-        
-        # 保底关键词检查（仅当模型不确定时）
-        if not is_math:
-            math_keywords = {
-                "方程", "函数", "导数", "积分", "矩阵", "概率", 
-                "几何", "代数", "解", "证明", "公式", "计算"
-            }
-            keyword_count = sum(1 for kw in math_keywords if kw in question)
-            is_math = keyword_count >= 2
-        
+        return self._classify_question(processed_question)
+
+    def _is_math_question(self, question: str) -> bool:
+        """综合判断数学问题"""
+        is_math = self.classifier.classify(question)
         self.logger.info(f"最终数学问题判定: {is_math}")
         return is_math
 
 
-    def _build_dialog_context(self, history):
-        """优化的对话上下文构建（修复历史记录更新问题）"""
-        self.logger.info("构建精简对话上下文")
-        
-        MAX_CHARS = 1000  # 字符数限制
-        dialog_entries = []
-        current_length = 0
-        
-        # 按时间倒序处理（从最新到最旧）
-        for msg in reversed(history):
-            content = msg["content"][:50]  # 截断单条消息长度
-            role = "用户" if msg["role"] == "user" else "助手"
-            entry = f"{role}：{content}"
-            entry_length = len(entry)  # 包含角色和内容的完整长度
-            
-            if current_length + entry_length > MAX_CHARS:
-                break
-            
-            dialog_entries.append(entry)  # 临时存储为倒序（最新在前）
-            current_length += entry_length
-        
-        # 反转回正常时间顺序（最旧到最新）
-        dialog_entries.reverse()
-        
-        # 保留最近N条（根据类常量配置）
-        return dialog_entries[-6:] if 6 else dialog_entries
-        
-    def _build_chat_template(self, question, contexts, history):
-        """优化的模板构建（修复历史记录截断问题）"""
-        self.logger.info(f"构建高效对话模板")
-        is_math = self._is_math_question(question)
-        
-        # 动态上下文处理
-        MAX_CONTEXT_CHARS = 1500
-        context_str = "\n".join([doc.page_content[:500] for doc in contexts[:3]]) if contexts else "无相关参考"
-        context_str = context_str[:MAX_CONTEXT_CHARS]
-        
-        # 历史对话（保留最近的合理数量）
-        dialog_history = self._build_dialog_context(history)  # 不再需要额外切片
-        
-        # 智能提示词构建
-        system_prompt = """<|system|>
-【会话记忆】
-{history}
-
-【参考知识】
-{context}
-
-【指令】
-{instruction}
-</s>"""
-
-        instruction = (
-            "作为数学专家，请用Markdown分步推导：1)问题分析 2)公式应用 3)计算过程 4)验证"
-            if is_math else 
-            "作为擅长交流的沟通者，请用自然语言回答，涉及公式时用LaTeX，保持口语化"
+    def _build_chat_template(self, question, contexts, history, is_math):
+        """按 token 预算组装单轮提示词：固定部分之外先放会话记忆，再用剩余预算放参考知识"""
+        budget = self.packer.prompt_budget - self.packer.count(build_prompt(question, "", "", is_math))
+
+        # 会话记忆（不含本轮问题，问题单独放在用户消息里）
+        dialog_history, history_tokens = self.packer.pack_history(history[:-1], budget)
+        context_str, _ = self.packer.pack_context(contexts, budget - history_tokens)
+
+        # 固定指令在前，同类问题共享可复用 KV 状态的前缀
+        prompt = build_prompt(
+            question,
+            history="\n".join(dialog_history) or "无近期对话",
+            context=context_str,
+            is_math=is_math
         )
+        return {
+            "prompt": prompt,
+            "is_math": is_math,
+            "prompt_tokens": self.packer.record(prompt)
+        }
 
-        user_template = """<|user|>
-{question}
-</s>
-<|assistant|>
-"""
+    def _lookup_text(self, contexts):
+        """提示词查找草稿的额外语料：检索分块全文（提示词里的参考知识是按预算截断后的）"""
+        return "\n".join(doc.page_content for doc in contexts)
+
+    def _build_conversation_template(self, conversation_id, question, contexts, history, is_math):
+        """多轮对话模板：沿用该对话上一轮结束时的完整文本，只追加本轮问题
 
+        客户端历史与记录不一致（编辑、重新生成、服务重启），或留给本轮参考知识的预算不足一半时，
+        按客户端历史重建。客户端只发送最近几轮历史，因此按最近几轮问答的指纹而不是轮数比对。
+        """
+        packer = self.packer
+        turn_tokens = packer.count(build_turn(question, ""))
+        pairs = self._history_pairs(history[:-1])
+
+        session = self.conversations.get(conversation_id)
+        if session is not None and session["history_key"] == self._history_key(pairs) \
+                and packer.prompt_budget - session["tokens"] - turn_tokens >= packer.context_tokens // 2:
+            transcript, transcript_tokens = session["transcript"], session["tokens"]
+        else:
+            self.logger.info(f"重建多轮对话文本：{len(pairs)} 轮历史")
+            transcript, transcript_tokens = self._rebuild_transcript(
+                pairs, is_math, packer.prompt_budget - turn_tokens - packer.context_tokens)
+
+        context_str, _ = packer.pack_context(contexts, packer.prompt_budget - transcript_tokens - turn_tokens)
+        prompt = transcript + build_turn(question, context_str)
+        return {
+            "prompt": prompt,
+            "is_math": is_math,
+            "question": question,
+            "pairs": pairs[-LLM_CONVERSATION_CHECK_TURNS:],
+            "prompt_tokens": packer.record(prompt)
+        }
+
+    def _history_pairs(self, previous):
+        """客户端历史中的 (问题, 回答) 对"""
+        pairs = []
+        question = None
+        for msg in previous:
+            if msg["role"] == "user":
+                question = msg["content"]
+            elif msg["role"] == "assistant" and question is not None:
+                pairs.append((question, msg["content"]))
+                question = None
+        return pairs
+
+    def _history_key(self, pairs):
+        """最近几轮问答的指纹，用于判断会话记录是否与客户端历史一致"""
+        tail = pairs[-LLM_CONVERSATION_CHECK_TURNS:]
+        text = "\x00".join(f"{question.strip()}\x01{answer.strip()}" for question, answer in tail)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _rebuild_transcript(self, pairs, is_math, budget):
+        """按客户端历史重建对话文本，从最近的轮次往前保留到 token 上限，返回 (文本, token 数)"""
+        prefix = conversation_prefix(is_math)
+        kept = []
+        n_tokens = self.packer.count(prefix)
+        for question, answer in reversed(pairs):
+            block = build_turn(question) + close_turn(answer)
+            block_tokens = self.packer.count(block)
+            if n_tokens + block_tokens > budget:
+                break
+            kept.append(block)
+            n_tokens += block_tokens
+        return prefix + "".join(reversed(kept)), n_tokens
+
+    def _record_conversation_turn(self, conversation_id, template, raw_answer, answer):
+        """记录本轮结束时的对话文本，与推理侧保存的 KV 状态对应"""
+        if conversation_id and raw_answer:
+            ending = close_turn(raw_answer)
+            self.conversations.set(conversation_id, {
+                "transcript": template["prompt"] + ending,
+                "tokens": template["prompt_tokens"] + self.packer.count(ending),
+                "history_key": self._history_key(template["pairs"] + [(template["question"], answer)])
+            })
+
+    def _build_template(self, question, contexts, history, is_math, conversation_id=None):
+        if conversation_id:
+            return self._build_conversation_template(conversation_id, question, contexts, history, is_math)
+        return self._build_chat_template(question, contexts, history, is_math)
+
+    async def _prepare(self, question, history):
+        """请求流水线的前置阶段：检索阶段（_retrieve）-> 提示词阶段（_prepare_prompt）
+
+        返回 {"answer": 可直接返回的答案或 None, "contexts", "prompt_contexts", "is_math", "cacheable", "sources"}
+        其中 contexts 为检索原文（答案缓存指纹、草稿语料、参考来源），prompt_contexts 为压缩后放入提示词的分块
+        """
+        stage = await self._retrieve(question)
+        if stage["answer"] is None:
+            await self._prepare_prompt(question, history, stage)
+        return stage
+
+    async def _retrieve(self, question):
+        """检索阶段：问答直查 -> 检索与问题分类并发
+
+        检索和分类互不依赖，直到组装提示词时才汇合；参考来源在这一阶段确定，流式接口可以立即发出。
+        """
+        loop = asyncio.get_running_loop()
+        curated = await loop.run_in_executor(None, self._match_curated_item, question)
+        if curated is not None:
+            return {"answer": curated["output"], "contexts": [], "prompt_contexts": [], "is_math": None, "cacheable": False,
+                    "sources": [self._source_entry(curated["source"], curated["instruction"])]}
+
+        start_time = time.perf_counter()
+        contexts, is_math = await asyncio.gather(
+            self.retriever.retrieve(question, top_k=RETRIEVAL_TOP_K),
+            loop.run_in_executor(None, self._is_math_question, question)
+        )
+        self.logger.info(f"检索与分类并发完成，耗时 {(time.perf_counter() - start_time) * 1000:.1f}ms，"
+                         f"检索到{len(contexts)}条相关上下文")
+        return {"answer": None, "contexts": contexts, "prompt_contexts": contexts, "is_math": is_math,
+                "cacheable": False, "sources": self._context_sources(contexts)}
+
+    async def _prepare_prompt(self, question, history, stage):
+        """提示词阶段：语义答案缓存 -> 参考知识压缩，结果写回 stage
+
+        答案缓存命中时分类结果不再使用，但已写入分类记忆，相关问题生成可以直接复用。
+        """
+        loop = asyncio.get_running_loop()
+        contexts = stage["contexts"]
+        cacheable = self._is_cacheable(history)
+        answer = await loop.run_in_executor(None, self._lookup_cached_answer, question, contexts) if cacheable else None
+
+        # 只保留与问题相关的句子和公式块，减少预填充 token
+        if answer is None:
+            stage["prompt_contexts"] = await loop.run_in_executor(None, self.compressor.compress, question, contexts)
+        stage["answer"] = answer
+        stage["cacheable"] = cacheable
+
+    def _source_entry(self, path, snippet):
+        """参考来源条目，路径相对知识库目录（与 /v1/reference_files 的条目格式一致）"""
+        if path.startswith(KNOWLEDGE_BASE_DIR):
+            file_path = os.path.relpath(path, KNOWLEDGE_BASE_DIR).replace(os.sep, "/")
+        else:
+            file_path = os.path.basename(path)
         return {
-            "prompt": system_prompt.format(
-                history="\n".join(dialog_history) or "无近期对话",
-                context=context_str,
-                instruction=instruction
-            ) + user_template.format(question=question),
-            "is_math": is_math
+            "file_name": os.path.basename(path),
+            "file_path": file_path,
+            "download_url": f"/api/download?file_path={file_path}",
+            "snippet": snippet[:200]
         }
 
+    def _context_sources(self, contexts):
+        """检索分块对应的参考来源（按文件去重，保持排序）"""
+        sources = []
+        seen = set()
+        for doc in contexts:
+            path = doc.metadata.get("source", "")
+            if path in seen:
+                continue
+            seen.add(path)
+            sources.append(self._source_entry(path, doc.page_content))
+        return sources
+
+    def _match_curated_item(self, question):
+        """在知识库问答对中查找与问题重复或近似重复的条目，命中时返回该问答对"""
+        match = self.qa_lookup.match(question, self.retriever.embed_query(question))
+        if match is None:
+            return None
+        item, score, method = match
+        self.logger.info(f"问答直查命中（{method}，相似度 {score:.3f}）: {item['instruction'][:50]}")
+        return item
+
+    def _is_cacheable(self, history):
+        """只有首轮提问（没有之前的对话）的答案才与历史无关，可以缓存"""
+        return sum(1 for msg in history if msg["role"] == "assistant") == 0
+
+    def _lookup_cached_answer(self, question, contexts):
+        """按问题向量和检索上下文指纹查找缓存答案"""
+        self.answer_cache.on_index_change(self.retriever.index_version)
+        return self.answer_cache.lookup(self.retriever.embed_query(question), context_fingerprint(contexts))
+
+    def _store_cached_answer(self, question, contexts, answer):
+        if answer:
+            self.answer_cache.store(question, self.retriever.embed_query(question), context_fingerprint(contexts), answer)
+
     @property
     def last_prompt(self):
         """用于获取最后生成的prompt"""
         return self._last_prompt  # 在ask方法中保存生成的prompt
 
-    async def ask(self, question: str, history: list = []) -> str:
-        """同步生成完整回答"""
+    async def ask(self, question: str, history: list = [], conversation_id: str = None, usage: dict = None) -> str:
+        """同步生成完整回答
+
+        传入 usage 字典时写入本次请求的 prompt_tokens（并发请求各自传入，不共享实例状态）
+        """
+        if usage is None:
+            usage = {}
+        usage["prompt_tokens"] = 0
         try:
             self.logger.info(f"开始处理问题: {question[:50]}...")
-            
-            # 检索上下文
-            contexts = await self.retriever.retrieve(question)
-            self.logger.info(f"检索到{len(contexts)}条相关上下文")
+
+            # 问答直查、检索与问题分类、答案缓存
+            stage = await self._prepare(question, history)
+            if stage["answer"] is not None:
+                self._last_prompt = None
+                return stage["answer"]
+            contexts = stage["contexts"]
+            cacheable = stage["cacheable"]
             
             # 构建prompt
-            template = self._build_chat_template(question, contexts, history)
+            template = self._build_template(question, stage["prompt_contexts"], history, stage["is_math"], conversation_id)
             prompt = template["prompt"]
             self._last_prompt = prompt
+            usage["prompt_tokens"] = template["prompt_tokens"]
+            self.logger.info(f"提示词 {template['prompt_tokens']} tokens")
 
             # 新增：打印提示词模板到控制台
             print("\n=== 生成的提示词模板 ===\n")
@@ -226,13 +392,23 @@ class EnhancedRAG:
                 "mirostat_mode": 2,          # 智能采样
                 "repeat_penalty": 1.2
             }
+            if conversation_id:
+                generation_config["conversation_id"] = conversation_id
+            if LLM_SPECULATIVE_MODE == "prompt_lookup":
+                generation_config["lookup_text"] = self._lookup_text(contexts)
             
-            # 生成回答
-            response = self.llm.create_completion(**generation_config)
+            # 生成回答（推理线程排队执行）
+            response = await self.llm_worker.complete(generation_config)
             full_text = response["choices"][0]["text"]
             
-            return self._postprocess_response(full_text, prompt)
+            answer = self._postprocess_response(full_text, prompt)
+            if cacheable:
+                await asyncio.get_running_loop().run_in_executor(None, self._store_cached_answer, question, contexts, answer)
+            self._record_conversation_turn(conversation_id, template, full_text, answer)
+            return answer
             
+        except QueueFullError:
+            raise
         except Exception as e:
             self.logger.error(f"处理异常：{str(e)}", exc_info=True)
             return "系统处理问题时遇到错误，请稍后再试。"
@@ -240,7 +416,9 @@ class EnhancedRAG:
     def _postprocess_response(self, response, prompt):
         """后处理优化响应结果"""
         self.logger.info("开始后处理响应")
-        response = response[len(prompt):].strip()
+        if response.startswith(prompt):
+            response = response[len(prompt):]
+        response = response.strip()
 
         # 清理对话历史残留
         response = re.sub(r'【对话上下文】.*?【当前问题】', '', response, flags=re.DOTALL)
@@ -250,18 +428,38 @@ class EnhancedRAG:
         return response.strip()
 
 
-    async def ask_stream(self, question: str, history: list = []) -> AsyncGenerator[str, None]:
-        """流式生成回答"""
+    async def ask_stream(self, question: str, history: list = [], conversation_id: str = None) -> AsyncGenerator[str, None]:
+        """流式生成回答
+
+        先产出一个 {"event": "sources", "data": [...]} 事件（检索到的参考来源），之后是回答文本帧
+        """
         try:
             self.logger.info(f"开始流式处理问题: {question[:50]}...")
-            
-            # 检索上下文
-            contexts = await self.retriever.retrieve(question)
+
+            # 问答直查、检索与问题分类
+            stage = await self._retrieve(question)
+
+            # 参考来源在检索返回后立即发出（先于答案缓存查找和压缩），前端可以立即渲染
+            yield {"event": "sources", "data": stage["sources"]}
+
+            # 答案缓存、参考知识压缩
+            if stage["answer"] is None:
+                await self._prepare_prompt(question, history, stage)
+
+            # 直查或缓存命中时直接快速回放
+            if stage["answer"] is not None:
+                answer = stage["answer"]
+                for i in range(0, len(answer), ANSWER_REPLAY_CHUNK_SIZE):
+                    yield answer[i:i + ANSWER_REPLAY_CHUNK_SIZE]
+                return
+            contexts = stage["contexts"]
+            cacheable = stage["cacheable"]
             
             # 构建prompt
-            template = self._build_chat_template(question, contexts, history)
+            template = self._build_template(question, stage["prompt_contexts"], history, stage["is_math"], conversation_id)
             prompt = template["prompt"]
             self._last_prompt = prompt
+            self.logger.info(f"提示词 {template['prompt_tokens']} tokens")
 
             # 新增：打印提示词模板到控制台
             print("\n=== 生成的提示词模板 ===\n")
@@ -277,37 +475,31 @@ class EnhancedRAG:
                 "stop": ["</s>", "[INST]"],
                 "stream": True,
             }
+            if conversation_id:
+                stream_config["conversation_id"] = conversation_id
+            if LLM_SPECULATIVE_MODE == "prompt_lookup":
+                stream_config["lookup_text"] = self._lookup_text(contexts)
             
-            # 创建流式生成器
-            stream = self.llm.create_completion(**stream_config)
-            
-            buffer = []
-            async for chunk in self._async_stream_wrapper(stream):
-                delta = chunk["choices"][0]["text"]
-                
-                # 缓冲区管理
-                buffer.append(delta)
-                if len(buffer) >= 3 or random.random() < 0.2:  # 动态flush
-                    yield "".join(buffer)
-                    buffer.clear()
-                    
-            # 返回剩余内容
-            if buffer:
-                yield "".join(buffer)
+            # 推理线程排队生成，按时间 / 大小合并成帧；客户端断开时本生成器被关闭，推理随之取消
+            answer_parts = []
+            async for text in self.llm_worker.stream(stream_config):
+                answer_parts.append(text)
+                yield text
+
+            full_text = "".join(answer_parts)
+            if cacheable:
+                # 与 ask 一样缓存后处理后的答案，缓存命中时两种接口返回相同的文本
+                answer = self._postprocess_response(full_text, prompt)
+                await asyncio.get_running_loop().run_in_executor(None, self._store_cached_answer, question, contexts, answer)
+            self._record_conversation_turn(conversation_id, template, full_text, full_text)
                 
+        except QueueFullError as e:
+            self.logger.warning(f"流式生成被拒绝: {e}")
+            yield "⚠️ 当前提问人数较多，请稍后重试"
         except Exception as e:
             self.logger.error(f"流式生成失败: {str(e)}")
             yield "⚠️ 服务响应异常，请稍后重试"
 
-    async def _async_stream_wrapper(self, generator):
-        """将同步生成器转换为异步"""
-        while True:
-            try:
-                yield next(generator)
-            except StopIteration:
-                break
-            await asyncio.sleep(0.001)  # 防止事件循环阻塞
-
     async def _async_streamer(self, streamer):
         """改进的异步流处理器"""
         while True:
@@ -346,10 +538,26 @@ class EnhancedRAG:
         return text
 
     async def generate_related_questions(self, original_question: str, num_questions: int = 5) -> list:
+        """相关问题：优先从知识库问答对中推荐，不足时按配置调用大模型补足"""
+        try:
+            questions = await asyncio.get_running_loop().run_in_executor(
+                None, self.related_questions.suggest, original_question, num_questions)
+        except Exception as e:
+            self.logger.error(f"知识库相关问题推荐异常：{str(e)}")
+            questions = []
+        if len(questions) >= num_questions or not RELATED_LLM_FALLBACK:
+            return questions
+
+        generated = await self._generate_related_questions_llm(original_question, num_questions)
+        seen = set(questions)
+        questions += [q for q in generated if q not in seen]
+        return questions[:num_questions]
+
+    async def _generate_related_questions_llm(self, original_question: str, num_questions: int = 5) -> list:
         """生成相关问题（适配GGUF版本）"""
         try:
             self.logger.info(f"开始生成相关问题，原始问题: {original_question}")
-            is_math = self._is_math_question(original_question)
+            is_math = await asyncio.get_running_loop().run_in_executor(None, self._is_math_question, original_question)
 
             # 强化格式要求的提示词
             prompt = f"""<|system|>
@@ -368,15 +576,15 @@ class EnhancedRAG:
 <|assistant|>
 """
 
-            # 使用GGUF模型生成
-            response = self.llm.create_completion(
-                prompt=prompt,
-                max_tokens=200,
-                temperature=0.6,
-                top_p=0.9,
-                stop=["</s>", "[INST]"],
-                echo=False  # 不返回原始prompt
-            )
+            # 使用GGUF模型生成（推理线程排队执行）
+            response = await self.llm_worker.complete({
+                "prompt": prompt,
+                "max_tokens": 200,
+                "temperature": 0.6,
+                "top_p": 0.9,
+                "stop": ["</s>", "[INST]"],
+                "echo": False  # 不返回原始prompt
+            })
 
             # 提取生成内容
             full_response = response["choices"][0]["text"]
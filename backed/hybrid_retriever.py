@@ -1,10 +1,16 @@
+import time
 import asyncio
+import logging
 from langchain.vectorstores import Chroma
-from langchain.retrievers import BM25Retriever, EnsembleRetriever
-from sentence_transformers import CrossEncoder
 from langchain.embeddings import HuggingFaceEmbeddings
-from constants import VECTOR_DB_DIR, EMBED_MODEL_NAME, RERANKER_MODEL_NAME
-import torch
+from sparse_index import SparseIndex
+from rank_fusion import fuse_rankings
+from reranker import RerankEngine
+from retrieval_cache import RetrievalCache
+from constants import (VECTOR_DB_DIR, VECTOR_DB_BATCH_SIZE, SPARSE_INDEX_BATCH_SIZE, EMBED_MODEL_NAME,
+                       DENSE_TOP_K, SPARSE_TOP_K, FUSION_TOP_K, FUSION_WEIGHTS,
+                       FUSION_METHOD, RRF_K, RETRIEVAL_CACHE_SIZES, RETRIEVAL_CACHE_TTL)
+import threading
 
 class HybridRetriever:
     def __init__(self, chunks):
@@ -14,47 +20,190 @@ class HybridRetriever:
             model_name=EMBED_MODEL_NAME
         )
 
-        # 初始化向量数据库
-        self.vector_db = Chroma.from_documents(
-            chunks,
-            embedding=self.embedding_model,
-            persist_directory=VECTOR_DB_DIR
+        # 按分块ID索引的文档，用于增量更新
+        self._lock = threading.Lock()
+        self.documents = {chunk.metadata["chunk_id"]: chunk for chunk in chunks}
+
+        # 打开已持久化的向量数据库，只嵌入缺失的分块并删除孤立分块
+        self.vector_db = Chroma(
+            persist_directory=VECTOR_DB_DIR,
+            embedding_function=self.embedding_model
         )
+        self._sync_vector_db()
+
+        # 加载持久化的稀疏索引并增量同步
+        self.sparse_index = SparseIndex()
+        self._sync_sparse_index()
+        self.last_timings = {}
+
+        # 检索多级缓存，索引每次增删都会递增版本号
+        self.index_version = 0
+        self.cache = RetrievalCache(**RETRIEVAL_CACHE_SIZES, ttl=RETRIEVAL_CACHE_TTL)
+
+        # 加载重排序引擎
+        self.reranker = RerankEngine()
+
+    def _sync_vector_db(self):
+        """对比持久化集合与当前分块的ID和内容哈希，增量同步"""
+        start_time = time.time()
+        existing = self.vector_db.get(include=["metadatas"])
+        existing_hashes = {
+            chunk_id: (metadata or {}).get("content_hash")
+            for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])
+        }
+
+        missing = [
+            chunk for chunk_id, chunk in self.documents.items()
+            if existing_hashes.get(chunk_id) != chunk.metadata["content_hash"]
+        ]
+        orphan_ids = [chunk_id for chunk_id in existing_hashes if chunk_id not in self.documents]
+
+        for i in range(0, len(orphan_ids), VECTOR_DB_BATCH_SIZE):
+            self.vector_db.delete(ids=orphan_ids[i:i + VECTOR_DB_BATCH_SIZE])
+        for i in range(0, len(missing), VECTOR_DB_BATCH_SIZE):
+            batch = missing[i:i + VECTOR_DB_BATCH_SIZE]
+            self.vector_db.add_documents(batch, ids=[chunk.metadata["chunk_id"] for chunk in batch])
+        if (missing or orphan_ids) and hasattr(self.vector_db, "persist"):
+            self.vector_db.persist()
+
+        logging.info(f"向量库同步完成：已有 {len(existing_hashes)} 条，新增嵌入 {len(missing)} 条，"
+                     f"删除孤立 {len(orphan_ids)} 条，耗时 {time.time() - start_time:.2f}s")
+
+    def _sync_sparse_index(self):
+        """对比稀疏索引与当前分块的ID和内容哈希，增量同步"""
+        start_time = time.time()
+        missing = [
+            chunk for chunk_id, chunk in self.documents.items()
+            if self.sparse_index.content_hash(chunk_id) != chunk.metadata["content_hash"]
+        ]
+        orphan_ids = [chunk_id for chunk_id in self.sparse_index.chunk_ids
+                      if chunk_id in self.sparse_index and chunk_id not in self.documents]
+        self.sparse_index.delete(orphan_ids)
+        for i in range(0, len(missing), SPARSE_INDEX_BATCH_SIZE):
+            self.sparse_index.add_documents(missing[i:i + SPARSE_INDEX_BATCH_SIZE])
+        if missing or orphan_ids:
+            self.sparse_index.save()
+        logging.info(f"稀疏索引同步完成：新增 {len(missing)} 条，删除孤立 {len(orphan_ids)} 条，"
+                     f"耗时 {time.time() - start_time:.2f}s")
+
+    def add_documents(self, chunks):
+        """增量添加分块（按分块ID覆盖写入）"""
+        if not chunks:
+            return 0
+        with self._lock:
+            ids = [chunk.metadata["chunk_id"] for chunk in chunks]
+            self.vector_db.add_documents(chunks, ids=ids)
+            self.sparse_index.add_documents(chunks)
+            for chunk_id, chunk in zip(ids, chunks):
+                self.documents[chunk_id] = chunk
+            self._bump_index_version()
+        return len(chunks)
 
-        # 初始化 BM25 检索器
-        self.bm25_retriever = BM25Retriever.from_documents(chunks, k=5)
+    def delete_documents(self, chunk_ids):
+        """按分块ID增量删除分块"""
+        chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id in self.documents]
+        if not chunk_ids:
+            return 0
+        with self._lock:
+            self.vector_db.delete(ids=chunk_ids)
+            self.sparse_index.delete(chunk_ids)
+            for chunk_id in chunk_ids:
+                self.documents.pop(chunk_id, None)
+            self._bump_index_version()
+        return len(chunk_ids)
 
-        # 初始化集成检索器
-        self.ensemble_retriever = EnsembleRetriever(
-            retrievers=[
-                self.vector_db.as_retriever(search_kwargs={"k": 5}),
-                self.bm25_retriever
-            ],
-            weights=[0.6, 0.4]
+    def _bump_index_version(self):
+        self.index_version += 1
+        self.cache.on_index_change(self.index_version)
+
+    def persist(self):
+        """持久化稀疏索引（向量库由 Chroma 自行持久化）"""
+        with self._lock:
+            self.sparse_index.save()
+            if hasattr(self.vector_db, "persist"):
+                self.vector_db.persist()
+
+    def embed_query(self, query):
+        """计算查询向量（带缓存）"""
+        embedding = self.cache.get_embedding(query)
+        if embedding is None:
+            embedding = self.embedding_model.embed_query(query)
+            self.cache.set_embedding(query, embedding)
+        return embedding
+
+    def _dense_search(self, query, k):
+        """稠密检索，返回 [(分块ID, 分数)]，分数为负距离"""
+        results = self.vector_db.similarity_search_by_vector_with_relevance_scores(self.embed_query(query), k=k)
+        return [(doc.metadata.get("chunk_id"), -distance) for doc, distance in results]
+
+    def _sparse_search(self, query, k):
+        """稀疏检索，返回 [(分块ID, 分数)]"""
+        return self.sparse_index.search(query, k)
+
+    @staticmethod
+    def _timed(func, *args):
+        start_time = time.perf_counter()
+        result = func(*args)
+        return result, (time.perf_counter() - start_time) * 1000
+
+    async def retrieve_candidates(self, query):
+        """并发执行稠密和稀疏两路检索并融合，返回去重后的候选文档"""
+        index_version = self.cache.index_version  # 检索开始前记录，检索期间索引更新时不缓存结果
+        cached_ids = self.cache.get_candidates(query)
+        if cached_ids is not None:
+            self.last_timings = {"dense_ms": 0.0, "sparse_ms": 0.0, "fusion_ms": 0.0, "candidates_cached": True}
+            return [self.documents[chunk_id] for chunk_id in cached_ids if chunk_id in self.documents]
+
+        loop = asyncio.get_running_loop()
+        (dense, dense_ms), (sparse, sparse_ms) = await asyncio.gather(
+            loop.run_in_executor(None, self._timed, self._dense_search, query, DENSE_TOP_K),
+            loop.run_in_executor(None, self._timed, self._sparse_search, query, SPARSE_TOP_K),
         )
 
-        # 加载重排序模型
-        self.reranker = CrossEncoder(
-            model_name_or_path=RERANKER_MODEL_NAME,
-            device="cuda" if torch.cuda.is_available() else "cpu"
+        start_time = time.perf_counter()
+        fused = fuse_rankings(
+            [dense, sparse],
+            FUSION_WEIGHTS,
+            method=FUSION_METHOD,
+            rrf_k=RRF_K,
+            top_k=FUSION_TOP_K
         )
+        candidates = [self.documents[chunk_id] for chunk_id, _ in fused if chunk_id in self.documents]
+        fusion_ms = (time.perf_counter() - start_time) * 1000
+        self.cache.set_candidates(query, [doc.metadata["chunk_id"] for doc in candidates], index_version)
+
+        self.last_timings = {"dense_ms": dense_ms, "sparse_ms": sparse_ms, "fusion_ms": fusion_ms}
+        logging.info(f"检索耗时：稠密 {dense_ms:.1f}ms（{len(dense)}条），稀疏 {sparse_ms:.1f}ms（{len(sparse)}条），"
+                     f"融合 {fusion_ms:.1f}ms（{len(candidates)}条）")
+        return candidates
+
+    def _rerank(self, query, docs):
+        """重排序（只为未缓存的 (问题, 分块) 对调用模型），返回按分数降序的 [(文档, 分数)]"""
+        docs = docs[:self.reranker.max_candidates]
+        scores = [self.cache.get_rerank_score(query, doc.metadata["chunk_id"]) for doc in docs]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            new_scores = self.reranker.predict(query, [docs[i].page_content for i in missing])
+            for i, score in zip(missing, new_scores.tolist()):
+                scores[i] = score
+                self.cache.set_rerank_score(query, docs[i].metadata["chunk_id"], score)
+        return sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
+
+    def cache_stats(self):
+        return self.cache.stats()
 
     async def retrieve(self, query, top_k=1):
         """检索相关文档"""
         try:
             loop = asyncio.get_running_loop()
-            relevant_docs_task = loop.run_in_executor(None, self.ensemble_retriever.get_relevant_documents, query)
-            relevant_docs = await relevant_docs_task
+            relevant_docs = await self.retrieve_candidates(query)
             if not relevant_docs:
                 return []
-            scores_task = loop.run_in_executor(None, self.reranker.predict, [[query, doc.page_content] for doc in relevant_docs])
-            scores = await scores_task
+            start_time = time.perf_counter()
+            ranked_docs = await loop.run_in_executor(None, self._rerank, query, relevant_docs)
+            self.last_timings["rerank_ms"] = (time.perf_counter() - start_time) * 1000
             threshold = 0.85
-            relevant_docs = [doc for doc, score in zip(relevant_docs, scores) if score > threshold]
-            ranked_docs = sorted(zip(relevant_docs, scores), key=lambda x: x[1], reverse=True)
-            return [doc for doc, _ in ranked_docs[:top_k]]
+            return [doc for doc, score in ranked_docs if score > threshold][:top_k]
         except Exception as e:
-            import logging
             logging.error(f"检索过程中发生错误: {str(e)}", exc_info=True)
-            return []
-        
\ No newline at end of file
+            return []
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from knowledge_processor import LOADER_MAPPING
+from constants import INDEX_PERSIST_INTERVAL
+
+
+class IndexJob:
+    """单个索引任务的状态"""
+
+    def __init__(self, action, file_path, user_id=None):
+        self.job_id = str(uuid.uuid4())
+        self.action = action  # "upsert" 或 "delete"
+        self.file_path = file_path
+        self.user_id = user_id
+        self.status = "pending"
+        self.error = None
+        self.chunks_added = 0
+        self.chunks_removed = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "action": self.action,
+            "status": self.status,
+            "error": self.error,
+            "chunks_added": self.chunks_added,
+            "chunks_removed": self.chunks_removed,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IndexJobQueue:
+    """后台索引任务队列：按顺序增量更新分块存储和在线检索器
+
+    索引变更只记为未持久化，由定时任务每隔 persist_interval 秒（队列空闲时）写盘一次，停止时写入最后的变更
+    """
+
+    def __init__(self, rag, max_jobs_kept=1000, persist_interval=INDEX_PERSIST_INTERVAL):
+        self.rag = rag
+        self.max_jobs_kept = max_jobs_kept
+        self.persist_interval = persist_interval
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._worker_task = None
+        self._persist_task = None
+        self._dirty = 0  # 上次持久化之后完成的任务数
+
+    async def start(self):
+        """在事件循环中启动后台工作协程"""
+        if self._worker_task is None:
+            self._queue = asyncio.Queue()
+            self._worker_task = asyncio.create_task(self._worker())
+            self._persist_task = asyncio.create_task(self._persist_loop())
+
+    async def stop(self):
+        for task in (self._worker_task, self._persist_task):
+            if task is not None:
+                task.cancel()
+        self._worker_task = None
+        self._persist_task = None
+        await self.persist()
+
+    async def persist(self):
+        """有未持久化的变更时写盘"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, 0
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.rag.retriever.persist)
+            logging.info(f"索引已持久化（{dirty} 个任务的变更）")
+        except Exception as e:
+            self._dirty += dirty
+            logging.error(f"索引持久化失败: {e}", exc_info=True)
+
+    async def _persist_loop(self):
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            # 仍有任务排队时推迟，避免连续上传时重复写盘
+            if self._queue.qsize() == 0:
+                await self.persist()
+
+    def submit(self, action, file_path, user_id=None):
+        """提交索引任务，立即返回任务对象；没有对应加载器的文件类型不能建索引，抛出 ValueError"""
+        if action == "upsert" and os.path.splitext(file_path)[1].lower() not in LOADER_MAPPING:
+            raise ValueError(f"不支持索引该文件类型: {file_path}")
+        job = IndexJob(action, file_path, user_id)
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > self.max_jobs_kept:
+            self.jobs.popitem(last=False)
+        self._queue.put_nowait(job)
+        logging.info(f"索引任务已提交: {job.job_id} {action} {file_path}")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def pending_count(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                await loop.run_in_executor(None, self._run, job)
+                self._dirty += 1
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                logging.error(f"索引任务失败: {job.job_id} {job.file_path}: {e}", exc_info=True)
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
+            logging.info(f"索引任务完成: {job.job_id} 状态={job.status} "
+                         f"新增={job.chunks_added} 删除={job.chunks_removed} "
+                         f"耗时={job.finished_at - job.started_at:.2f}s")
+
+    def _run(self, job):
+        """在线程池中执行：只处理受影响文件的分块"""
+        processor = self.rag.processor
+        retriever = self.rag.retriever
+
+        if job.action == "delete":
+            removed_ids = processor.remove_file(job.file_path)
+            job.chunks_removed = retriever.delete_documents(removed_ids)
+        elif job.action == "upsert":
+            entry = processor.chunk_store.get_entry(job.file_path)
+            old_ids = set(entry["chunk_ids"]) if entry else set()
+            chunks = processor.process_file(job.file_path)
+            self.rag.packer.index_chunks(chunks)
+            new_ids = {chunk.metadata["chunk_id"] for chunk in chunks}
+            job.chunks_removed = retriever.delete_documents(list(old_ids - new_ids))
+            job.chunks_added = retriever.add_documents(
+                [chunk for chunk in chunks if chunk.metadata["chunk_id"] not in retriever.documents]
+            )
+        else:
+            raise ValueError(f"未知的索引操作: {job.action}")
+
+        self.rag.chunks = processor._load_processed_chunks()
+        if job.file_path.lower().endswith((".json", ".jsonl")):
+            self.rag.qa_lookup.sync(processor.chunk_store)
@@ -4,13 +4,23 @@ import logging
 import hashlib
 from langchain_experimental.text_splitter import SemanticChunker
 from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.document_loaders import DirectoryLoader, PyPDFLoader, TextLoader
+from langchain.document_loaders import PyPDFLoader, TextLoader
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from json_loader import JSONLoader
 from jsonl_loader import JSONLLoader
+from chunk_store import ChunkStore, assign_chunk_ids
 from constants import KNOWLEDGE_BASE_DIR, EMBED_MODEL_NAME, MIN_KNOWLEDGE_BASE_DOCS
 
+# 文件扩展名与加载器的对应关系
+LOADER_MAPPING = {
+    ".pdf": PyPDFLoader,
+    ".txt": TextLoader,
+    ".md": TextLoader,
+    ".json": JSONLoader,
+    ".jsonl": JSONLLoader,
+}
+
 class EnhancedKnowledgeProcessor:
     def __init__(self):
         self.embed_model = HuggingFaceEmbeddings(
@@ -19,7 +29,9 @@ class EnhancedKnowledgeProcessor:
             encode_kwargs={"batch_size": 8}
         )
         self._validate_knowledge_base()
-        self.file_status_cache = {}  # 用于缓存文件状态
+        self.chunk_store = ChunkStore()  # 持久化的文件状态和分块
+        self._cached_chunks = None
+        self._chunker = None
 
     def _validate_knowledge_base(self):
         """确保知识库满足最小数据量要求"""
@@ -59,88 +71,105 @@ class EnhancedKnowledgeProcessor:
         return hasher.hexdigest()
 
     def process_documents(self):
-        """处理知识库中的所有文档，动态更新知识库"""
+        """处理知识库中的所有文档，动态更新知识库（仅重新处理新增、修改和删除的文件）"""
         # 检查知识库目录是否存在
         if not os.path.exists(KNOWLEDGE_BASE_DIR):
             os.makedirs(KNOWLEDGE_BASE_DIR)
             return []
 
-        # 获取知识库目录中的所有文件
+        # 获取知识库目录中所有支持的文件
         file_paths = []
         for root, _, files in os.walk(KNOWLEDGE_BASE_DIR):
             for file in files:
-                file_paths.append(os.path.join(root, file))
+                if os.path.splitext(file)[1].lower() in LOADER_MAPPING:
+                    file_paths.append(os.path.join(root, file))
 
-        # 检查文件状态，只处理新增或修改的文件
+        # 检查文件状态：大小和修改时间不变直接跳过，否则再比较哈希
         updated_files = []
         for file_path in file_paths:
-            file_hash = self.get_file_hash(file_path)
-            file_mtime = os.path.getmtime(file_path)
-
-            # 如果文件不在缓存中，或者哈希值或修改时间发生变化，则需要重新处理
-            if file_path not in self.file_status_cache:
-                updated_files.append(file_path)
-            else:
-                cached_hash, cached_mtime = self.file_status_cache[file_path]
-                if file_hash != cached_hash or file_mtime != cached_mtime:
-                    updated_files.append(file_path)
-
-        # 处理新增或修改的文件
-        if updated_files:
-            self._process_updated_files(updated_files)
+            stat = os.stat(file_path)
+            if self.chunk_store.is_unchanged(file_path, stat.st_size, stat.st_mtime):
+                continue
+            entry = self.chunk_store.get_entry(file_path)
+            if entry is not None and entry["hash"] == self.get_file_hash(file_path):
+                self.chunk_store.touch(file_path, stat.st_size, stat.st_mtime)
+                continue
+            updated_files.append(file_path)
+
+        # 已从知识库中删除的文件
+        deleted_files = self.chunk_store.paths() - set(file_paths)
+
+        if updated_files or deleted_files:
+            logging.info(f"知识库变更：新增/修改 {len(updated_files)} 个文件，删除 {len(deleted_files)} 个文件")
+        for file_path in deleted_files:
+            self.remove_file(file_path, flush=False)
+        self._process_updated_files(updated_files)
+        self.chunk_store.flush()
 
         # 返回所有文档的分块
         return self._load_processed_chunks()
 
     def _process_updated_files(self, updated_files):
         """处理新增或修改的文件"""
-        loaders = [
-            DirectoryLoader(KNOWLEDGE_BASE_DIR, glob="**/*.pdf", loader_cls=PyPDFLoader),
-            DirectoryLoader(KNOWLEDGE_BASE_DIR, glob="**/*.txt", loader_cls=TextLoader),
-            DirectoryLoader(KNOWLEDGE_BASE_DIR, glob="**/*.json", loader_cls=JSONLoader),
-            DirectoryLoader(KNOWLEDGE_BASE_DIR, glob="**/*.jsonl", loader_cls=JSONLLoader),
-        ]
-
-        # 加载所有文件
-        all_documents = []
-        for loader in loaders:
-            all_documents.extend(loader.load())
-
-        # 使用语义分块器处理文档
-        chunker = SemanticChunker(
-            embeddings=self.embed_model,
-            breakpoint_threshold_amount=82,
-            add_start_index=True
-        )
-        base_chunks = chunker.split_documents(all_documents)
+        for file_path in updated_files:
+            try:
+                self.process_file(file_path, flush=False)
+            except Exception as e:
+                logging.error(f"处理文件 {file_path} 时出错: {e}", exc_info=True)
+
+    def _get_chunker(self):
+        """语义分块器（延迟创建，复用）"""
+        if self._chunker is None:
+            self._chunker = SemanticChunker(
+                embeddings=self.embed_model,
+                breakpoint_threshold_amount=82,
+                add_start_index=True
+            )
+        return self._chunker
 
-        # 根据内容类型进一步分割
+    def _split_documents(self, documents):
+        """语义分块后根据内容类型进一步分割"""
+        base_chunks = self._get_chunker().split_documents(documents)
         final_chunks = []
         for chunk in base_chunks:
             content_type = self._detect_content_type(chunk.page_content)
             splitter = self._get_text_splitter(content_type)
             final_chunks.extend(splitter.split_documents([chunk]))
-
-        # 更新分块缓存
-        self._save_processed_chunks(final_chunks)
-
-        # 更新文件状态缓存
-        for file_path in updated_files:
-            file_hash = self.get_file_hash(file_path)
-            file_mtime = os.path.getmtime(file_path)
-            self.file_status_cache[file_path] = (file_hash, file_mtime)
+        return final_chunks
+
+    def process_file(self, file_path, flush=True):
+        """加载并分块单个文件，写入分块存储，返回该文件的分块"""
+        loader_cls = LOADER_MAPPING[os.path.splitext(file_path)[1].lower()]
+        stat = os.stat(file_path)
+        file_hash = self.get_file_hash(file_path)
+
+        documents = loader_cls(file_path).load()
+        chunks = assign_chunk_ids(file_path, self._split_documents(documents))
+
+        self.chunk_store.save_chunks(file_path, stat.st_size, stat.st_mtime, file_hash, chunks)
+        if flush:
+            self.chunk_store.flush()
+        if self._cached_chunks is not None:
+            self._cached_chunks[file_path] = chunks
+        return chunks
+
+    def remove_file(self, file_path, flush=True):
+        """从分块存储中移除文件，返回被移除的分块ID"""
+        removed_ids = self.chunk_store.remove(file_path)
+        if flush:
+            self.chunk_store.flush()
+        if self._cached_chunks is not None:
+            self._cached_chunks.pop(file_path, None)
+        return removed_ids
 
     def _load_processed_chunks(self):
-        """加载已处理的分块"""
-        # 如果没有缓存的分块，则重新处理所有文件
-        if not hasattr(self, '_cached_chunks') or self._cached_chunks is None:
-            self._cached_chunks = []
-            self._process_updated_files([])  # 强制重新处理所有文件
-        return self._cached_chunks
-
-    def _save_processed_chunks(self, chunks):
-        """保存处理后的分块"""
-        self._cached_chunks = chunks
+        """加载已处理的分块（首次从磁盘读取，之后使用内存缓存）"""
+        if self._cached_chunks is None:
+            self._cached_chunks = {
+                file_path: self.chunk_store.load_chunks(file_path)
+                for file_path in sorted(self.chunk_store.paths())
+            }
+        return [chunk for chunks in self._cached_chunks.values() for chunk in chunks]
 
     def _detect_content_type(self, text):
         """检测内容类型（增加jsonl检测）"""
@@ -0,0 +1,219 @@
+import os
+import pickle
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixStateCache:
+    """按 token 前缀保存的 llama.cpp 状态 LRU，容量按状态字节数限制
+
+    固定模板前缀以 pinned 方式保存，不参与淘汰。
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # token 元组 -> (状态, 字节数, 是否常驻)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, tokens, state, pinned=False):
+        key = tuple(tokens)
+        size = int(state.llama_state_size)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._entries[key] = (state, size, pinned)
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            _, size, pinned = self._entries[key]
+            if not pinned:
+                del self._entries[key]
+                self.total_bytes -= size
+
+    def longest_prefix(self, tokens, min_length=0):
+        """返回与 tokens 公共前缀最长且超过 min_length 的 (状态, 公共前缀长度)，没有时返回 (None, 0)
+
+        min_length 一般为模型当前 KV 状态与 tokens 的公共前缀长度，不比它长的缓存状态无需恢复。
+        """
+        best_key, best_length = None, min_length
+        with self._lock:
+            for key in self._entries:
+                length = common_prefix_length(key, tokens)
+                if length > best_length:
+                    best_key, best_length = key, length
+            if best_key is None:
+                self.misses += 1
+                return None, 0
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            self.reused_tokens += best_length
+            return self._entries[best_key][0], best_length
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "reused_tokens": self.reused_tokens
+        }
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ConversationStateCache:
+    """多轮对话 KV 状态缓存：每个对话保存上一轮回答结束时的状态及其对应文本的哈希
+
+    新一轮提示词以该文本开头时（哈希校验）才恢复状态。内存 LRU 按字节数限制，
+    淘汰的状态在后台线程写入磁盘，磁盘同样按字节数淘汰最旧的状态。
+    """
+
+    def __init__(self, max_bytes, spill_dir=None, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes if spill_dir else 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # 对话ID -> {"prefix_hash", "text_len", "size", "state"}
+        self._disk = OrderedDict()  # 对话ID -> {"prefix_hash", "text_len", "size", "path"}
+        self._spill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kv-spill")
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.max_disk_bytes:
+            # 状态只在本进程内有效，启动时清空上次遗留的文件
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def _path(self, conversation_id):
+        return os.path.join(self.spill_dir, hashlib.sha1(conversation_id.encode("utf-8")).hexdigest() + ".state")
+
+    def get(self, conversation_id, prompt):
+        """返回可作为 prompt 前缀恢复的状态，没有或已失效时返回 None"""
+        with self._lock:
+            entry = self._memory.get(conversation_id) or self._disk.get(conversation_id)
+            if entry is None or len(prompt) < entry["text_len"] \
+                    or text_hash(prompt[:entry["text_len"]]) != entry["prefix_hash"]:
+                self.misses += 1
+                return None
+            if conversation_id in self._memory:
+                self._memory.move_to_end(conversation_id)
+                self.hits += 1
+                return entry["state"]
+            self._disk.pop(conversation_id)
+            self.disk_bytes -= entry["size"]
+        try:
+            with open(entry["path"], "rb") as f:
+                state = pickle.load(f)
+            os.remove(entry["path"])
+        except Exception as e:
+            logging.error(f"读取对话 KV 状态失败: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self.put(conversation_id, None, state, prefix_hash=entry["prefix_hash"], text_len=entry["text_len"])
+        return state
+
+    def put(self, conversation_id, text, state, prefix_hash=None, text_len=None):
+        """保存对话状态；text 为该状态对应的完整文本（提示词 + 已生成回答）"""
+        entry = {
+            "prefix_hash": prefix_hash or text_hash(text),
+            "text_len": text_len if text_len is not None else len(text),
+            "size": int(state.llama_state_size),
+            "state": state
+        }
+        with self._lock:
+            self._discard(conversation_id)
+            self._memory[conversation_id] = entry
+            self.memory_bytes += entry["size"]
+            spilled = []
+            while self.memory_bytes > self.max_bytes and len(self._memory) > 1:
+                old_id, old_entry = self._memory.popitem(last=False)
+                self.memory_bytes -= old_entry["size"]
+                spilled.append((old_id, old_entry))
+        for old_id, old_entry in spilled:
+            if self.max_disk_bytes:
+                self._spill_executor.submit(self._spill, old_id, old_entry)
+
+    def _discard(self, conversation_id):
+        old = self._memory.pop(conversation_id, None)
+        if old is not None:
+            self.memory_bytes -= old["size"]
+        old = self._disk.pop(conversation_id, None)
+        if old is not None:
+            self.disk_bytes -= old["size"]
+            self._remove_file(old["path"])
+
+    def _spill(self, conversation_id, entry):
+        """后台线程：把淘汰的状态写入磁盘"""
+        path = self._path(conversation_id)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(entry["state"], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logging.error(f"写入对话 KV 状态失败: {e}")
+            return
+        with self._lock:
+            if conversation_id in self._memory:
+                # 写盘期间该对话又产生了新状态
+                self._remove_file(path)
+                return
+            self._disk[conversation_id] = {**{k: v for k, v in entry.items() if k != "state"}, "path": path}
+            self.disk_bytes += entry["size"]
+            while self.disk_bytes > self.max_disk_bytes and self._disk:
+                _, old_entry = self._disk.popitem(last=False)
+                self.disk_bytes -= old_entry["size"]
+                self._remove_file(old_entry["path"])
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self.memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self.disk_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0
+        }
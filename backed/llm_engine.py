@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+from collections import deque
+from llama_cpp import Llama
+from constants import LLM_MODEL_NAME, LLM_N_THREADS, LLM_PREFIX_CACHE_BYTES
+from constants import LLM_CONVERSATION_CACHE_BYTES, LLM_CONVERSATION_DISK_BYTES, LLM_CONVERSATION_SPILL_DIR
+from constants import LLM_SPECULATIVE_MODE, LLM_DRAFT_MODEL_NAME
+from kv_cache import PrefixStateCache, ConversationStateCache, common_prefix_length
+from speculative import build_draft_model, check_vocab
+
+
+def build_llama(n_threads=LLM_N_THREADS, speculative=LLM_SPECULATIVE_MODE, draft_model_path=LLM_DRAFT_MODEL_NAME,
+                **overrides):
+    """按统一配置加载 GGUF 模型；speculative 为推测解码模式（None / "prompt_lookup" / "draft"）"""
+    params = dict(
+        model_path=LLM_MODEL_NAME,
+        n_gpu_layers=33,     # 启用全部GPU加速
+        n_ctx=4096,          # 与模型训练长度一致
+        n_batch=512,         # 根据显存调整
+        n_threads=n_threads,
+        seed=3029422349,
+    )
+    params.update(overrides)
+    draft_model = build_draft_model(speculative, draft_model_path)
+    if draft_model is not None:
+        # 启用草稿模型时 llama-cpp 会保留所有位置的 logits，KV 状态快照也相应变大
+        params["draft_model"] = draft_model
+    llm = Llama(**params)
+    if draft_model is not None:
+        check_vocab(draft_model, llm)
+        logging.info(f"推测解码已启用：{speculative}")
+    return llm
+
+
+class LlamaEngine:
+    """封装 Llama 实例的生成调用，只能在模型所属线程中使用
+
+    prefixes 为固定的提示词前缀，首次生成前预先计算其 KV 状态；每次生成前恢复与提示词
+    公共前缀最长的缓存状态，llama.cpp 只需预填充剩余部分。
+    配置中带 conversation_id 时，回答结束后保存该对话的状态，下一轮优先从该状态继续。
+    """
+
+    def __init__(self, llm, prefixes=None, prefix_cache_bytes=LLM_PREFIX_CACHE_BYTES,
+                 conversation_cache_bytes=LLM_CONVERSATION_CACHE_BYTES):
+        self.llm = llm
+        self.prefix_cache = PrefixStateCache(prefix_cache_bytes) if prefix_cache_bytes else None
+        self.conversation_cache = ConversationStateCache(
+            conversation_cache_bytes,
+            spill_dir=os.path.join(LLM_CONVERSATION_SPILL_DIR, str(os.getpid())),
+            max_disk_bytes=LLM_CONVERSATION_DISK_BYTES
+        ) if conversation_cache_bytes else None
+        self._pending_prefixes = list(prefixes or ()) if self.prefix_cache is not None else []
+        self._ttft = deque(maxlen=1000)
+        self.draft_model = getattr(llm, "draft_model", None)
+        self.generated_tokens = 0
+        self.generation_time = 0.0
+        self.draft_calls = 0
+        self.draft_proposed = 0
+
+    def _tokenize(self, text):
+        # 与 create_completion 内部的分词方式保持一致
+        return self.llm.tokenize(text.encode("utf-8"), special=True)
+
+    def warm_prefixes(self):
+        """预先计算固定前缀的 KV 状态（在模型所属线程中调用）"""
+        while self._pending_prefixes:
+            text = self._pending_prefixes.pop()
+            start_time = time.time()
+            tokens = self._tokenize(text)
+            self.llm.reset()
+            self.llm.eval(tokens)
+            self.prefix_cache.put(tokens, self.llm.save_state(), pinned=True)
+            logging.info(f"固定前缀 KV 状态已缓存：{len(tokens)} tokens，耗时 {time.time() - start_time:.2f}s")
+
+    def _restore_prefix(self, prompt, conversation_id=None):
+        """恢复与提示词公共前缀最长的缓存状态（比当前 KV 状态更长时才恢复），对话状态优先"""
+        if self.prefix_cache is None and self.conversation_cache is None:
+            return
+        try:
+            tokens = self._tokenize(prompt)
+            current = common_prefix_length(self.llm.input_ids[:self.llm.n_tokens].tolist(), tokens)
+            if conversation_id and self.conversation_cache is not None:
+                state = self.conversation_cache.get(conversation_id, prompt)
+                if state is not None:
+                    length = common_prefix_length(state.input_ids[:state.n_tokens].tolist(), tokens)
+                    if length > current:
+                        self.llm.load_state(state)
+                        logging.info(f"恢复对话 KV 状态：复用 {length}/{len(tokens)} tokens")
+                        return
+            if self.prefix_cache is None:
+                return
+            self.warm_prefixes()
+            state, length = self.prefix_cache.longest_prefix(tokens, min_length=current)
+            if state is not None:
+                self.llm.load_state(state)
+                logging.info(f"恢复前缀 KV 状态：复用 {length}/{len(tokens)} tokens")
+        except Exception as e:
+            logging.error(f"恢复前缀 KV 状态失败，将完整预填充: {e}")
+            self.llm.reset()
+
+    def _save_conversation(self, conversation_id, text):
+        if not conversation_id or self.conversation_cache is None:
+            return
+        try:
+            self.conversation_cache.put(conversation_id, text, self.llm.save_state())
+        except Exception as e:
+            logging.error(f"保存对话 KV 状态失败: {e}")
+
+    def _set_lookup_corpus(self, lookup_text):
+        """提示词查找草稿的额外语料（本次检索分块全文）"""
+        if self.draft_model is not None and hasattr(self.draft_model, "set_corpus"):
+            tokens = self.llm.tokenize(lookup_text.encode("utf-8"), add_bos=False) if lookup_text else None
+            self.draft_model.set_corpus(tokens)
+
+    def _record_generation(self, tokens, elapsed, draft_calls, draft_proposed):
+        self.generated_tokens += tokens
+        self.generation_time += elapsed
+        if self.draft_model is not None:
+            self.draft_calls += self.draft_model.calls - draft_calls
+            self.draft_proposed += self.draft_model.proposed - draft_proposed
+
+    def _draft_counters(self):
+        if self.draft_model is None:
+            return 0, 0
+        return self.draft_model.calls, self.draft_model.proposed
+
+    def complete(self, config):
+        """非流式生成，返回 create_completion 的结果"""
+        config = dict(config)
+        conversation_id = config.pop("conversation_id", None)
+        self._set_lookup_corpus(config.pop("lookup_text", None))
+        prompt = config.get("prompt", "")
+        self._restore_prefix(prompt, conversation_id)
+        start_time = time.perf_counter()
+        draft_calls, draft_proposed = self._draft_counters()
+        result = self.llm.create_completion(**{**config, "stream": False})
+        self._record_generation(result.get("usage", {}).get("completion_tokens", 0),
+                                time.perf_counter() - start_time, draft_calls, draft_proposed)
+        self._save_conversation(conversation_id, prompt + result["choices"][0]["text"])
+        return result
+
+    def stream(self, config, cancel_event=None):
+        """流式生成，逐个产出 create_completion 的分块；cancel_event 置位时停止生成"""
+        start_time = time.perf_counter()
+        config = dict(config)
+        conversation_id = config.pop("conversation_id", None)
+        self._set_lookup_corpus(config.pop("lookup_text", None))
+        prompt = config.get("prompt", "")
+        self._restore_prefix(prompt, conversation_id)
+        draft_calls, draft_proposed = self._draft_counters()
+        generator = self.llm.create_completion(**{**config, "stream": True})
+        first = True
+        parts = []
+        try:
+            for chunk in generator:
+                if first:
+                    self._ttft.append(time.perf_counter() - start_time)
+                    first = False
+                if cancel_event is not None and cancel_event.is_set():
+                    logging.info("客户端已断开，停止生成")
+                    break
+                parts.append(chunk["choices"][0]["text"])
+                yield chunk
+            else:
+                self._save_conversation(conversation_id, prompt + "".join(parts))
+        finally:
+            generator.close()
+            self._record_generation(len(parts), time.perf_counter() - start_time, draft_calls, draft_proposed)
+
+    def stats(self):
+        ttft = sorted(self._ttft)
+        return {
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None,
+            "conversation_cache": self.conversation_cache.stats() if self.conversation_cache is not None else None,
+            "speculative": self.speculative_stats(),
+            "avg_ttft_ms": sum(ttft) / len(ttft) * 1000 if ttft else 0.0,
+            "p95_ttft_ms": ttft[min(len(ttft) - 1, int(len(ttft) * 0.95))] * 1000 if ttft else 0.0
+        }
+
+    def speculative_stats(self):
+        """推测解码统计：被接受的草稿数 = 生成 token 数 - 草稿调用次数"""
+        accepted = max(0, self.generated_tokens - self.draft_calls) if self.draft_model is not None else 0
+        return {
+            "mode": getattr(self.draft_model, "mode", None),
+            "generated_tokens": self.generated_tokens,
+            "tokens_per_sec": self.generated_tokens / self.generation_time if self.generation_time else 0.0,
+            "draft_calls": self.draft_calls,
+            "draft_proposed": self.draft_proposed,
+            "draft_accepted": accepted,
+            "acceptance_rate": accepted / self.draft_proposed if self.draft_proposed else 0.0,
+            "tokens_per_step": self.generated_tokens / self.draft_calls if self.draft_calls else 1.0
+        }
@@ -0,0 +1,496 @@
+"""多进程 Llama 推理池
+
+每个工作进程独立加载一份 GGUF 模型，绑定各自的 CPU 核心和线程数，请求按未完成 token 数最少的进程路由。
+工作进程以独立脚本启动（python llm_pool.py --worker ...），通过 multiprocessing.connection 与主进程通信，
+避免 spawn 方式重新导入 api.py 再加载一遍全部模型。进程退出或就绪后长时间无进展时自动重启；
+非流式请求在工作进程内也按流式生成并定期发送进展，长回答不会被误判为停滞。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import itertools
+import threading
+import shutil
+import subprocess
+from collections import deque, OrderedDict
+from multiprocessing.connection import Listener, Client
+from constants import (LLM_POOL_SIZE, LLM_POOL_THREADS_PER_WORKER, LLM_POOL_CORE_OFFSET, LLM_POOL_GPU_LAYERS,
+                       LLM_POOL_STALL_TIMEOUT, LLM_QUEUE_SIZE, MAX_NEW_TOKENS, LLM_CONVERSATION_SPILL_DIR,
+                       LLM_CONVERSATION_SESSIONS)
+from llm_worker import QueueFullError
+from token_pump import TokenPump
+
+_HEARTBEAT_INTERVAL = 2
+_AUTHKEY_ENV = "LLM_POOL_AUTHKEY"
+
+
+def estimate_tokens(config):
+    """粗略估计请求的 token 开销：待生成 token 数 + 提示词 token 数（按 4 字符一个 token 估算）"""
+    return int(config.get("max_tokens") or MAX_NEW_TOKENS) + len(config.get("prompt", "")) // 4
+
+
+def plan_cores(size, threads_per_worker=0, core_offset=0, cpu_count=None):
+    """为每个工作进程分配互不重叠的核心；threads_per_worker 为 0 时均分剩余核心"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    available = max(1, cpu_count - core_offset)
+    threads = threads_per_worker or max(1, available // size)
+    plans = []
+    for i in range(size):
+        start = core_offset + i * threads
+        cores = [c % cpu_count for c in range(start, start + threads)]
+        plans.append((cores, threads))
+    return plans
+
+
+class _PoolRequest:
+    def __init__(self, request_id, config, stream, estimate):
+        self.request_id = request_id
+        self.config = config
+        self.stream = stream
+        self.remaining = estimate
+        self.worker = None
+        self.future = None
+        self.pump = None
+        self.enqueued_at = time.monotonic()
+
+
+class _WorkerHandle:
+    """主进程中对单个推理进程的记录"""
+
+    def __init__(self, worker_id, cores, n_threads):
+        self.worker_id = worker_id
+        self.cores = cores
+        self.n_threads = n_threads
+        self.process = None
+        self.listener = None
+        self.conn = None
+        self.pid = None
+        self.ready = False
+        self.outbox = []
+        self.active = set()
+        self.outstanding = 0
+        self.last_seen = time.monotonic()
+        self.started_at = time.monotonic()
+        self.restarts = 0
+        self.completed = 0
+        self.tokens = 0
+        self.send_lock = threading.Lock()
+
+    def to_dict(self):
+        uptime = time.monotonic() - self.started_at
+        return {
+            "worker_id": self.worker_id,
+            "pid": self.pid,
+            "ready": self.ready,
+            "alive": self.process is not None and self.process.poll() is None,
+            "cores": self.cores,
+            "n_threads": self.n_threads,
+            "active_requests": len(self.active),
+            "outstanding_tokens": self.outstanding,
+            "completed": self.completed,
+            "tokens": self.tokens,
+            "tokens_per_sec": self.tokens / uptime if uptime > 0 else 0.0,
+            "restarts": self.restarts
+        }
+
+
+class LLMProcessPool:
+    """多进程推理池，接口与 LLMWorker 一致（start / complete / stream / stats）"""
+
+    def __init__(self, size=LLM_POOL_SIZE, threads_per_worker=LLM_POOL_THREADS_PER_WORKER,
+                 core_offset=LLM_POOL_CORE_OFFSET, gpu_layers=LLM_POOL_GPU_LAYERS,
+                 max_queue=LLM_QUEUE_SIZE, stall_timeout=LLM_POOL_STALL_TIMEOUT):
+        self.gpu_layers = gpu_layers
+        self.max_queue = max_queue
+        self.stall_timeout = stall_timeout
+        self.workers = [_WorkerHandle(i, cores, threads)
+                        for i, (cores, threads) in enumerate(plan_cores(size, threads_per_worker, core_offset))]
+        self._authkey = os.urandom(16)
+        self._lock = threading.Lock()
+        self._pending = {}  # 请求ID -> _PoolRequest
+        self._affinity = OrderedDict()  # 对话ID -> 上一轮所在进程，对话的 KV 状态保存在该进程中
+        self._ids = itertools.count()
+        self._loop = None
+        self._monitor_task = None
+        self.total_requests = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._wait_times = deque(maxlen=1000)
+
+    async def start(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            self._spawn(worker)
+        self._monitor_task = asyncio.create_task(self._monitor())
+        logging.info(f"推理进程池启动：{len(self.workers)} 个进程，"
+                     f"每进程 {self.workers[0].n_threads} 线程")
+
+    async def stop(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        for worker in self.workers:
+            self._terminate(worker)
+        self._loop = None
+
+    # ---- 进程管理 ----
+
+    def _spawn(self, worker):
+        worker.listener = Listener(("127.0.0.1", 0), authkey=self._authkey)
+        host, port = worker.listener.address
+        command = [
+            sys.executable, os.path.abspath(__file__), "--worker",
+            "--address", f"{host}:{port}",
+            "--cores", ",".join(map(str, worker.cores)),
+            "--threads", str(worker.n_threads),
+            "--gpu-layers", str(self.gpu_layers)
+        ]
+        env = {**os.environ, _AUTHKEY_ENV: self._authkey.hex()}
+        worker.process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        worker.ready = False
+        worker.conn = None
+        worker.pid = worker.process.pid
+        worker.started_at = worker.last_seen = time.monotonic()
+        worker.tokens = 0
+        threading.Thread(target=self._read_loop, args=(worker, worker.listener),
+                         name=f"llm-pool-reader-{worker.worker_id}", daemon=True).start()
+
+    def _terminate(self, worker):
+        if worker.process is not None and worker.process.poll() is None:
+            worker.process.kill()
+            try:
+                worker.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                logging.error(f"推理进程 {worker.pid} 未能在 10s 内退出")
+        for closable in (worker.conn, worker.listener):
+            if closable is not None:
+                try:
+                    closable.close()
+                except OSError:
+                    pass
+        worker.conn = None
+        worker.listener = None
+        worker.ready = False
+
+    def _restart(self, worker, reason):
+        logging.error(f"推理进程 {worker.worker_id}（pid {worker.pid}）{reason}，正在重启")
+        self._terminate(worker)
+        shutil.rmtree(os.path.join(LLM_CONVERSATION_SPILL_DIR, str(worker.pid)), ignore_errors=True)
+        with self._lock:
+            failed = [self._pending.pop(request_id) for request_id in worker.active if request_id in self._pending]
+            worker.active.clear()
+            worker.outstanding = 0
+            worker.outbox.clear()
+        for request in failed:
+            self._deliver(request, "error", f"推理进程异常（{reason}）")
+        worker.restarts += 1
+        self._spawn(worker)
+
+    async def _monitor(self):
+        """定期检查进程存活和进展，异常时重启"""
+        while True:
+            await asyncio.sleep(_HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.process.poll() is not None:
+                    reason = f"已退出（返回码 {worker.process.returncode}）"
+                elif worker.ready and worker.active and now - worker.last_seen > self.stall_timeout:
+                    # 进程就绪（模型加载、前缀预热完成）后才开始计算停滞时间
+                    reason = f"超过 {self.stall_timeout}s 无进展"
+                else:
+                    continue
+                # 连续崩溃时退避，避免模型加载失败时频繁重启
+                if now - worker.started_at < min(60, 5 * worker.restarts):
+                    continue
+                await self._loop.run_in_executor(None, self._restart, worker, reason)
+
+    # ---- 通信 ----
+
+    def _send(self, worker, message):
+        with worker.send_lock:
+            if worker.conn is None:
+                worker.outbox.append(message)
+                return
+            try:
+                worker.conn.send(message)
+            except OSError as e:
+                logging.error(f"向推理进程 {worker.worker_id} 发送请求失败: {e}")
+
+    def _read_loop(self, worker, listener):
+        """读取线程：接受工作进程连接并分发其消息"""
+        try:
+            conn = listener.accept()
+        except OSError:
+            return
+        with worker.send_lock:
+            worker.conn = conn
+            for message in worker.outbox:
+                conn.send(message)
+            worker.outbox.clear()
+        while True:
+            try:
+                kind, request_id, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            worker.last_seen = time.monotonic()
+            if kind == "ready":
+                worker.ready = True
+                logging.info(f"推理进程 {worker.worker_id} 就绪（pid {payload}，核心 {worker.cores}）")
+            elif kind not in ("heartbeat", "progress"):
+                self._on_message(worker, kind, request_id, payload)
+
+    def _on_message(self, worker, kind, request_id, payload):
+        with self._lock:
+            request = self._pending.get(request_id)
+            if request is None:
+                return
+            if kind == "chunk":
+                worker.tokens += 1
+                if request.remaining > 0:
+                    request.remaining -= 1
+                    worker.outstanding -= 1
+            else:
+                del self._pending[request_id]
+                worker.active.discard(request_id)
+                worker.outstanding -= request.remaining
+                worker.completed += 1
+                if kind == "result":
+                    worker.tokens += payload.get("usage", {}).get("completion_tokens", 0)
+        self._deliver(request, kind, payload)
+
+    def _deliver(self, request, kind, payload):
+        """从读取线程把结果交回事件循环"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        if request.stream:
+            if kind == "chunk":
+                request.pump.push(payload["choices"][0]["text"])
+            elif kind == "error":
+                request.pump.close(RuntimeError(payload))
+            else:
+                request.pump.close()
+        elif kind == "result":
+            loop.call_soon_threadsafe(self._set_result, request.future, payload)
+        else:
+            loop.call_soon_threadsafe(self._set_exception, request.future, RuntimeError(payload or "请求已取消"))
+
+    @staticmethod
+    def _set_result(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future, exc):
+        if not future.done():
+            future.set_exception(exc)
+
+    # ---- 请求 ----
+
+    def _submit(self, config, stream):
+        with self._lock:
+            if len(self._pending) >= self.max_queue + len(self.workers):
+                self.rejected += 1
+                raise QueueFullError(f"推理队列已满（{self.max_queue}）")
+            request = _PoolRequest(next(self._ids), config, stream, estimate_tokens(config))
+            if stream:
+                request.pump = TokenPump(self._loop)
+            else:
+                request.future = self._loop.create_future()
+            worker = self._route(config.get("conversation_id"), request.remaining)
+            request.worker = worker
+            worker.active.add(request.request_id)
+            worker.outstanding += request.remaining
+            self._pending[request.request_id] = request
+            self.total_requests += 1
+        self._send(worker, ("stream" if stream else "complete", request.request_id, config))
+        return request
+
+    def _route(self, conversation_id, estimate):
+        """优先就绪的进程，再按未完成 token 数最少路由；多轮对话在负载相差不超过一个请求时留在原进程"""
+        best = min(self.workers, key=lambda w: (not w.ready, w.outstanding))
+        if conversation_id is None:
+            return best
+        previous = self._affinity.get(conversation_id)
+        if previous is not None:
+            worker = self.workers[previous]
+            if worker.ready and worker.outstanding <= best.outstanding + estimate:
+                best = worker
+        self._affinity[conversation_id] = best.worker_id
+        self._affinity.move_to_end(conversation_id)
+        while len(self._affinity) > LLM_CONVERSATION_SESSIONS:
+            self._affinity.popitem(last=False)
+        return best
+
+    def _cancel(self, request):
+        """请求仍在进程池中时通知工作进程取消"""
+        with self._lock:
+            if request.request_id not in self._pending:
+                return
+            self.cancelled += 1
+        self._send(request.worker, ("cancel", request.request_id, None))
+
+    async def complete(self, config):
+        """非流式生成"""
+        await self.start()
+        request = self._submit(config, stream=False)
+        try:
+            return await request.future
+        finally:
+            self._cancel(request)
+            self._wait_times.append(time.monotonic() - request.enqueued_at)
+
+    async def stream(self, config):
+        """流式生成，产出合并后的文本帧；调用方停止迭代时取消生成"""
+        await self.start()
+        request = self._submit(config, stream=True)
+        first = True
+        try:
+            async for text in request.pump.frames():
+                if first:
+                    self._wait_times.append(time.monotonic() - request.enqueued_at)
+                    first = False
+                yield text
+        finally:
+            self._cancel(request)
+
+    def is_full(self):
+        return len(self._pending) >= self.max_queue + len(self.workers)
+
+    def stats(self):
+        waits = sorted(self._wait_times)
+        workers = [worker.to_dict() for worker in self.workers]
+        return {
+            "mode": "process_pool",
+            "queue_depth": max(0, len(self._pending) - len(self.workers)),
+            "queue_capacity": self.max_queue,
+            "in_flight": sum(1 for worker in self.workers if worker.active),
+            "total_requests": self.total_requests,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "tokens_per_sec": sum(worker["tokens_per_sec"] for worker in workers),
+            "avg_wait_ms": sum(waits) / len(waits) * 1000 if waits else 0.0,
+            "p95_wait_ms": waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000 if waits else 0.0,
+            "workers": workers
+        }
+
+
+# ---- 工作进程 ----
+
+def _set_affinity(cores):
+    if not cores:
+        return
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cores))
+    else:
+        logging.warning("当前平台不支持 sched_setaffinity，推理进程不绑定核心")
+
+
+def _complete_streamed(engine, config, cancel_flag, progress):
+    """非流式请求也按流式生成，每隔 _HEARTBEAT_INTERVAL 秒调用 progress(已生成 token 数)，让主进程看到进展
+
+    返回与 create_completion 相同结构的结果；生成中途被取消时返回 None
+    """
+    parts = []
+    finish_reason = None
+    last_progress = time.monotonic()
+    for chunk in engine.stream(config, cancel_flag):
+        choice = chunk["choices"][0]
+        parts.append(choice["text"])
+        finish_reason = choice.get("finish_reason") or finish_reason
+        now = time.monotonic()
+        if now - last_progress >= _HEARTBEAT_INTERVAL:
+            progress(len(parts))
+            last_progress = now
+    if cancel_flag.is_set():
+        return None
+    return {
+        "choices": [{"text": "".join(parts), "index": 0, "finish_reason": finish_reason}],
+        "usage": {"completion_tokens": len(parts)}
+    }
+
+
+class _CancelFlag:
+    """供 LlamaEngine.stream 在分块之间检查的取消标记，检查时顺带接收主进程消息"""
+
+    def __init__(self, request_id, pump, cancelled):
+        self.request_id = request_id
+        self.pump = pump
+        self.cancelled = cancelled
+
+    def is_set(self):
+        self.pump(0)
+        return self.request_id in self.cancelled
+
+
+def _worker_main(args):
+    from llm_engine import LlamaEngine, build_llama
+    from prompt_templates import fixed_prefixes
+
+    cores = [int(c) for c in args.cores.split(",") if c]
+    _set_affinity(cores)
+    host, port = args.address.rsplit(":", 1)
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ[_AUTHKEY_ENV]))
+    engine = LlamaEngine(build_llama(n_threads=args.threads, n_gpu_layers=args.gpu_layers),
+                         prefixes=fixed_prefixes())
+    engine.warm_prefixes()
+    conn.send(("ready", None, os.getpid()))
+
+    backlog = deque()
+    cancelled = set()
+
+    def pump(timeout):
+        while conn.poll(timeout):
+            kind, request_id, payload = conn.recv()
+            if kind == "cancel":
+                cancelled.add(request_id)
+            else:
+                backlog.append((kind, request_id, payload))
+            timeout = 0
+
+    while True:
+        try:
+            if not backlog:
+                pump(_HEARTBEAT_INTERVAL)
+                if not backlog:
+                    conn.send(("heartbeat", None, None))
+                    continue
+            kind, request_id, config = backlog.popleft()
+            if request_id in cancelled:
+                cancelled.discard(request_id)
+                conn.send(("end" if kind == "stream" else "error", request_id, None))
+                continue
+            try:
+                if kind == "stream":
+                    for chunk in engine.stream(config, _CancelFlag(request_id, pump, cancelled)):
+                        conn.send(("chunk", request_id, chunk))
+                    conn.send(("end", request_id, None))
+                else:
+                    result = _complete_streamed(engine, config, _CancelFlag(request_id, pump, cancelled),
+                                                lambda n: conn.send(("progress", request_id, n)))
+                    conn.send(("result", request_id, result) if result is not None
+                              else ("error", request_id, "请求已取消"))
+            except (EOFError, OSError):
+                raise
+            except Exception as e:
+                conn.send(("error", request_id, f"{type(e).__name__}: {e}"))
+            cancelled.discard(request_id)
+        except (EOFError, OSError):
+            # 主进程已退出
+            return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Llama 推理池工作进程")
+    parser.add_argument("--worker", action="store_true")
+    parser.add_argument("--address", required=True)
+    parser.add_argument("--cores", default="")
+    parser.add_argument("--threads", type=int, required=True)
+    parser.add_argument("--gpu-layers", type=int, default=0)
+    logging.basicConfig(level=logging.INFO)
+    _worker_main(parser.parse_args())
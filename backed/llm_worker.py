@@ -0,0 +1,160 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from constants import LLM_QUEUE_SIZE
+from token_pump import TokenPump
+
+
+class QueueFullError(Exception):
+    """推理队列已满"""
+
+
+class LLMRequest:
+    def __init__(self, config, stream):
+        self.config = config
+        self.stream = stream
+        self.cancel_event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.future = None
+        self.pump = None
+
+
+class LLMWorker:
+    """推理工作线程：Llama 实例只在一个专属线程中使用，请求经有界 asyncio 队列排队
+
+    队列满时立即拒绝，流式请求在客户端断开时取消生成，事件循环不再被生成阻塞。
+    """
+
+    def __init__(self, engine, max_queue=LLM_QUEUE_SIZE):
+        self.engine = engine
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-worker")
+        self._queue = None
+        self._dispatcher = None
+        self.in_flight = 0
+        self.total_requests = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.stream_tokens = 0
+        self.stream_frames = 0
+        self._wait_times = deque(maxlen=1000)
+
+    async def start(self):
+        if self._dispatcher is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+            # 在推理线程中预热固定前缀，排在所有请求之前
+            asyncio.get_running_loop().run_in_executor(self._executor, self._warm)
+
+    async def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _enqueue(self, request):
+        try:
+            self._queue.put_nowait(request)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"推理队列已满（{self.max_queue}）")
+        self.total_requests += 1
+
+    async def complete(self, config):
+        """排队执行非流式生成"""
+        await self.start()
+        request = LLMRequest(config, stream=False)
+        request.future = asyncio.get_running_loop().create_future()
+        self._enqueue(request)
+        try:
+            return await request.future
+        finally:
+            request.cancel_event.set()
+
+    async def stream(self, config):
+        """排队执行流式生成，异步产出合并后的文本帧；调用方停止迭代（如客户端断开）时取消生成"""
+        await self.start()
+        request = LLMRequest(config, stream=True)
+        request.pump = TokenPump(asyncio.get_running_loop())
+        self._enqueue(request)
+        try:
+            async for text in request.pump.frames():
+                yield text
+        finally:
+            request.cancel_event.set()
+            self.stream_tokens += request.pump.tokens
+            self.stream_frames += request.pump.frame_count
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            request = await self._queue.get()
+            if request.cancel_event.is_set():
+                self.cancelled += 1
+                continue
+            wait_time = time.monotonic() - request.enqueued_at
+            self._wait_times.append(wait_time)
+            logging.info(f"推理请求开始：排队 {wait_time * 1000:.0f}ms，剩余队列 {self._queue.qsize()}")
+            self.in_flight += 1
+            try:
+                await loop.run_in_executor(self._executor, self._run, request, loop)
+            except Exception as e:
+                logging.error(f"推理请求执行失败: {e}", exc_info=True)
+            finally:
+                self.in_flight -= 1
+
+    def _run(self, request, loop):
+        """在推理线程中执行"""
+        if request.stream:
+            try:
+                for chunk in self.engine.stream(request.config, request.cancel_event):
+                    request.pump.push(chunk["choices"][0]["text"])
+                if request.cancel_event.is_set():
+                    self.cancelled += 1
+                request.pump.close()
+            except Exception as e:
+                request.pump.close(e)
+            return
+
+        try:
+            result = self.engine.complete(request.config)
+            loop.call_soon_threadsafe(self._set_result, request.future, result)
+        except Exception as e:
+            loop.call_soon_threadsafe(self._set_exception, request.future, e)
+
+    def _warm(self):
+        try:
+            self.engine.warm_prefixes()
+        except Exception as e:
+            logging.error(f"预热前缀 KV 状态失败: {e}")
+
+    @staticmethod
+    def _set_result(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future, exc):
+        if not future.done():
+            future.set_exception(exc)
+
+    def is_full(self):
+        return self._queue is not None and self._queue.full()
+
+    def stats(self):
+        waits = sorted(self._wait_times)
+        return {
+            "mode": "thread",
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.max_queue,
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "tokens_per_frame": self.stream_tokens / self.stream_frames if self.stream_frames else 0.0,
+            "avg_wait_ms": sum(waits) / len(waits) * 1000 if waits else 0.0,
+            "p95_wait_ms": waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000 if waits else 0.0,
+            "engine": self.engine.stats()
+        }
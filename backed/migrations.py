@@ -0,0 +1,211 @@
+"""MySQL 表结构版本化迁移
+
+_init_tables 只负责 CREATE TABLE IF NOT EXISTS，已存在的表不会被修改；索引等后续变更按版本号写在
+MIGRATIONS 中，启动时按顺序执行尚未应用的版本，并记录到 schema_migrations 表。
+每个操作先查 information_schema，已存在（例如由 cs.sql 建库）的索引直接跳过，因此可以重复执行。
+多个进程同时启动时用 MySQL 命名锁串行执行。
+
+check_plans() 对热点查询执行 EXPLAIN，检查是否使用了预期的索引、是否出现 filesort。
+
+用法：
+    python migrations.py              # 查看已应用 / 待应用的版本
+    python migrations.py --migrate    # 执行待应用的版本
+    python migrations.py --explain    # 检查热点查询的执行计划
+"""
+import time
+import logging
+import argparse
+from mysql.connector import Error
+from constants import SCHEMA_MIGRATION_LOCK_TIMEOUT
+
+MIGRATION_LOCK = "math_ai_schema_migrations"
+
+
+def index_exists(db, table, name):
+    return db.fetch_one("index_exists", """
+    SELECT 1 FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    LIMIT 1
+    """, (table, name)) is not None
+
+
+class AddIndex:
+    def __init__(self, table, name, columns):
+        self.table = table
+        self.name = name
+        self.columns = columns
+
+    def apply(self, db):
+        if index_exists(db, self.table, self.name):
+            return False
+        db.execute("migrate", f"ALTER TABLE {self.table} ADD INDEX {self.name} ({self.columns})")
+        return True
+
+    def __str__(self):
+        return f"ADD INDEX {self.table}.{self.name} ({self.columns})"
+
+
+class DropIndex:
+    def __init__(self, table, name):
+        self.table = table
+        self.name = name
+
+    def apply(self, db):
+        if not index_exists(db, self.table, self.name):
+            return False
+        db.execute("migrate", f"ALTER TABLE {self.table} DROP INDEX {self.name}")
+        return True
+
+    def __str__(self):
+        return f"DROP INDEX {self.table}.{self.name}"
+
+
+class Migration:
+    def __init__(self, version, name, operations):
+        self.version = version
+        self.name = name
+        self.operations = operations
+
+
+# 版本号只增不改；已发布的版本不要修改，变更请追加新版本
+MIGRATIONS = [
+    Migration(1, "会话、消息分页索引", [
+        # 会话列表按 (created_at, id) 倒序键集分页
+        AddIndex("conversations", "idx_user_created", "user_id, created_at, id"),
+        # 消息按 id 游标分页，最后一条消息预览取 MAX(id)
+        AddIndex("messages", "idx_conversation_id", "conversation_id, id"),
+    ]),
+    Migration(2, "热点查询索引", [
+        # get_api_key / get_all_api_keys：按用户过滤、按创建时间排序，取 api_key 时不回表
+        AddIndex("api_keys", "idx_user_created", "user_id, created_at, api_key"),
+        # save_user_document 按 (user_id, file_name) 查重；file_name 在旧库中是 TEXT，只能建前缀索引
+        AddIndex("user_documents", "idx_user_file", "user_id, file_name(191)"),
+        # get_user_documents：按用户过滤、按创建时间排序
+        AddIndex("user_documents", "idx_user_created", "user_id, created_at"),
+        # get_reference_files：按问题过滤、按相似度排序
+        AddIndex("reference_files", "idx_question_similarity", "question_id, similarity"),
+        # get_messages：按会话过滤、按时间排序
+        AddIndex("messages", "idx_conversation_time", "conversation_id, timestamp"),
+    ]),
+    Migration(3, "删除 cs.sql 中重复的消息索引", [
+        DropIndex("messages", "idx_conv_time"),
+    ]),
+    Migration(4, "删除 cs.sql 中被 idx_user_created 取代的会话索引", [
+        # (user_id, created_at) 是 idx_user_created 的前缀，新建库中已不存在
+        DropIndex("conversations", "idx_user_time"),
+    ]),
+]
+
+
+def ensure_migrations_table(db):
+    db.execute("migrate", """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        duration_ms INT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def applied_versions(db):
+    return {row[0] for row in db.fetch_all("migrate", "SELECT version FROM schema_migrations")}
+
+
+def migrate(db, migrations=MIGRATIONS):
+    """按版本顺序执行尚未应用的迁移，返回本次应用的版本号；某个版本失败时抛出异常，后续版本不执行"""
+    ensure_migrations_table(db)
+    applied = []
+    with db.named_lock(MIGRATION_LOCK, SCHEMA_MIGRATION_LOCK_TIMEOUT):
+        done = applied_versions(db)  # 拿到锁后再读，其他进程可能已经执行过
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version in done:
+                continue
+            start = time.perf_counter()
+            for operation in migration.operations:
+                if operation.apply(db):
+                    logging.info(f"迁移 {migration.version}: {operation}")
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            db.execute("migrate", "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+                       (migration.version, migration.name, duration_ms))
+            logging.info(f"已应用迁移 {migration.version} {migration.name}，用时 {duration_ms}ms")
+            applied.append(migration.version)
+    return applied
+
+
+# 热点查询及其预期使用的索引：(名称, 语句, 参数, 预期索引)
+HOT_QUERIES = [
+    ("get_api_key", "SELECT api_key FROM api_keys WHERE user_id = %s ORDER BY created_at DESC LIMIT 1",
+     (1,), "idx_user_created"),
+    ("find_user_document", "SELECT id FROM user_documents WHERE user_id = %s AND file_name = %s",
+     (1, "a.pdf"), "idx_user_file"),
+    ("get_user_documents", "SELECT id, file_name, file_path, file_type, created_at FROM user_documents "
+     "WHERE user_id = %s ORDER BY created_at DESC", (1,), "idx_user_created"),
+    ("get_reference_files", "SELECT file_name, file_path, file_type, description, similarity, source "
+     "FROM reference_files WHERE question_id = %s ORDER BY similarity DESC", ("q",), "idx_question_similarity"),
+    ("get_messages", "SELECT role, content, timestamp FROM messages WHERE conversation_id = %s "
+     "ORDER BY timestamp ASC", (1,), "idx_conversation_time"),
+    ("list_messages", "SELECT id, role, content, timestamp FROM messages WHERE conversation_id = %s "
+     "ORDER BY id DESC LIMIT 51", (1,), "idx_conversation_id"),
+    ("list_conversations", "SELECT id, title, created_at FROM conversations WHERE user_id = %s "
+     "ORDER BY created_at DESC, id DESC LIMIT 31", (1,), "idx_user_created"),
+]
+
+
+def check_plans(db, queries=HOT_QUERIES):
+    """对热点查询执行 EXPLAIN，返回每条查询的执行计划摘要和是否符合预期
+
+    表中数据很少时优化器可能选择全表扫描，结论以有代表性数据量的库为准。
+    """
+    report = []
+    for name, query, params, expected in queries:
+        try:
+            plan = db.fetch_one("explain", "EXPLAIN " + query, params, dictionary=True) or {}
+        except Error as e:
+            report.append({"query": name, "expected": expected, "ok": False, "error": str(e)})
+            continue
+        extra = plan.get("Extra") or ""
+        report.append({
+            "query": name,
+            "expected": expected,
+            "key": plan.get("key"),
+            "type": plan.get("type"),
+            "rows": plan.get("rows"),
+            "extra": extra,
+            "ok": plan.get("key") == expected and "filesort" not in extra
+        })
+    return report
+
+
+def main(args):
+    from database import Database
+    db = Database(migrate=False)
+    if db.pool is None:
+        raise SystemExit("数据库连接失败")
+    try:
+        if args.migrate:
+            applied = migrate(db)
+            print(f"本次应用的版本: {applied or '无'}")
+        if args.explain:
+            for row in check_plans(db):
+                status = "OK  " if row["ok"] else "WARN"
+                detail = row.get("error") or f"key={row['key']} type={row['type']} rows={row['rows']} {row['extra']}"
+                print(f"{status} {row['query']:<22} 预期 {row['expected']:<24} {detail}")
+        if not args.migrate and not args.explain:
+            ensure_migrations_table(db)
+            done = applied_versions(db)
+            for migration in MIGRATIONS:
+                status = "已应用" if migration.version in done else "待应用"
+                print(f"{migration.version:>3} {status} {migration.name}")
+                for operation in migration.operations:
+                    print(f"      {operation}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MySQL 表结构迁移")
+    parser.add_argument("--migrate", action="store_true", help="执行待应用的迁移")
+    parser.add_argument("--explain", action="store_true", help="检查热点查询的执行计划")
+    logging.basicConfig(level=logging.INFO)
+    main(parser.parse_args())
@@ -0,0 +1,210 @@
+"""按 token 预算组装提示词中的参考知识和会话记忆
+
+- 用模型自身的分词器计数（只加载词表），分块 token 数在建索引时按内容哈希计算并持久化
+- 参考知识按检索排序（重排分数降序）依次放入，去掉被已选分块包含的分块以及相邻分块的重叠部分，
+  放不下的分块按剩余预算截断或丢弃
+- 会话记忆从最新一条往前按 token 计入，单条消息也按 token 截断
+- 记录每次请求的提示词 token 数，预填充开销可控、可观测
+"""
+import os
+import json
+import logging
+import threading
+from collections import deque
+import numpy as np
+from llama_cpp import Llama
+from constants import (LLM_MODEL_NAME, MAX_SEQ_LENGTH, MAX_NEW_TOKENS, PROMPT_CONTEXT_TOKENS, PROMPT_HISTORY_TOKENS,
+                       PROMPT_HISTORY_MESSAGE_TOKENS, PROMPT_MIN_CHUNK_TOKENS, PROMPT_MIN_OVERLAP_CHARS,
+                       PROMPT_TOKEN_CACHE_PATH)
+from chunk_store import compute_content_hash
+
+
+def overlap_length(left, right, min_overlap):
+    """left 的后缀与 right 的前缀重合的最大长度（不足 min_overlap 时返回 0）"""
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    probe = right[:min_overlap]
+    start = left.find(probe, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+def remove_overlap(selected, text, min_overlap=PROMPT_MIN_OVERLAP_CHARS):
+    """去掉 text 中与已选分块重叠的首尾部分；被已选分块完整包含时返回空串"""
+    for other in selected:
+        if text in other:
+            return ""
+        head = overlap_length(other, text, min_overlap)
+        if head:
+            text = text[head:]
+        tail = overlap_length(text, other, min_overlap)
+        if tail:
+            text = text[:-tail]
+    return text.strip()
+
+
+class PromptPacker:
+    """提示词 token 预算器：prompt_budget = n_ctx - 最大生成长度"""
+
+    def __init__(self, model_path=LLM_MODEL_NAME, n_ctx=MAX_SEQ_LENGTH, max_new_tokens=MAX_NEW_TOKENS,
+                 context_tokens=PROMPT_CONTEXT_TOKENS, history_tokens=PROMPT_HISTORY_TOKENS,
+                 message_tokens=PROMPT_HISTORY_MESSAGE_TOKENS, min_chunk_tokens=PROMPT_MIN_CHUNK_TOKENS,
+                 cache_path=PROMPT_TOKEN_CACHE_PATH):
+        self.vocab = Llama(model_path=model_path, vocab_only=True, verbose=False)
+        self.prompt_budget = n_ctx - max_new_tokens
+        self.context_tokens = context_tokens
+        self.history_tokens = history_tokens
+        self.message_tokens = message_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._counts = {}  # 分块内容哈希 -> token 数
+        self._prompt_tokens = deque(maxlen=1000)
+        self.requests = 0
+        self.chunks_packed = 0
+        self.chunks_truncated = 0
+        self.chunks_deduped = 0
+        self.chunks_dropped = 0
+        self._load()
+
+    # ---- 分词 ----
+
+    def tokenize(self, text):
+        return self.vocab.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+    def count(self, text):
+        return len(self.tokenize(text)) if text else 0
+
+    def truncate(self, text, max_tokens):
+        """按 token 截断文本，返回 (截断后的文本, token 数)"""
+        tokens = self.tokenize(text)
+        if len(tokens) <= max_tokens:
+            return text, len(tokens)
+        return self.vocab.detokenize(tokens[:max_tokens]).decode("utf-8", errors="ignore"), max_tokens
+
+    def chunk_tokens(self, doc):
+        """分块 token 数（按内容哈希缓存；没有内容哈希的分块，如压缩后的分块，直接计数）"""
+        content_hash = doc.metadata.get("content_hash")
+        if content_hash is None:
+            return self.count(doc.page_content)
+        with self._lock:
+            n_tokens = self._counts.get(content_hash)
+        if n_tokens is None:
+            n_tokens = self.count(doc.page_content)
+            with self._lock:
+                self._counts[content_hash] = n_tokens
+        return n_tokens
+
+    def index_chunks(self, chunks):
+        """建索引时预先计算分块 token 数，新增的计数持久化"""
+        for chunk in chunks:
+            chunk.metadata.setdefault("content_hash", compute_content_hash(chunk.page_content))
+        missing = [chunk for chunk in chunks if chunk.metadata["content_hash"] not in self._counts]
+        for chunk in missing:
+            self.chunk_tokens(chunk)
+        if missing:
+            self._save()
+            logging.info(f"分块 token 计数完成：新增 {len(missing)} 个，共 {len(self._counts)} 个")
+
+    # ---- 组装 ----
+
+    def pack_context(self, contexts, budget):
+        """按检索排序在 budget 内放入参考知识，返回 (文本, token 数)"""
+        budget = min(budget, self.context_tokens)
+        selected = []
+        used = 0
+        packed = truncated = deduped = dropped = 0
+        for doc in contexts:
+            remaining = budget - used
+            if remaining < self.min_chunk_tokens:
+                dropped += 1
+                continue
+            text = remove_overlap(selected, doc.page_content.strip())
+            if not text:
+                deduped += 1
+                continue
+            n_tokens = self.chunk_tokens(doc) if text == doc.page_content.strip() else self.count(text)
+            if n_tokens > remaining:
+                text, n_tokens = self.truncate(text, remaining)
+                truncated += 1
+            selected.append(text)
+            used += n_tokens
+            packed += 1
+        with self._lock:
+            self.chunks_packed += packed
+            self.chunks_truncated += truncated
+            self.chunks_deduped += deduped
+            self.chunks_dropped += dropped
+        if not selected:
+            return "无相关参考", 0
+        return "\n".join(selected), used
+
+    def pack_history(self, history, budget):
+        """从最新一条往前按 token 放入会话记忆，返回 ([条目], token 数)"""
+        budget = min(budget, self.history_tokens)
+        entries = []
+        used = 0
+        for msg in reversed(history):
+            role = "用户" if msg["role"] == "user" else "助手"
+            content, n_tokens = self.truncate(msg["content"], self.message_tokens)
+            entry = f"{role}：{content}"
+            n_tokens += self.count(f"{role}：") + 1  # 角色前缀和换行
+            if used + n_tokens > budget:
+                break
+            entries.append(entry)
+            used += n_tokens
+        entries.reverse()
+        return entries, used
+
+    def record(self, prompt):
+        """统计一次请求的提示词 token 数并返回"""
+        n_tokens = self.count(prompt)
+        with self._lock:
+            self.requests += 1
+            self._prompt_tokens.append(n_tokens)
+        if n_tokens > self.prompt_budget:
+            logging.warning(f"提示词 {n_tokens} tokens 超出预算 {self.prompt_budget}")
+        return n_tokens
+
+    def stats(self):
+        with self._lock:
+            recent = np.array(self._prompt_tokens) if self._prompt_tokens else None
+            return {
+                "prompt_budget": self.prompt_budget,
+                "requests": self.requests,
+                "avg_prompt_tokens": float(recent.mean()) if recent is not None else 0.0,
+                "p95_prompt_tokens": float(np.percentile(recent, 95)) if recent is not None else 0.0,
+                "max_prompt_tokens": int(recent.max()) if recent is not None else 0,
+                "chunks_packed": self.chunks_packed,
+                "chunks_truncated": self.chunks_truncated,
+                "chunks_deduped": self.chunks_deduped,
+                "chunks_dropped": self.chunks_dropped,
+                "cached_chunk_counts": len(self._counts)
+            }
+
+    # ---- 持久化 ----
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        with self._lock:
+            counts = dict(self._counts)
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(counts, f)
+            os.replace(self.cache_path + ".tmp", self.cache_path)
+        except Exception as e:
+            logging.error(f"保存分块 token 计数失败: {e}")
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                self._counts = json.load(f)
+        except Exception as e:
+            logging.error(f"加载分块 token 计数失败，将重新计算: {e}")
@@ -0,0 +1,73 @@
+"""对话提示词模板
+
+固定的系统指令放在最前面，会话记忆、参考知识和问题依次在后，
+这样同类问题的提示词共享同一段前缀，推理时可以直接恢复该前缀的 KV 状态。
+多轮对话使用只追加的布局：每轮的参考知识随问题放在用户消息里，上一轮结束时的文本
+恰好是下一轮提示词的前缀，可以从上一轮保存的 KV 状态继续，只预填充新的一轮。
+"""
+
+MATH_INSTRUCTION = "作为数学专家，请用Markdown分步推导：1)问题分析 2)公式应用 3)计算过程 4)验证"
+CHAT_INSTRUCTION = "作为擅长交流的沟通者，请用自然语言回答，涉及公式时用LaTeX，保持口语化"
+
+SYSTEM_PREFIX = """<|system|>
+【指令】
+{instruction}
+
+【会话记忆】
+"""
+
+SYSTEM_BODY = """{history}
+
+【参考知识】
+{context}
+</s>"""
+
+USER_TEMPLATE = """<|user|>
+{question}
+</s>
+<|assistant|>
+"""
+
+
+def system_prefix(is_math):
+    return SYSTEM_PREFIX.format(instruction=MATH_INSTRUCTION if is_math else CHAT_INSTRUCTION)
+
+
+def fixed_prefixes():
+    """所有请求共享的固定前缀（数学 / 非数学两种指令）"""
+    return [system_prefix(True), system_prefix(False)]
+
+
+def build_prompt(question, history, context, is_math):
+    return (system_prefix(is_math)
+            + SYSTEM_BODY.format(history=history, context=context)
+            + USER_TEMPLATE.format(question=question))
+
+
+CONVERSATION_HEADER = """多轮对话，参考知识随每轮问题给出
+</s>
+"""
+
+TURN_TEMPLATE = """<|user|>
+【参考知识】
+{context}
+
+{question}
+</s>
+<|assistant|>
+"""
+
+
+def conversation_prefix(is_math):
+    return system_prefix(is_math) + CONVERSATION_HEADER
+
+
+def build_turn(question, context=None):
+    """一轮用户消息；重建的历史轮次没有参考知识"""
+    if context is None:
+        return USER_TEMPLATE.format(question=question)
+    return TURN_TEMPLATE.format(question=question, context=context)
+
+
+def close_turn(answer):
+    return f"{answer}\n</s>\n"
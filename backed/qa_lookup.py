@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+import numpy as np
+from constants import QA_INDEX_DIR, QA_MATCH_THRESHOLD
+
+QA_FILE_EXTENSIONS = (".json", ".jsonl")
+
+
+def normalize_question(text):
+    """问题归一化：全角转半角、小写，去掉空白和标点（保留数学运算符）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"[\s，。？！、；：,.?!;:\"'“”‘’（）()【】\[\]《》]+", "", text)
+
+
+def question_key(instruction, input_text=""):
+    return hashlib.sha1(normalize_question(f"{instruction}{input_text}").encode("utf-8")).hexdigest()
+
+
+def read_qa_items(file_path):
+    """读取 JSON / JSONL 文件中的 instruction/input/output 问答对"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        if file_path.lower().endswith(".jsonl"):
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        else:
+            records = json.load(f)
+    items = []
+    for record in records:
+        if isinstance(record, dict) and record.get("instruction") and record.get("output"):
+            items.append({
+                "instruction": record["instruction"],
+                "input": record.get("input", "") or "",
+                "output": record["output"],
+                "source": file_path
+            })
+    return items
+
+
+class QALookupIndex:
+    """知识库问答对直查索引：归一化哈希精确匹配 + 问题向量近邻匹配
+
+    问答对和向量按文件内容哈希增量维护并持久化，重启后只解析和嵌入变化的文件。
+    """
+
+    def __init__(self, embed_documents, index_dir=QA_INDEX_DIR, threshold=QA_MATCH_THRESHOLD, batch_size=256):
+        self.embed_documents = embed_documents
+        self.index_dir = index_dir
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self.items = []
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.exact = {}  # 问题哈希 -> 行号
+        self.file_hashes = {}
+        self.version = 0  # 每次同步有变化时递增，供下游缓存失效
+        self._load()
+
+    def __len__(self):
+        return len(self.items)
+
+    def sync(self, chunk_store):
+        """与分块存储的 manifest 对比，只重新解析和嵌入新增或修改的 JSON/JSONL 文件"""
+        start_time = time.time()
+        current = {}
+        for path in chunk_store.paths():
+            if path.lower().endswith(QA_FILE_EXTENSIONS):
+                current[path] = chunk_store.get_entry(path)["hash"]
+
+        keep_rows = [i for i, item in enumerate(self.items)
+                     if current.get(item["source"]) == self.file_hashes.get(item["source"])]
+        changed = [path for path, file_hash in current.items() if self.file_hashes.get(path) != file_hash]
+        if not changed and len(keep_rows) == len(self.items) and set(current) == set(self.file_hashes):
+            return
+
+        new_items = []
+        for path in changed:
+            try:
+                new_items.extend(read_qa_items(path))
+            except Exception as e:
+                logging.error(f"解析问答文件 {path} 失败: {e}")
+
+        items = [self.items[i] for i in keep_rows]
+        seen = {question_key(item["instruction"], item["input"]) for item in items}
+        unique_new = []
+        for item in new_items:
+            key = question_key(item["instruction"], item["input"])
+            if key not in seen:
+                seen.add(key)
+                unique_new.append(item)
+
+        parts = [self.embeddings[keep_rows]] if keep_rows else []
+        if unique_new:
+            parts.append(self._embed([f"{item['instruction']}{item['input']}" for item in unique_new]))
+        embeddings = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+        with self._lock:
+            self.items = items + unique_new
+            self.embeddings = embeddings
+            self.exact = {question_key(item["instruction"], item["input"]): i for i, item in enumerate(self.items)}
+            self.file_hashes = current
+            self.version += 1
+        self._save()
+        logging.info(f"问答直查索引同步完成：共 {len(self.items)} 条，新增嵌入 {len(unique_new)} 条，"
+                     f"耗时 {time.time() - start_time:.2f}s")
+
+    def _embed(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embed_documents(texts[i:i + self.batch_size]))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def match(self, question, embedding):
+        """返回 (问答对, 相似度, 匹配方式)，未命中返回 None"""
+        with self._lock:
+            row = self.exact.get(question_key(question))
+            if row is not None:
+                return self.items[row], 1.0, "exact"
+            if not len(self.items):
+                return None
+            query = np.asarray(embedding, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            similarities = self.embeddings @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return self.items[best], float(similarities[best]), "near"
+        return None
+
+    def nearest(self, embedding, k):
+        """按问题向量返回最相近的 k 条 [(问答对, 相似度, 问题向量)]，按相似度降序"""
+        with self._lock:
+            if not len(self.items):
+                return []
+            query = np.asarray(embedding, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            similarities = self.embeddings @ query
+            k = min(k, len(similarities))
+            rows = np.argpartition(-similarities, k - 1)[:k]
+            rows = rows[np.argsort(-similarities[rows])]
+            return [(self.items[row], float(similarities[row]), self.embeddings[row]) for row in rows]
+
+    def _save(self):
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            items_path = os.path.join(self.index_dir, "items.json")
+            embeddings_path = os.path.join(self.index_dir, "embeddings.npy")
+            with open(items_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"items": self.items, "file_hashes": self.file_hashes}, f, ensure_ascii=False)
+            with open(embeddings_path + ".tmp", "wb") as f:
+                np.save(f, self.embeddings)
+            os.replace(items_path + ".tmp", items_path)
+            os.replace(embeddings_path + ".tmp", embeddings_path)
+        except Exception as e:
+            logging.error(f"保存问答直查索引失败: {e}")
+
+    def _load(self):
+        items_path = os.path.join(self.index_dir, "items.json")
+        embeddings_path = os.path.join(self.index_dir, "embeddings.npy")
+        if not (os.path.exists(items_path) and os.path.exists(embeddings_path)):
+            return
+        try:
+            with open(items_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            embeddings = np.load(embeddings_path)
+            if len(embeddings) != len(data["items"]):
+                raise ValueError("问答对与向量数量不一致")
+            self.items = data["items"]
+            self.file_hashes = data["file_hashes"]
+            self.embeddings = embeddings
+            self.exact = {question_key(item["instruction"], item["input"]): i for i, item in enumerate(self.items)}
+        except Exception as e:
+            logging.error(f"加载问答直查索引失败，将重新构建: {e}")
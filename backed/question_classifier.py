@@ -0,0 +1,235 @@
+"""分层问题分类（数学问题 / 其他问题）
+
+1. 记忆化：按归一化问题缓存结果，同一轮对话的回答和相关问题生成只分类一次
+2. 关键词规则：公式、LaTeX 或多个数学关键词直接判为数学问题，寒暄类短句直接判为其他问题
+3. 逻辑回归头：在检索已计算（并缓存）的 bge 查询向量上打分，概率足够高或足够低时直接采用
+4. SeqGPT：只在前两级都没有把握时调用，其结果同时作为逻辑回归头的在线训练样本
+
+逻辑回归头的初始样本为知识库问答对的问题向量（正例）和内置的数学 / 非数学问题，
+之后每积累一批 SeqGPT 标注样本重新拟合一次，权重和样本一起持久化。
+"""
+import os
+import re
+import time
+import logging
+import threading
+import numpy as np
+from constants import (CLASSIFIER_HEAD_PATH, CLASSIFIER_CONFIDENCE, CLASSIFIER_MEMO_SIZE,
+                       CLASSIFIER_RETRAIN_EVERY, CLASSIFIER_MAX_SAMPLES)
+from retrieval_cache import LRUCache, normalize_query
+
+MATH_KEYWORDS = {
+    "方程", "函数", "导数", "积分", "矩阵", "概率",
+    "几何", "代数", "解", "证明", "公式", "计算"
+}
+
+# 公式特征：LaTeX 命令、运算式、上下标。运算数只能是数字、单个字母（未知数）或括号，
+# 不匹配单词之间的 >、= 等符号；数字之间的 - 不算运算（日期、电话号码、版本号）
+_OPERAND_LEFT = r"(?:\d|(?<![a-z])[a-z](?![a-z])|\))"
+_OPERAND_RIGHT = r"(?:-?\d|(?<![a-z])[a-z](?![a-z])|\()"
+FORMULA_PATTERN = re.compile(
+    r"\\[a-zA-Z]+|" + _OPERAND_LEFT + r"\s*[=<>≤≥^]\s*" + _OPERAND_RIGHT
+    + r"|\d\s*[+*/×÷]\s*\d|(?<![a-z])[a-z]\s*\^\s*\d|(?<![a-z])[a-z]_\{?\d"
+)
+# 匹配公式前先去掉网址和 Windows 路径（其中的 =、\ 不是公式）
+NON_FORMULA_PATTERN = re.compile(r"(?:https?://|www\.)\S+|[a-z]:\\\S*")
+
+CHITCHAT_PATTERN = re.compile(r"^(你好|您好|hi|hello|谢谢|感谢|再见|拜拜|你是谁|在吗|早上好|晚上好)[\s!！。,.，?？~]*$")
+
+SEED_MATH_QUESTIONS = [
+    "求函数的极值", "如何求矩阵的特征值", "等差数列的通项公式是什么", "二次函数的顶点坐标怎么求",
+    "什么是条件概率", "三角形内角和为什么是180度", "如何证明根号2是无理数", "求不定积分的方法有哪些",
+    "怎么判断函数的单调性", "圆的面积公式怎么推导", "什么是向量的内积", "如何求解线性方程组",
+    "泰勒展开式有什么用", "极限的定义是什么", "排列和组合有什么区别", "正态分布的期望和方差",
+]
+
+SEED_OTHER_QUESTIONS = [
+    "你好", "你是谁", "今天天气怎么样", "推荐一本好看的小说", "怎么学好英语", "帮我写一首诗",
+    "如何提高睡眠质量", "谢谢你的帮助", "周末去哪里玩比较好", "怎么和同学相处", "这个网站怎么注册账号",
+    "如何缓解考试焦虑", "讲个笑话吧", "晚饭吃什么好", "你能做什么", "怎么备份手机照片",
+]
+
+
+def keyword_rule(question):
+    """关键词规则：返回 True / False，没有把握时返回 None"""
+    text = normalize_query(question)
+    if CHITCHAT_PATTERN.match(text):
+        return False
+    if FORMULA_PATTERN.search(NON_FORMULA_PATTERN.sub(" ", text)):
+        return True
+    if sum(1 for kw in MATH_KEYWORDS if kw in text) >= 2:
+        return True
+    return None
+
+
+def _unit(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def fit_logistic(features, labels, l2=1e-3, lr=1.0, epochs=300):
+    """类别加权的 L2 逻辑回归（全量梯度下降），返回 (权重, 偏置)"""
+    labels = labels.astype(np.float32)
+    positives = max(float(labels.sum()), 1.0)
+    negatives = max(float(len(labels) - labels.sum()), 1.0)
+    sample_weights = np.where(labels > 0, 0.5 / positives, 0.5 / negatives).astype(np.float32)
+    weights = np.zeros(features.shape[1], dtype=np.float32)
+    bias = 0.0
+    for _ in range(epochs):
+        probs = 1.0 / (1.0 + np.exp(-(features @ weights + bias)))
+        grad = (probs - labels) * sample_weights
+        weights -= lr * (features.T @ grad + l2 * weights)
+        bias -= lr * float(grad.sum())
+    return weights, bias
+
+
+class QuestionClassifier:
+    """分层分类器；fallback 为 SeqGPT 分类函数，embed_query 为检索共用的带缓存查询向量函数"""
+
+    TIERS = ("memo", "rule", "head", "seqgpt")
+
+    def __init__(self, embed_query, fallback, head_path=CLASSIFIER_HEAD_PATH, confidence=CLASSIFIER_CONFIDENCE,
+                 memo_size=CLASSIFIER_MEMO_SIZE, retrain_every=CLASSIFIER_RETRAIN_EVERY,
+                 max_samples=CLASSIFIER_MAX_SAMPLES):
+        self.embed_query = embed_query
+        self.fallback = fallback
+        self.head_path = head_path
+        self.confidence = confidence
+        self.retrain_every = retrain_every
+        self.max_samples = max_samples
+        self.memo = LRUCache(memo_size)
+        self._lock = threading.Lock()
+        self.weights = None
+        self.bias = 0.0
+        self.features = np.zeros((0, 0), dtype=np.float32)
+        self.labels = np.zeros(0, dtype=np.int8)
+        self._pending = []
+        self.counts = dict.fromkeys(self.TIERS, 0)
+        self.seconds = dict.fromkeys(self.TIERS, 0.0)
+        self._load()
+
+    def bootstrap(self, positive_embeddings=None, sample_size=2000):
+        """没有已保存的权重时，用知识库问题向量和内置问题拟合初始逻辑回归头"""
+        if self.weights is not None:
+            return
+        start_time = time.time()
+        parts = [_unit([self.embed_query(q) for q in SEED_MATH_QUESTIONS]),
+                 _unit([self.embed_query(q) for q in SEED_OTHER_QUESTIONS])]
+        labels = [np.ones(len(SEED_MATH_QUESTIONS), dtype=np.int8),
+                  np.zeros(len(SEED_OTHER_QUESTIONS), dtype=np.int8)]
+        if positive_embeddings is not None and len(positive_embeddings):
+            rows = np.random.default_rng(0).permutation(len(positive_embeddings))[:sample_size]
+            parts.append(_unit(positive_embeddings[rows]))
+            labels.append(np.ones(len(rows), dtype=np.int8))
+        with self._lock:
+            self.features = np.concatenate(parts)
+            self.labels = np.concatenate(labels)
+            self._refit()
+        self._save()
+        logging.info(f"问题分类头初始化完成：{len(self.labels)} 个样本，耗时 {time.time() - start_time:.2f}s")
+
+    def classify(self, question):
+        """返回是否为数学问题"""
+        start = time.perf_counter()
+        key = normalize_query(question)
+        is_math = self.memo.get(key)
+        if is_math is not None:
+            return self._finish("memo", start, is_math)
+
+        is_math = keyword_rule(question)
+        if is_math is not None:
+            self.memo.set(key, is_math)
+            return self._finish("rule", start, is_math)
+
+        embedding = _unit(self.embed_query(question))
+        prob = self.predict_proba(embedding)
+        if prob is not None and (prob >= self.confidence or prob <= 1.0 - self.confidence):
+            is_math = prob >= self.confidence
+            self.memo.set(key, is_math)
+            return self._finish("head", start, is_math)
+
+        is_math = bool(self.fallback(question))
+        self.memo.set(key, is_math)
+        self._add_sample(embedding, is_math)
+        logging.info(f"分类头置信度不足（p={prob}），SeqGPT 判定数学问题? {is_math}")
+        return self._finish("seqgpt", start, is_math)
+
+    def predict_proba(self, embedding):
+        with self._lock:
+            if self.weights is None or len(self.weights) != len(embedding):
+                return None
+            return float(1.0 / (1.0 + np.exp(-(embedding @ self.weights + self.bias))))
+
+    def _finish(self, tier, start, is_math):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counts[tier] += 1
+            self.seconds[tier] += elapsed
+        return is_math
+
+    def _add_sample(self, embedding, is_math):
+        """记录 SeqGPT 标注样本，每积累 retrain_every 个重新拟合"""
+        with self._lock:
+            self._pending.append((embedding, int(is_math)))
+            if len(self._pending) < self.retrain_every:
+                return
+            new_features = np.stack([e for e, _ in self._pending])
+            new_labels = np.array([label for _, label in self._pending], dtype=np.int8)
+            self._pending = []
+            if len(self.features) and self.features.shape[1] == new_features.shape[1]:
+                # 保留最新的 max_samples 个样本
+                self.features = np.concatenate([self.features, new_features])[-self.max_samples:]
+                self.labels = np.concatenate([self.labels, new_labels])[-self.max_samples:]
+            else:
+                self.features, self.labels = new_features, new_labels
+            self._refit()
+        self._save()
+
+    def _refit(self):
+        if len(set(self.labels.tolist())) < 2:
+            return
+        self.weights, self.bias = fit_logistic(self.features, self.labels)
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "total": total,
+                "samples": int(len(self.labels)),
+                "tiers": {
+                    tier: {
+                        "count": self.counts[tier],
+                        "ratio": self.counts[tier] / total if total else 0.0,
+                        "avg_ms": self.seconds[tier] / self.counts[tier] * 1000 if self.counts[tier] else 0.0
+                    }
+                    for tier in self.TIERS
+                }
+            }
+
+    def _save(self):
+        if not self.head_path:
+            return
+        with self._lock:
+            if self.weights is None:
+                return
+            weights, bias, features, labels = self.weights, self.bias, self.features, self.labels
+        try:
+            os.makedirs(os.path.dirname(self.head_path), exist_ok=True)
+            with open(self.head_path + ".tmp", "wb") as f:
+                np.savez(f, weights=weights, bias=np.float32(bias), features=features, labels=labels)
+            os.replace(self.head_path + ".tmp", self.head_path)
+        except Exception as e:
+            logging.error(f"保存问题分类头失败: {e}")
+
+    def _load(self):
+        if not self.head_path or not os.path.exists(self.head_path):
+            return
+        try:
+            data = np.load(self.head_path)
+            self.weights = data["weights"]
+            self.bias = float(data["bias"])
+            self.features = data["features"]
+            self.labels = data["labels"]
+        except Exception as e:
+            logging.error(f"加载问题分类头失败，将重新初始化: {e}")
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def fuse_rankings(rankings, weights, method="rrf", rrf_k=60, top_k=None):
+    """融合多路检索结果（按分块ID去重）
+
+    rankings: 每一路为按相关度降序排列的 [(分块ID, 分数)]
+    method: "rrf" 为加权倒数排名融合，"score" 为各路分数 min-max 归一化后加权求和
+    返回按融合分数降序排列的 [(分块ID, 融合分数)]
+    """
+    id_parts, score_parts = [], []
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        ids = [chunk_id for chunk_id, _ in ranking]
+        if method == "rrf":
+            contrib = weight / (rrf_k + np.arange(1, len(ids) + 1, dtype=np.float64))
+        else:
+            scores = np.asarray([score for _, score in ranking], dtype=np.float64)
+            span = scores.max() - scores.min()
+            normalized = (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+            contrib = weight * normalized
+        id_parts.extend(ids)
+        score_parts.append(contrib)
+    if not id_parts:
+        return []
+
+    unique_ids, inverse = np.unique(np.asarray(id_parts, dtype=object), return_inverse=True)
+    fused = np.bincount(inverse, weights=np.concatenate(score_parts))
+    order = np.argsort(-fused, kind="stable")
+    if top_k is not None:
+        order = order[:top_k]
+    return [(unique_ids[i], float(fused[i])) for i in order]
@@ -0,0 +1,90 @@
+"""基于知识库问答对的相关问题推荐
+
+用检索已缓存的查询向量在问答对问题向量中取近邻候选，再用 MMR（最大边际相关）挑选
+既相关又彼此不重复的问题，结果按归一化问题缓存。整个过程只有一次矩阵乘法，不占用推理模型。
+"""
+import time
+import threading
+import numpy as np
+from constants import (RELATED_CANDIDATES, RELATED_MMR_LAMBDA, RELATED_MIN_SIMILARITY, RELATED_MAX_CHARS,
+                       RELATED_CACHE_SIZE, RELATED_CACHE_TTL, QA_MATCH_THRESHOLD)
+from qa_lookup import normalize_question
+from retrieval_cache import LRUCache, normalize_query
+
+
+def mmr_select(query, vectors, k, lambda_mult):
+    """最大边际相关选择，向量均已归一化；返回选中的行号"""
+    if not len(vectors):
+        return []
+    relevance = vectors @ query
+    redundancy = np.full(len(vectors), -np.inf, dtype=np.float32)
+    selected = []
+    for _ in range(min(k, len(vectors))):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * np.maximum(redundancy, 0.0)
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return selected
+
+
+class RelatedQuestionEngine:
+    """相关问题推荐：问答对近邻 + MMR 去冗余 + 按问题缓存"""
+
+    def __init__(self, qa_lookup, embed_query, candidates=RELATED_CANDIDATES, lambda_mult=RELATED_MMR_LAMBDA,
+                 min_similarity=RELATED_MIN_SIMILARITY, max_similarity=QA_MATCH_THRESHOLD,
+                 max_chars=RELATED_MAX_CHARS, cache_size=RELATED_CACHE_SIZE, cache_ttl=RELATED_CACHE_TTL):
+        self.qa_lookup = qa_lookup
+        self.embed_query = embed_query
+        self.candidates = candidates
+        self.lambda_mult = lambda_mult
+        self.min_similarity = min_similarity
+        self.max_similarity = max_similarity
+        self.max_chars = max_chars
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.total_ms = 0.0
+
+    def suggest(self, question, num_questions=5):
+        """返回至多 num_questions 个知识库中的相关问题（可能不足）"""
+        start = time.perf_counter()
+        key = (normalize_query(question), num_questions, self.qa_lookup.version)
+        suggestions = self.cache.get(key)
+        if suggestions is None:
+            suggestions = self._select(question, num_questions)
+            self.cache.set(key, suggestions)
+        with self._lock:
+            self.requests += 1
+            self.total_ms += (time.perf_counter() - start) * 1000
+        return list(suggestions)
+
+    def _select(self, question, num_questions):
+        query = np.asarray(self.embed_query(question), dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        # 过滤：相关度太低、与原问题（近似）重复、过长，以及彼此文本重复的候选
+        own_key = normalize_question(question)
+        seen = {own_key}
+        texts, vectors = [], []
+        for item, similarity, vector in self.qa_lookup.nearest(query, self.candidates):
+            text = f"{item['instruction']}{item['input']}".strip()
+            text_key = normalize_question(text)
+            if similarity < self.min_similarity or similarity >= self.max_similarity \
+                    or len(text) > self.max_chars or text_key in seen:
+                continue
+            seen.add(text_key)
+            texts.append(text)
+            vectors.append(vector)
+        if not texts:
+            return ()
+        rows = mmr_select(query, np.stack(vectors), num_questions, self.lambda_mult)
+        return tuple(texts[row] for row in rows)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "avg_ms": self.total_ms / self.requests if self.requests else 0.0,
+                "cache": self.cache.stats()
+            }
@@ -0,0 +1,80 @@
+import logging
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from constants import (RERANKER_MODEL_NAME, RERANK_BACKEND, RERANK_MAX_LENGTH, RERANK_BATCH_SIZE,
+                       RERANK_MAX_CANDIDATES, RERANK_ONNX_DIR)
+
+
+class RerankEngine:
+    """交叉编码器重排序引擎：按长度分桶批处理、截断输入，支持 int8 量化和 ONNX Runtime CPU 后端
+
+    backend:
+        "torch" —— 原始精度（有 GPU 时使用 GPU）
+        "int8"  —— CPU 上对 Linear 层做动态 int8 量化
+        "onnx"  —— 通过 optimum 导出并使用 ONNX Runtime CPU 推理（需安装 optimum[onnxruntime]）
+    """
+
+    def __init__(self, model_name=RERANKER_MODEL_NAME, backend=RERANK_BACKEND, max_length=RERANK_MAX_LENGTH,
+                 batch_size=RERANK_BATCH_SIZE, max_candidates=RERANK_MAX_CANDIDATES):
+        self.backend = backend
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_candidates = max_candidates
+        self.device = "cuda" if backend == "torch" and torch.cuda.is_available() else "cpu"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = self._load_model(model_name)
+        logging.info(f"重排序模型加载完成：backend={backend} device={self.device} max_length={max_length}")
+
+    def _load_model(self, model_name):
+        if self.backend == "onnx":
+            try:
+                from optimum.onnxruntime import ORTModelForSequenceClassification
+            except ImportError as e:
+                raise RuntimeError("ONNX 重排序后端需要安装 optimum[onnxruntime]") from e
+            try:
+                return ORTModelForSequenceClassification.from_pretrained(RERANK_ONNX_DIR)
+            except Exception:
+                logging.info(f"未找到已导出的 ONNX 重排序模型，开始导出到 {RERANK_ONNX_DIR}")
+                model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+                model.save_pretrained(RERANK_ONNX_DIR)
+                return model
+
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+        if self.backend == "int8":
+            return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        if self.backend != "torch":
+            raise ValueError(f"未知的重排序后端: {self.backend}")
+        return model.to(self.device)
+
+    def predict(self, query, texts):
+        """计算 (query, text) 相关度分数（sigmoid 后，与 CrossEncoder.predict 一致），按输入顺序返回"""
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        features = self.tokenizer(
+            [query] * len(texts),
+            list(texts),
+            truncation="only_second",
+            max_length=self.max_length
+        )
+        encodings = [{key: features[key][i] for key in features.keys()} for i in range(len(texts))]
+
+        # 按长度排序分桶，减少每个批次内的填充
+        order = np.argsort([len(encoding["input_ids"]) for encoding in encodings], kind="stable")
+        scores = np.zeros(len(texts), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_ids = order[start:start + self.batch_size]
+                batch = self.tokenizer.pad([encodings[i] for i in batch_ids], return_tensors="pt")
+                if self.backend == "torch":
+                    batch = batch.to(self.device)
+                logits = self.model(**batch).logits
+                scores[batch_ids] = torch.sigmoid(logits.view(-1).float()).cpu().numpy()
+        return scores
+
+    def rerank(self, query, docs):
+        """对候选文档重排序（最多 max_candidates 个），返回按分数降序的 [(文档, 分数)]"""
+        docs = docs[:self.max_candidates]
+        scores = self.predict(query, [doc.page_content for doc in docs])
+        return sorted(zip(docs, scores.tolist()), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,116 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    """问题归一化：全角转半角、去首尾空白、合并空白、英文小写"""
+    text = unicodedata.normalize("NFKC", text).strip().lower()
+    return re.sub(r"\s+", " ", text)
+
+
+class LRUCache:
+    """线程安全的 LRU + TTL 缓存，带命中率统计"""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is not self._MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+class RetrievalCache:
+    """检索三级缓存
+
+    - 归一化问题 -> 查询向量（与索引无关，不随索引版本失效）
+    - (归一化问题, 索引版本) -> 融合后的候选分块ID（索引版本变化即失效）
+    - (归一化问题, 分块ID) -> 重排序分数（分块ID由内容哈希派生，内容变化时ID随之变化）
+    """
+
+    def __init__(self, embedding_size=10000, candidate_size=5000, rerank_size=50000, ttl=3600):
+        self.embeddings = LRUCache(embedding_size, ttl)
+        self.candidates = LRUCache(candidate_size, ttl)
+        self.rerank_scores = LRUCache(rerank_size, ttl)
+        self.index_version = 0
+
+    def on_index_change(self, index_version):
+        """索引版本变化时清空候选缓存"""
+        self.index_version = index_version
+        self.candidates.clear()
+
+    def get_embedding(self, query):
+        return self.embeddings.get(normalize_query(query))
+
+    def set_embedding(self, query, embedding):
+        self.embeddings.set(normalize_query(query), embedding)
+
+    def get_candidates(self, query):
+        return self.candidates.get((normalize_query(query), self.index_version))
+
+    def set_candidates(self, query, chunk_ids, index_version):
+        """index_version 为检索开始时的索引版本；检索期间索引已更新时结果可能过期，不写入缓存"""
+        if index_version != self.index_version:
+            return
+        self.candidates.set((normalize_query(query), index_version), tuple(chunk_ids))
+
+    def get_rerank_score(self, query, chunk_id):
+        return self.rerank_scores.get((normalize_query(query), chunk_id))
+
+    def set_rerank_score(self, query, chunk_id, score):
+        self.rerank_scores.set((normalize_query(query), chunk_id), score)
+
+    def stats(self):
+        return {
+            "index_version": self.index_version,
+            "embeddings": self.embeddings.stats(),
+            "candidates": self.candidates.stats(),
+            "rerank_scores": self.rerank_scores.stats()
+        }
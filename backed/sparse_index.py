@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from array import array
+import numpy as np
+from constants import SPARSE_INDEX_DIR
+
+# LaTeX 命令、英文单词、数字、中文片段、常见数学符号
+TOKEN_PATTERN = re.compile(
+    r"\\[a-zA-Z]+|[a-zA-Z]+|\d+(?:\.\d+)?|[\u3400-\u4dbf\u4e00-\u9fff]+|[∑∫∮√∞≤≥≠±∂∇∈∉⊂⊆∪∩∀∃πθαβγδλμσφω^=<>]"
+)
+CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+
+
+def tokenize(text, for_query=False):
+    """面向中文数学文本的分词：中文按单字+双字切分，LaTeX 命令和公式符号单独成词
+
+    查询时长度大于1的中文片段只使用双字，避免高频单字带来的长倒排列表。
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if CJK_PATTERN.match(token):
+            if not for_query or len(token) == 1:
+                tokens.extend(token)
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token.lower())
+    return tokens
+
+
+class SparseIndex:
+    """可持久化、可增量更新的 BM25 稀疏索引
+
+    倒排表主体以 CSR 数组（indptr / 文档号 / 词频）存储，每批新增文档写成一个增量段，
+    删除采用墓碑标记，增量段或墓碑过多时合并压缩。
+    """
+
+    def __init__(self, index_dir=SPARSE_INDEX_DIR, k1=1.5, b=0.75, max_df_ratio=0.5):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio  # 文档频率超过该比例的词视为停用词（查询全是高频词时除外）
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()  # 串行化写盘（写文件不持有 _lock）
+        self._reset()
+        self.load()
+
+    def _reset(self):
+        self.terms = []  # 词ID -> 词
+        self.vocab = {}  # 词 -> 词ID
+        self.chunk_ids = []  # 文档号 -> 分块ID
+        self.content_hashes = []
+        self.id_to_doc = {}  # 分块ID -> 文档号
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self.n_alive = 0
+        self.total_len = 0.0
+        # 主倒排表（CSR）
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tfs = np.zeros(0, dtype=np.uint16)
+        # 增量段：每段都是一个小的 CSR 倒排表 (indptr, 文档号, 词频)
+        self.segments = []
+        self._delta_size = 0
+
+    def __len__(self):
+        return self.n_alive
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.id_to_doc
+
+    def content_hash(self, chunk_id):
+        doc = self.id_to_doc.get(chunk_id)
+        return self.content_hashes[doc] if doc is not None else None
+
+    def _ensure_capacity(self, size):
+        if size <= len(self._doc_len):
+            return
+        capacity = max(size, 2 * len(self._doc_len), 1024)
+        doc_len = np.zeros(capacity, dtype=np.float32)
+        doc_len[:len(self._doc_len)] = self._doc_len
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._doc_len, self._alive = doc_len, alive
+
+    def add_documents(self, chunks):
+        """批量添加分块（已存在的分块ID先删除再添加），新分块写入一个增量段"""
+        if not chunks:
+            return
+        with self._lock:
+            self.delete([chunk.metadata["chunk_id"] for chunk in chunks])
+            first_doc = len(self.chunk_ids)
+            self._ensure_capacity(first_doc + len(chunks))
+
+            token_terms = array("i")
+            token_docs = array("i")
+            for offset, chunk in enumerate(chunks):
+                doc = first_doc + offset
+                chunk_id = chunk.metadata["chunk_id"]
+                self.chunk_ids.append(chunk_id)
+                self.content_hashes.append(chunk.metadata.get("content_hash"))
+                self.id_to_doc[chunk_id] = doc
+
+                term_ids = [self._term_id(token) for token in tokenize(chunk.page_content)]
+                token_terms.extend(term_ids)
+                token_docs.extend([doc] * len(term_ids))
+                self._doc_len[doc] = len(term_ids)
+                self._alive[doc] = True
+                self.total_len += len(term_ids)
+                self.n_alive += 1
+
+            self.segments.append(self._build_segment(
+                np.frombuffer(token_terms, dtype=np.int32),
+                np.frombuffer(token_docs, dtype=np.int32)
+            ))
+            self._delta_size += len(self.segments[-1][1])
+            self._maybe_compact()
+
+    def _term_id(self, term):
+        term_id = self.vocab.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.vocab[term] = term_id
+            self.terms.append(term)
+        return term_id
+
+    def _build_segment(self, token_terms, token_docs):
+        """把 (词ID, 文档号) 序列聚合为按词排序的 CSR 段"""
+        n_docs = len(self.chunk_ids)
+        keys = token_terms.astype(np.int64) * n_docs + token_docs
+        keys, counts = np.unique(keys, return_counts=True)
+        terms = keys // n_docs
+        indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.terms)), out=indptr[1:])
+        return indptr, (keys % n_docs).astype(np.int32), np.minimum(counts, 65535).astype(np.uint16)
+
+    def delete(self, chunk_ids):
+        """按分块ID删除（墓碑标记）"""
+        with self._lock:
+            removed = 0
+            for chunk_id in chunk_ids:
+                doc = self.id_to_doc.pop(chunk_id, None)
+                if doc is None:
+                    continue
+                self._alive[doc] = False
+                self.total_len -= float(self._doc_len[doc])
+                self.n_alive -= 1
+                removed += 1
+            if removed:
+                self._maybe_compact()
+            return removed
+
+    def _maybe_compact(self):
+        n_docs = len(self.chunk_ids)
+        dead = n_docs - self.n_alive
+        if (len(self.segments) > 8 or self._delta_size > max(100000, len(self.post_docs) // 4)
+                or dead > max(1000, n_docs // 5)):
+            self.compact()
+
+    def compact(self):
+        """合并增量区并清除已删除文档，重建连续的 CSR 倒排表"""
+        with self._lock:
+            n_docs = len(self.chunk_ids)
+            n_terms = len(self.terms)
+            term_parts, doc_parts, tf_parts = [], [], []
+            for indptr, docs, tfs in [(self.indptr, self.post_docs, self.post_tfs)] + self.segments:
+                term_parts.append(np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr)))
+                doc_parts.append(docs)
+                tf_parts.append(tfs)
+            terms = np.concatenate(term_parts)
+            docs = np.concatenate(doc_parts)
+            tfs = np.concatenate(tf_parts)
+
+            alive = self._alive[:n_docs]
+            keep = alive[docs]
+            remap = np.cumsum(alive, dtype=np.int64) - 1
+            terms, docs, tfs = terms[keep], remap[docs[keep]].astype(np.int32), tfs[keep]
+            order = np.lexsort((docs, terms))
+
+            self.post_docs = docs[order]
+            self.post_tfs = tfs[order]
+            self.indptr = np.zeros(n_terms + 1, dtype=np.int64)
+            np.cumsum(np.bincount(terms, minlength=n_terms), out=self.indptr[1:])
+
+            alive_docs = np.flatnonzero(alive)
+            self.chunk_ids = [self.chunk_ids[i] for i in alive_docs]
+            self.content_hashes = [self.content_hashes[i] for i in alive_docs]
+            self.id_to_doc = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)}
+            self._doc_len = self._doc_len[alive_docs].copy()
+            self._alive = np.ones(len(alive_docs), dtype=bool)
+            self.n_alive = len(alive_docs)
+            self.total_len = float(self._doc_len.sum())
+            self.segments = []
+            self._delta_size = 0
+
+    def _postings(self, term_id):
+        """合并主倒排表与各增量段的倒排列表"""
+        doc_parts, tf_parts = [], []
+        for indptr, docs, tfs in [(self.indptr, self.post_docs, self.post_tfs)] + self.segments:
+            if term_id < len(indptr) - 1:
+                start, end = indptr[term_id], indptr[term_id + 1]
+                if end > start:
+                    doc_parts.append(docs[start:end])
+                    tf_parts.append(tfs[start:end])
+        if not doc_parts:
+            return self.post_docs[:0], self.post_tfs[:0]
+        if len(doc_parts) == 1:
+            return doc_parts[0], tf_parts[0]
+        return np.concatenate(doc_parts), np.concatenate(tf_parts)
+
+    def search(self, query, k=5):
+        """向量化 BM25 检索，返回 [(分块ID, 分数)]"""
+        with self._lock:
+            if self.n_alive == 0:
+                return []
+            term_ids = {self.vocab[t] for t in tokenize(query, for_query=True) if t in self.vocab}
+            if not term_ids:
+                # 双字都未命中时退回单字
+                term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+            n_docs = len(self.chunk_ids)
+            has_deleted = self.n_alive < n_docs
+            alive = self._alive[:n_docs]
+            doc_len = self._doc_len[:n_docs]
+            avgdl = self.total_len / self.n_alive
+
+            legs = []
+            for term_id in term_ids:
+                docs, tfs = self._postings(term_id)
+                if has_deleted:
+                    mask = alive[docs]
+                    docs, tfs = docs[mask], tfs[mask]
+                if len(docs):
+                    legs.append((docs, tfs))
+            if not legs:
+                return []
+            common_limit = self.max_df_ratio * self.n_alive
+            if self.n_alive >= 1000 and any(len(docs) <= common_limit for docs, _ in legs):
+                legs = [leg for leg in legs if len(leg[0]) <= common_limit]
+
+            doc_parts, score_parts = [], []
+            for docs, tfs in legs:
+                df = len(docs)
+                tfs = tfs.astype(np.float32)
+                idf = np.log(1.0 + (self.n_alive - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * doc_len[docs] / avgdl)
+                doc_parts.append(docs)
+                score_parts.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+            all_docs = np.concatenate(doc_parts)
+            all_scores = np.concatenate(score_parts)
+            if len(all_docs) * 8 > n_docs:
+                # 候选较多时直接按文档号稠密累加
+                scores = np.bincount(all_docs, weights=all_scores, minlength=n_docs)
+                candidates = np.flatnonzero(scores)
+                scores = scores[candidates]
+            else:
+                candidates, inverse = np.unique(all_docs, return_inverse=True)
+                scores = np.bincount(inverse, weights=all_scores)
+
+            k = min(k, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.chunk_ids[candidates[i]], float(scores[i])) for i in top]
+
+    def save(self):
+        """压缩后原子写入磁盘
+
+        只在持有索引锁时压缩并取出数组和列表的快照，写文件在锁外进行，期间检索和增量更新不受影响。
+        压缩后的数组不会被原地修改（增量段、墓碑和扩容都会换新数组），快照可以直接引用。
+        """
+        with self._save_lock:
+            with self._lock:
+                self.compact()
+                n_docs = len(self.chunk_ids)
+                arrays = {"indptr": self.indptr, "post_docs": self.post_docs,
+                          "post_tfs": self.post_tfs, "doc_len": self._doc_len[:n_docs]}
+                meta = {
+                    "terms": list(self.terms),
+                    "chunk_ids": list(self.chunk_ids),
+                    "content_hashes": list(self.content_hashes)
+                }
+            os.makedirs(self.index_dir, exist_ok=True)
+            postings_path = os.path.join(self.index_dir, "postings.npz")
+            meta_path = os.path.join(self.index_dir, "meta.json")
+            with open(postings_path + ".tmp", "wb") as f:
+                np.savez(f, **arrays)
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(postings_path + ".tmp", postings_path)
+            os.replace(meta_path + ".tmp", meta_path)
+
+    def load(self):
+        """从磁盘加载索引，不存在或损坏时保持为空"""
+        postings_path = os.path.join(self.index_dir, "postings.npz")
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        if not (os.path.exists(postings_path) and os.path.exists(meta_path)):
+            return False
+        start_time = time.time()
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            data = np.load(postings_path)
+            with self._lock:
+                self._reset()
+                self.terms = meta["terms"]
+                self.vocab = {term: i for i, term in enumerate(self.terms)}
+                self.chunk_ids = meta["chunk_ids"]
+                self.content_hashes = meta["content_hashes"]
+                self.id_to_doc = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)}
+                self.indptr = data["indptr"]
+                self.post_docs = data["post_docs"]
+                self.post_tfs = data["post_tfs"]
+                self._doc_len = data["doc_len"]
+                self._alive = np.ones(len(self.chunk_ids), dtype=bool)
+                self.n_alive = len(self.chunk_ids)
+                self.total_len = float(self._doc_len.sum())
+        except Exception as e:
+            logging.error(f"加载稀疏索引失败，将重新构建: {e}")
+            self._reset()
+            return False
+        logging.info(f"稀疏索引加载完成：{self.n_alive} 个分块，{len(self.terms)} 个词，耗时 {time.time() - start_time:.2f}s")
+        return True
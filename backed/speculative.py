@@ -0,0 +1,122 @@
+"""推测解码草稿模型
+
+- prompt_lookup：在提示词 + 已生成 token 以及本次检索分块全文中查找与末尾 n-gram 相同的位置，
+  取其后续 token 作为草稿。数学回答大量照抄题目和参考资料中的公式、变量和步骤，命中率高且几乎零开销
+- draft：用小 GGUF 模型贪心生成草稿，要求与主模型词表一致
+
+草稿由 llama.cpp 在一次前向中验证，输出分布不变。CountingDraftModel 统计草稿调用次数和草稿 token 数，
+用于计算接受率。
+"""
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+from constants import (LLM_SPECULATIVE_MODE, LLM_LOOKUP_NGRAM_SIZE, LLM_LOOKUP_NUM_TOKENS,
+                       LLM_DRAFT_MODEL_NAME, LLM_DRAFT_NUM_TOKENS)
+from kv_cache import common_prefix_length
+
+_EMPTY = np.array([], dtype=np.intc)
+
+
+def lookup_continuation(tokens, corpus, max_ngram_size, num_pred_tokens):
+    """在 corpus 中查找 tokens 末尾 n-gram 最近一次出现的位置，返回其后续 token（从长到短尝试 n-gram）"""
+    for n in range(min(max_ngram_size, len(tokens)), 0, -1):
+        if len(corpus) <= n:
+            continue
+        ngram = tokens[-n:]
+        windows = np.lib.stride_tricks.sliding_window_view(corpus, n)
+        matches = np.nonzero(np.all(windows == ngram, axis=1))[0]
+        # 从最近的匹配往前找，跳过后面没有 token 的匹配（即末尾 n-gram 自身）
+        for start in matches[::-1] + n:
+            if start < len(corpus):
+                return corpus[start:start + num_pred_tokens]
+    return _EMPTY
+
+
+class PromptLookupDraftModel(LlamaDraftModel):
+    """n-gram 提示词查找草稿，额外语料（检索分块全文）按请求设置"""
+
+    def __init__(self, max_ngram_size=LLM_LOOKUP_NGRAM_SIZE, num_pred_tokens=LLM_LOOKUP_NUM_TOKENS):
+        self.max_ngram_size = max_ngram_size
+        self.num_pred_tokens = num_pred_tokens
+        self.corpus = _EMPTY
+
+    def set_corpus(self, tokens):
+        self.corpus = np.asarray(tokens, dtype=np.intc) if tokens is not None else _EMPTY
+
+    def __call__(self, input_ids, /, **kwargs):
+        input_ids = np.asarray(input_ids, dtype=np.intc)
+        drafts = lookup_continuation(input_ids, input_ids, self.max_ngram_size, self.num_pred_tokens)
+        if not len(drafts) and len(self.corpus):
+            drafts = lookup_continuation(input_ids, self.corpus, self.max_ngram_size, self.num_pred_tokens)
+        return drafts
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """小 GGUF 模型贪心草稿；自身 KV 状态按公共前缀复用，只评估新增 token"""
+
+    def __init__(self, model_path, num_pred_tokens=LLM_DRAFT_NUM_TOKENS, n_threads=4, n_ctx=4096, n_gpu_layers=0):
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
+                         n_gpu_layers=n_gpu_layers, verbose=False)
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        llm = self.llm
+        tokens = np.asarray(input_ids, dtype=np.intc).tolist()
+        if len(tokens) + self.num_pred_tokens > llm.n_ctx():
+            return _EMPTY
+        # 至少重新评估最后一个 token，以取得它的 logits
+        prefix = min(common_prefix_length(llm.input_ids[:llm.n_tokens].tolist(), tokens), len(tokens) - 1)
+        llm.n_tokens = prefix
+        llm.eval(tokens[prefix:])
+        drafts = []
+        for _ in range(self.num_pred_tokens):
+            token = int(np.argmax(llm.scores[llm.n_tokens - 1]))
+            if token == llm.token_eos():
+                break
+            drafts.append(token)
+            llm.eval([token])
+        return np.array(drafts, dtype=np.intc)
+
+
+class CountingDraftModel(LlamaDraftModel):
+    """统计草稿调用次数和草稿 token 数
+
+    llama.cpp 每轮解码调用一次草稿模型并至少产出一个 token，
+    所以被接受的草稿数 = 生成 token 数 - 草稿调用次数。
+    """
+
+    def __init__(self, inner, mode):
+        self.inner = inner
+        self.mode = mode
+        self.calls = 0
+        self.proposed = 0
+
+    def set_corpus(self, tokens):
+        if hasattr(self.inner, "set_corpus"):
+            self.inner.set_corpus(tokens)
+
+    def __call__(self, input_ids, /, **kwargs):
+        drafts = self.inner(input_ids, **kwargs)
+        self.calls += 1
+        self.proposed += len(drafts)
+        return drafts
+
+
+def build_draft_model(mode=LLM_SPECULATIVE_MODE, draft_model_path=LLM_DRAFT_MODEL_NAME):
+    """按配置构建草稿模型，未启用时返回 None"""
+    if not mode:
+        return None
+    if mode == "prompt_lookup":
+        return CountingDraftModel(PromptLookupDraftModel(), mode)
+    if mode == "draft":
+        if not draft_model_path:
+            raise ValueError("draft 模式需要配置 LLM_DRAFT_MODEL_NAME")
+        return CountingDraftModel(GGUFDraftModel(draft_model_path), mode)
+    raise ValueError(f"未知的推测解码模式: {mode}")
+
+
+def check_vocab(draft_model, target):
+    """草稿模型必须与主模型共用词表"""
+    inner = getattr(draft_model, "inner", None)
+    if isinstance(inner, GGUFDraftModel) and inner.llm.n_vocab() != target.n_vocab():
+        raise ValueError(f"草稿模型词表大小 {inner.llm.n_vocab()} 与主模型 {target.n_vocab()} 不一致")
@@ -0,0 +1,110 @@
+import time
+import asyncio
+import threading
+from constants import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_BYTES
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class TokenPump:
+    """生成线程到事件循环的分块泵：生成线程只追加文本，事件循环按时间 / 大小合并成帧
+
+    - 第一帧有数据就发出，不增加首 token 延迟；之后每帧在最早的文本等满 max_latency
+      或累计满 max_bytes 时发出，事件循环每帧只被唤醒一到两次，而不是每个 token 一次
+    - 消费方（SSE 连接）慢时生成线程不阻塞，文本在缓冲区里继续合并，消费方下次取走时成为一帧
+    """
+
+    def __init__(self, loop, max_latency=STREAM_FLUSH_INTERVAL, max_bytes=STREAM_FLUSH_BYTES):
+        self.max_latency = max_latency
+        self.max_bytes = max_bytes
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._parts = []
+        self._bytes = 0
+        self._oldest_at = None
+        self._closed = False
+        self._error = None
+        self._waiter = None
+        self._waiter_bytes = 0
+        self.tokens = 0
+        self.frame_count = 0
+        self.wakeups = 0
+
+    # ---- 生成线程 ----
+
+    def push(self, text):
+        with self._lock:
+            if self._closed or not text:
+                return
+            self._parts.append(text)
+            self._bytes += len(text.encode("utf-8"))
+            self.tokens += 1
+            if self._oldest_at is None:
+                self._oldest_at = time.monotonic()
+            if self._waiter is not None and self._bytes >= self._waiter_bytes:
+                self._wake()
+
+    def close(self, error=None):
+        """生成结束（或出错）；之后的 push 被忽略"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._error = error
+            if self._waiter is not None:
+                self._wake()
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        self.wakeups += 1
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(_resolve, waiter)
+
+    # ---- 事件循环 ----
+
+    async def _wait_for(self, min_bytes, timeout=None):
+        """等到缓冲区至少有 min_bytes 字节、生成结束或超时"""
+        with self._lock:
+            if self._closed or self._bytes >= min_bytes:
+                return
+            waiter = self._loop.create_future()
+            self._waiter = waiter
+            self._waiter_bytes = min_bytes
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        finally:
+            with self._lock:
+                if self._waiter is waiter:
+                    self._waiter = None
+
+    async def frames(self):
+        """按合并策略产出文本帧"""
+        first = True
+        while True:
+            await self._wait_for(1)
+            if not first:
+                with self._lock:
+                    age = time.monotonic() - self._oldest_at if self._oldest_at is not None else 0.0
+                if age < self.max_latency:
+                    await self._wait_for(self.max_bytes, timeout=self.max_latency - age)
+            with self._lock:
+                text = "".join(self._parts)
+                self._parts.clear()
+                self._bytes = 0
+                self._oldest_at = None
+                finished = self._closed
+                error = self._error
+            if text:
+                first = False
+                self.frame_count += 1
+                yield text
+            if finished:
+                with self._lock:
+                    drained = not self._parts
+                if drained:
+                    if error is not None:
+                        raise error
+                    return
@@ -0,0 +1,307 @@
+"""问题、参考资料和消息的异步批量写入（write-behind）
+
+请求线程只把记录放进内存队列就返回，后台线程做组提交：等待 WRITE_BEHIND_FLUSH_INTERVAL 或攒够
+WRITE_BEHIND_BATCH_SIZE 条后，在一个事务里按表 executemany 写入。
+
+- 数据库不可用（连接错误）时整批落盘到问题缓存目录，定期重放，成功后删除；落盘批次重放完之前，
+  新的批次先尝试重放，仍有遗留时同样落盘，保证按入队顺序写入（参考资料依赖问题、消息 id 递增）
+- 数据本身有问题（外键、长度等）时逐条重试，仍失败的记录写入 rejected-*.json，不再重放
+- barrier() 等待此前入队的记录全部写入，读接口据此保证能读到自己刚写入的数据
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from mysql.connector import Error
+from constants import (QUESTION_CACHE_DIR, WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_BATCH_SIZE,
+                       WRITE_BEHIND_RETRY_INTERVAL)
+from database import RETRYABLE_ERRORS
+
+# 问题ID由服务端生成，重放时可能重复写入，用 ON DUPLICATE KEY 保持幂等
+INSERT_QUESTION = """
+INSERT INTO questions (id, user_id, content, conversation_id, created_at)
+VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE id = id
+"""
+DELETE_REFERENCE_FILES = "DELETE FROM reference_files WHERE question_id = %s"
+INSERT_REFERENCE_FILE = """
+INSERT INTO reference_files
+(question_id, file_name, file_path, file_type, description, similarity, source)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+INSERT_MESSAGE = "INSERT INTO messages (conversation_id, role, content, timestamp) VALUES (%s, %s, %s, %s)"
+
+SPILL_PREFIX = "writebehind-"
+REJECTED_PREFIX = "rejected-"
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class DatabaseUnavailable(Exception):
+    """连接池未建立，按连接错误处理（落盘重放）"""
+
+
+class WriteBehindQueue:
+    """后台组提交写入队列，记录为 (类型, 参数) 且可 JSON 序列化，便于落盘"""
+
+    def __init__(self, db, spill_dir=QUESTION_CACHE_DIR, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 batch_size=WRITE_BEHIND_BATCH_SIZE, retry_interval=WRITE_BEHIND_RETRY_INTERVAL):
+        self.db = db
+        self.spill_dir = spill_dir
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self._cond = threading.Condition()
+        self._pending = []
+        self._first_at = 0.0  # 队列中最早一条记录的入队时间
+        self._enqueued = 0
+        self._done = 0
+        self._flush_requested = False
+        self._stopping = False
+        self._thread = None
+        self._has_spilled = True  # 启动时可能有上次遗留的落盘批次
+        self.written = 0
+        self.flushed = 0  # 经组提交处理的记录数（不含重放）
+        self.batches = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.rejected = 0
+        self.total_flush_ms = 0.0
+
+    # ---- 入队 ----
+
+    def _enqueue(self, kind, payload):
+        with self._cond:
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.append([kind, payload])
+            self._enqueued += 1
+            self._cond.notify_all()
+
+    def enqueue_question(self, question_id, user_id, content, conversation_id=None):
+        self._enqueue("question", [question_id, user_id, content, conversation_id, _now()])
+
+    def enqueue_reference_files(self, question_id, reference_files):
+        """替换问题的参考资料（与 Database.save_reference_files 语义相同）"""
+        rows = [[
+            question_id,
+            ref.get("file_name", ""),
+            ref.get("file_path", ""),
+            ref.get("file_type", ""),
+            ref.get("description", ""),
+            float(ref.get("similarity", 0.0)),
+            ref.get("source", "local")
+        ] for ref in reference_files]
+        self._enqueue("reference_files", [question_id, rows])
+
+    def enqueue_message(self, conversation_id, role, content):
+        self._enqueue("message", [conversation_id, role, content, _now()])
+
+    def pending_count(self):
+        with self._cond:
+            return self._enqueued - self._done
+
+    def barrier(self, timeout=5.0):
+        """立即触发写入，等待此前入队的记录全部处理完（写入、落盘或拒绝）；超时返回 False"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._done < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # ---- 后台线程 ----
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """写完（或落盘）队列中的全部记录后停止"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def _next_batch(self, next_replay):
+        """等待组提交条件满足后取出一批记录；到了重放时间且队列为空时返回空批次"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._pending and (self._stopping or self._flush_requested
+                                      or len(self._pending) >= self.batch_size
+                                      or now >= self._first_at + self.flush_interval):
+                    break
+                if self._stopping or (not self._pending and now >= next_replay):
+                    return []
+                timeout = self._first_at + self.flush_interval - now if self._pending else next_replay - now
+                self._cond.wait(max(timeout, 0.001))
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            if not self._pending:
+                self._flush_requested = False
+            return batch
+
+    def _loop(self):
+        next_replay = time.monotonic()  # 启动时先重放上次遗留的落盘批次
+        while True:
+            batch = self._next_batch(next_replay)
+            if batch:
+                self._flush(batch)
+                with self._cond:
+                    self._done += len(batch)
+                    self._cond.notify_all()
+            elif self._stopping:
+                return
+            if time.monotonic() >= next_replay:
+                self.replay_spilled()
+                next_replay = time.monotonic() + self.retry_interval
+
+    # ---- 写入 ----
+
+    def _write(self, records):
+        """在一个事务中写入一组记录：先问题，再参考资料（外键依赖问题），最后消息"""
+        if self.db.pool is None:
+            raise DatabaseUnavailable("数据库连接池未建立")
+        questions, references, messages = [], {}, []
+        for kind, payload in records:
+            if kind == "question":
+                questions.append(tuple(payload))
+            elif kind == "reference_files":
+                question_id, rows = payload
+                references[question_id] = rows  # 同一问题以最后一次为准
+            elif kind == "message":
+                messages.append(tuple(payload))
+        self.db.execute_batches("write_behind", [
+            (INSERT_QUESTION, questions),
+            (DELETE_REFERENCE_FILES, [(question_id,) for question_id in references]),
+            (INSERT_REFERENCE_FILE, [tuple(row) for rows in references.values() for row in rows]),
+            (INSERT_MESSAGE, messages)
+        ])
+
+    def _write_each(self, records):
+        """整批失败且不是连接问题时逐条写入，找出有问题的记录
+
+        中途遇到连接错误时停止，返回尚未写入的记录（由调用方落盘，保持顺序）
+        """
+        for i, record in enumerate(records):
+            try:
+                self._write([record])
+                self.written += 1
+            except (DatabaseUnavailable, *RETRYABLE_ERRORS):
+                return records[i:]
+            except Error as e:
+                logging.error(f"写入记录失败，已转存为 rejected: {record[0]} {e}")
+                self._save(REJECTED_PREFIX, [record], error=str(e))
+                self.rejected += 1
+        return []
+
+    def _flush(self, records):
+        start = time.perf_counter()
+        if not self.replay_spilled():
+            # 还有更早的落盘批次没写入，新批次先写会破坏外键依赖和消息顺序
+            logging.warning(f"落盘批次尚未重放完，{len(records)} 条新记录同样落盘")
+            self._spill(records)
+        else:
+            try:
+                self._write(records)
+                self.written += len(records)
+            except (DatabaseUnavailable, *RETRYABLE_ERRORS) as e:
+                logging.warning(f"数据库不可用，{len(records)} 条记录落盘等待重放: {e}")
+                self._spill(records)
+            except Error as e:
+                logging.warning(f"批量写入失败，改为逐条写入: {e}")
+                remaining = self._write_each(records)
+                if remaining:
+                    self._spill(remaining)
+        self.flushed += len(records)
+        self.batches += 1
+        self.total_flush_ms += (time.perf_counter() - start) * 1000
+
+    def replay_spilled(self):
+        """按时间顺序重放落盘批次；遇到连接错误时停止，下次再试。全部重放完（或没有落盘批次）时返回 True"""
+        if not self._has_spilled:
+            return True
+        try:
+            names = sorted(name for name in os.listdir(self.spill_dir)
+                           if name.startswith(SPILL_PREFIX) and name.endswith(".json"))
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    records = json.load(f)["records"]
+            except Exception as e:
+                logging.error(f"读取落盘批次失败，跳过: {path} {e}")
+                continue
+            try:
+                self._write(records)
+                self.written += len(records)
+            except (DatabaseUnavailable, *RETRYABLE_ERRORS):
+                return False
+            except Error:
+                remaining = self._write_each(records)
+                if remaining:
+                    # 只保留未写入的记录，文件名不变，下次仍按原顺序重放
+                    try:
+                        self._write_file(path, remaining)
+                    except Exception as e:
+                        logging.error(f"更新落盘批次失败，已写入的记录可能被重复重放: {path} {e}")
+                    self.replayed += len(records) - len(remaining)
+                    return False
+            os.remove(path)
+            self.replayed += len(records)
+            logging.info(f"已重放落盘批次 {name}：{len(records)} 条记录")
+        self._has_spilled = False
+        return True
+
+    def _spill(self, records):
+        self._has_spilled = True
+        if self._save(SPILL_PREFIX, records):
+            self.spilled += len(records)
+
+    def _save(self, prefix, records, error=None):
+        """原子写入一个批次文件（先写临时文件再改名）"""
+        path = os.path.join(self.spill_dir, f"{prefix}{time.time_ns()}-{uuid.uuid4().hex[:8]}.json")
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._write_file(path, records, error)
+            return True
+        except Exception as e:
+            logging.error(f"记录落盘失败，{len(records)} 条记录丢失: {e}")
+            return False
+
+    def _write_file(self, path, records, error=None):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"records": records, "error": error}, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def stats(self):
+        with self._cond:
+            pending = self._enqueued - self._done
+        return {
+            "pending": pending,
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch_size": self.flushed / self.batches if self.batches else 0.0,
+            "avg_flush_ms": self.total_flush_ms / self.batches if self.batches else 0.0,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "rejected": self.rejected
+        }
@@ -30,6 +30,7 @@ CREATE TABLE `api_keys`  (
   PRIMARY KEY (`id`) USING BTREE,
   UNIQUE INDEX `api_key`(`api_key` ASC) USING BTREE,
   INDEX `user_id`(`user_id` ASC) USING BTREE,
+  INDEX `idx_user_created`(`user_id` ASC, `created_at` ASC, `api_key` ASC) USING BTREE,
   CONSTRAINT `api_keys_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE RESTRICT ON UPDATE RESTRICT
 ) ENGINE = InnoDB AUTO_INCREMENT = 73 CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = DYNAMIC;
 
@@ -43,7 +44,7 @@ CREATE TABLE `conversations`  (
   `title` varchar(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL DEFAULT NULL,
   `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`) USING BTREE,
-  INDEX `idx_user_time`(`user_id` ASC, `created_at` ASC) USING BTREE,
+  INDEX `idx_user_created`(`user_id` ASC, `created_at` ASC, `id` ASC) USING BTREE,
   CONSTRAINT `conversations_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE RESTRICT ON UPDATE RESTRICT
 ) ENGINE = InnoDB AUTO_INCREMENT = 799 CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = DYNAMIC;
 
@@ -59,7 +60,7 @@ CREATE TABLE `messages`  (
   `timestamp` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`) USING BTREE,
   INDEX `idx_conversation_time`(`conversation_id` ASC, `timestamp` ASC) USING BTREE,
-  INDEX `idx_conv_time`(`conversation_id` ASC, `timestamp` ASC) USING BTREE,
+  INDEX `idx_conversation_id`(`conversation_id` ASC, `id` ASC) USING BTREE,
   CONSTRAINT `messages_ibfk_1` FOREIGN KEY (`conversation_id`) REFERENCES `conversations` (`id`) ON DELETE RESTRICT ON UPDATE RESTRICT
 ) ENGINE = InnoDB AUTO_INCREMENT = 4667 CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = DYNAMIC;
 
@@ -95,6 +96,7 @@ CREATE TABLE `reference_files`  (
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`) USING BTREE,
   INDEX `question_id`(`question_id` ASC) USING BTREE,
+  INDEX `idx_question_similarity`(`question_id` ASC, `similarity` ASC) USING BTREE,
   CONSTRAINT `reference_files_ibfk_1` FOREIGN KEY (`question_id`) REFERENCES `questions` (`id`) ON DELETE RESTRICT ON UPDATE RESTRICT
 ) ENGINE = InnoDB AUTO_INCREMENT = 166 CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = Dynamic;
 
@@ -112,6 +114,8 @@ CREATE TABLE `user_documents`  (
   `created_at` datetime NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`) USING BTREE,
   INDEX `user_id`(`user_id` ASC) USING BTREE,
+  INDEX `idx_user_file`(`user_id` ASC, `file_name`(191) ASC) USING BTREE,
+  INDEX `idx_user_created`(`user_id` ASC, `created_at` ASC) USING BTREE,
   CONSTRAINT `user_documents_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE RESTRICT ON UPDATE RESTRICT
 ) ENGINE = InnoDB AUTO_INCREMENT = 4 CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = Dynamic;
 
@@ -130,7 +130,8 @@ export const streamingRequest = async (
   data, 
   onDataReceived,
   onComplete,
-  signal = null
+  signal = null,
+  onEvent = null
 ) => {
   const token = localStorage.getItem('token');
   let fullContent = '';
@@ -168,6 +169,22 @@ export const streamingRequest = async (
       buffer = parts.pop() || '';
 
       for (const part of parts) {
+        // 具名事件（如参考来源 sources）交给 onEvent 处理
+        if (part.startsWith('event: ')) {
+          const [eventLine, ...dataLines] = part.split('\n');
+          const eventData = dataLines
+            .filter(line => line.startsWith('data: '))
+            .map(line => line.substring(6))
+            .join('\n');
+          if (typeof onEvent === 'function' && eventData) {
+            try {
+              onEvent(eventLine.substring(7).trim(), JSON.parse(eventData));
+            } catch (e) {
+              console.error('事件解析失败:', e);
+            }
+          }
+          continue;
+        }
         if (!part.startsWith('data: ')) continue;
         
         const payload = part.substring(6).trim();